@@ -1,92 +1,123 @@
 package tobii;
 
 import java.awt.*;
+import java.io.BufferedOutputStream;
+import java.io.BufferedWriter;
+import java.io.DataInputStream;
+import java.io.EOFException;
 import java.io.File;
 import java.io.FileWriter;
 import java.io.IOException;
-import java.io.InputStream;
+import java.io.OutputStream;
 import java.net.ServerSocket;
 import java.net.Socket;
+import java.nio.ByteBuffer;
+import java.nio.ByteOrder;
+import java.nio.charset.StandardCharsets;
 import java.time.LocalDateTime;
 import java.time.format.DateTimeFormatter;
-import java.util.Objects;
 
-class ListeningToSocketThread implements Runnable {
-    private final Socket socket;
-    private final Thread otherThread;
-
-    public ListeningToSocketThread(Socket socket, Thread otherThread) {
-        this.socket = socket;
-        this.otherThread = otherThread;
+/*
+ * Stream protocol (gaze_stream.py): frames of [length (uint32, little-endian), type (1 byte), payload], the length
+ * counting the type and the payload.
+ * Python -> recorder: 'C' command (ASCII): WRITE (stream and archive to a GAZE-DATA-*.txt file), STREAM (only stream), STOP.
+ * Recorder -> Python: 'S' gaze sample (X, Y as float32 and timestamp as int64, little-endian), 'F' path of the archive
+ * file (UTF-8), 'E' end of the recording (after its last sample).
+ */
+class GazeStream {
+    static final byte COMMAND = 'C', SAMPLES = 'S', ARCHIVE = 'F', END = 'E';
+
+    private final DataInputStream input;
+    private final OutputStream output;
+
+    public GazeStream(Socket socket) throws IOException {
+        this.input = new DataInputStream(socket.getInputStream());
+        this.output = new BufferedOutputStream(socket.getOutputStream());
     }
 
-    public void run() {
-        String message = getMessageFromSocket(this.socket);
+    public synchronized void send(byte type, byte[] payload) throws IOException {
+        ByteBuffer header = ByteBuffer.allocate(5).order(ByteOrder.LITTLE_ENDIAN);
+        header.putInt(payload.length + 1);
+        header.put(type);
+        output.write(header.array());
+        output.write(payload);
+        output.flush();
+    }
 
-        if (Objects.equals(message, "STOP")) {
-            System.out.println(message);
-            otherThread.interrupt();
-            Thread.currentThread().interrupt();
-        }
+    public void sendSample(int x, int y, long timestamp) throws IOException {
+        ByteBuffer sample = ByteBuffer.allocate(16).order(ByteOrder.LITTLE_ENDIAN);
+        sample.putFloat(x);
+        sample.putFloat(y);
+        sample.putLong(timestamp);
+        send(SAMPLES, sample.array());
     }
 
-    public static String getMessageFromSocket(Socket socket) {
-        String message = null;
-        try {
-            InputStream input = socket.getInputStream();
-            byte[] buffer = new byte[1024];
-            int length = input.read(buffer);
-            message = new String(buffer, 0, length);
-        } catch (IOException e) {
-            e.printStackTrace();
+    // blocks until the next command, throws EOFException when the connection is closed
+    public String receiveCommand() throws IOException {
+        while (true) {
+            int length = Integer.reverseBytes(input.readInt());
+            byte type = input.readByte();
+            byte[] payload = new byte[length - 1];
+            input.readFully(payload);
+            if (type == COMMAND) {
+                return new String(payload, StandardCharsets.US_ASCII);
+            }
         }
-
-        return message;
     }
 }
 
 class WriteGazeDataToFile implements Runnable {
     private final double screenWidth, screenHeight;
     private final String file_name;
+    private final GazeStream stream;
 
     private final int freq = 64;
 
-    public WriteGazeDataToFile(double screenWidth, double screenHeight, String file_name) {
+    // file_name: archive file, or null to only stream the samples
+    public WriteGazeDataToFile(double screenWidth, double screenHeight, String file_name, GazeStream stream) {
         this.screenWidth = screenWidth;
         this.screenHeight = screenHeight;
         this.file_name = file_name;
+        this.stream = stream;
     }
 
     public void run() {
-        long last_nanos = System.nanoTime();
-        while (!Thread.currentThread().isInterrupted()) {
-            float[] position = Tobii.gazePosition();
-            long aux = System.nanoTime();
-            long timestamp = System.currentTimeMillis();
+        BufferedWriter writer = null;
+        try {
+            if (file_name != null) {
+                writer = new BufferedWriter(new FileWriter(file_name, true));
+            }
 
-            float xRatio = position[0];
-            float yRatio = position[1];
+            long last_nanos = System.nanoTime();
+            while (!Thread.currentThread().isInterrupted()) {
+                float[] position = Tobii.gazePosition();
+                long aux = System.nanoTime();
+                long timestamp = System.currentTimeMillis();
 
-            int xPosition = (int) (xRatio * screenWidth);
-            int yPosition = (int) (yRatio * screenHeight);
+                float xRatio = position[0];
+                float yRatio = position[1];
 
-            String message = "(" + xPosition + ", " + yPosition + ")";
-            System.out.println(message);
+                int xPosition = (int) (xRatio * screenWidth);
+                int yPosition = (int) (yRatio * screenHeight);
 
-            if (aux - last_nanos >= 1000000000 / freq) {
-                writeToFile(file_name, xPosition + "\n" + yPosition + "\n" + timestamp + "\n");
-                last_nanos = aux;
+                if (aux - last_nanos >= 1000000000 / freq) {
+                    stream.sendSample(xPosition, yPosition, timestamp);
+                    if (writer != null) {
+                        writer.write(xPosition + "\n" + yPosition + "\n" + timestamp + "\n");
+                    }
+                    last_nanos = aux;
+                }
             }
-        }
-    }
-
-    private static void writeToFile(String filename, String content) {
-        try {
-            FileWriter fw = new FileWriter(filename, true);
-            fw.write(content);
-            fw.close();
         } catch (IOException e) {
-            System.out.println("An error occurred while writing to the file: " + e.getMessage());
+            System.out.println("An error occurred while recording the gaze data: " + e.getMessage());
+        } finally {
+            if (writer != null) {
+                try {
+                    writer.close();
+                } catch (IOException e) {
+                    System.out.println("An error occurred while writing to the file: " + e.getMessage());
+                }
+            }
         }
     }
 }
@@ -110,25 +141,52 @@ public class TobiiDemo {
             double screenHeight = screenSize.getHeight();
             System.out.println("screenWidth = " + screenWidth + ", screenHeight = " + screenHeight);
 
+            // one game (persistent connection) at a time, each one with several recordings
             while (true) {
-                Socket socket = serverSocket.accept();
-                String inputFromPython = ListeningToSocketThread.getMessageFromSocket(socket);
-                if (Objects.equals(inputFromPython, "WRITE")) {
-                    String file_name = file_name_base + LocalDateTime.now().format(DateTimeFormatter.ofPattern("yyyy-MM-dd-HH-mm-ss-SSS")) + ".txt";
-                    createNewFile(file_name);
-
-                    WriteGazeDataToFile WriteGazeData = new WriteGazeDataToFile(screenWidth, screenHeight, file_name);
-                    Thread WriteGazeDataThread = new Thread(WriteGazeData);
-                    ListeningToSocketThread ListeningToSocket = new ListeningToSocketThread(socket, WriteGazeDataThread);
-                    Thread ListeningToSocketThread = new Thread(ListeningToSocket);
-
-                    ListeningToSocketThread.start();
-                    WriteGazeDataThread.start();
+                try (Socket socket = serverSocket.accept()) {
+                    serve(new GazeStream(socket), screenWidth, screenHeight);
                 }
             }
         }
     }
 
+    public static void serve(GazeStream stream, double screenWidth, double screenHeight) throws InterruptedException {
+        Thread recording = null;
+        try {
+            while (true) {
+                String command = stream.receiveCommand();
+                System.out.println(command);
+                if ((command.equals("WRITE") || command.equals("STREAM")) && recording == null) {
+                    String file_name = null;
+                    if (command.equals("WRITE")) {
+                        file_name = file_name_base + LocalDateTime.now().format(DateTimeFormatter.ofPattern("yyyy-MM-dd-HH-mm-ss-SSS")) + ".txt";
+                        createNewFile(file_name);
+                        stream.send(GazeStream.ARCHIVE, file_name.getBytes(StandardCharsets.UTF_8));
+                    }
+
+                    recording = new Thread(new WriteGazeDataToFile(screenWidth, screenHeight, file_name, stream));
+                    recording.start();
+                } else if (command.equals("STOP")) {
+                    if (recording != null) {
+                        recording.interrupt();
+                        recording.join();
+                        recording = null;
+                    }
+                    stream.send(GazeStream.END, new byte[0]);
+                }
+            }
+        } catch (EOFException e) {
+            System.out.println("Connection closed.");
+        } catch (IOException e) {
+            System.out.println("An error occurred in the connection: " + e.getMessage());
+        } finally {
+            if (recording != null) {
+                recording.interrupt();
+                recording.join();
+            }
+        }
+    }
+
     public static void createNewFile(String filename) {
         try {
             File file = new File(filename);
@@ -141,4 +199,4 @@ public class TobiiDemo {
             System.out.println("An error occurred while creating the file: " + e.getMessage());
         }
     }
-}
\ No newline at end of file
+}
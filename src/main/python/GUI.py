@@ -1,11 +1,14 @@
 import os.path
 import random
-import socket
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pygame
 
+from card_evidence import CardEvidence
 from eyetracker_data import *
+from fixations import FixationDetector
+from gaze_stream import GazeStreamReceiver
 
 # sizes
 GRID_CARDS = (7, 3)
@@ -36,14 +39,25 @@ RECT_LIST = []
 root1 = tkinter.Tk()
 os.environ['SDL_VIDEO_WINDOW_POS'] = "%d,%d" % ((root1.winfo_screenwidth() / 2) - RESOLUTION[0] / 2, (root1.winfo_screenheight() / 2) - RESOLUTION[1] / 2)
 root1.deiconify()
+# read here, as tkinter cannot be used by the processing thread
+SCREEN_SIZE = (root1.winfo_screenwidth(), root1.winfo_screenheight())
 
 # pygame window set
 pygame.init()
 screen = pygame.display.set_mode(RESOLUTION, pygame.NOFRAME)
 pygame.display.set_caption("CARD TRICK GAME")
 
-# socket communication
+# socket communication (persistent connection to the Java recorder, which streams the gaze samples)
 PORT = 1234
+RECEIVER = None
+# keep a copy of each recording in a GAZE-DATA-*.txt file (written by the recorder)
+ARCHIVE_GAZE = True
+
+# folder where the Java recorder writes the gaze data
+DATA_FOLDER = "C:\\Users\\Alexandre-Jacob\\Documents\\TESTING"
+
+# the phases are processed and exported in this thread, while the game goes on (one at a time, in order)
+PROCESSING = ThreadPoolExecutor(max_workers=1)
 
 # forms link
 # FORMS = "https://forms.gle/G5gPkFogF7DE8iaTA"
@@ -112,7 +126,109 @@ def fade(element, pos, in_or_out, time_fade, keep_bg = False):
         clock.tick(FPS)
 
 
+def gaze_receiver():
+    """
+    CONNECTION TO THE JAVA RECORDER (OPENED ONCE, KEPT FOR EVERY RECORDING)
+    :return: GazeStreamReceiver
+    """
+    global RECEIVER
+    if RECEIVER is None:
+        RECEIVER = GazeStreamReceiver('localhost', PORT)
+
+    return RECEIVER
+
+
+def track_fixations(receiver, detector, fixations, evidence=None):
+    """
+    READ THE NEW GAZE SAMPLES FROM THE RECORDER AND KEEP THE COMPLETED FIXATIONS
+    :param receiver: GazeStreamReceiver of the current recording
+    :param detector: FixationDetector
+    :param fixations: list where the completed fixations are appended
+    :param evidence: CardEvidence updated with each sample and fixation (phase one)
+    """
+    for x, y, timestamp in receiver.poll():
+        fixation = detector.push(x, y, timestamp)
+        if evidence is not None:
+            evidence.push_sample(x, y, timestamp)
+        if fixation is not None:
+            fixations.append(fixation)
+            if evidence is not None:
+                evidence.push_fixation(fixation)
+
+
+def finish_fixations(receiver, detector, fixations, evidence=None):
+    """
+    STOP THE RECORDING, READ THE LAST GAZE SAMPLES AND KEEP THE LAST FIXATION
+    THE DETECTOR IS FLUSHED AFTER THE RECORDER ENDED THE RECORDING, SO THE LAST FIXATION IS NOT CUT BY SAMPLES STILL ON
+    THEIR WAY; IF THE RECORDER DOES NOT END IT IN TIME, THE SAMPLES RECEIVED SO FAR ARE KEPT AND THE RECORDING IS
+    REPORTED AS TRUNCATED
+    :return: every gaze sample of the recording (GAZE_DTYPE)
+    """
+    try:
+        gaze = receiver.stop_recording()
+    except TimeoutError as error:
+        gaze = receiver.samples()
+        print("GAZE RECORDING TRUNCATED ({} SAMPLES RECEIVED): {}".format(len(gaze), error))
+    track_fixations(receiver, detector, fixations, evidence)
+    fixation = detector.flush()
+    if fixation is not None:
+        fixations.append(fixation)
+        if evidence is not None:
+            evidence.push_fixation(fixation)
+
+    return gaze
+
+
+def process_recording(data_type, path, gaze, timestamps, fixations):
+    """
+    PROCESS A RECORDING AND EXPORT IT TO <recording>_PHASE_ONE OR <recording>_PHASE_TWO (RUNS IN THE PROCESSING THREAD)
+    :param EyetrackerData.DataType data_type: phase of the recording
+    :param path: path of the recording (see recording_path)
+    :param gaze: gaze samples of the recording, received from the recorder
+    :param timestamps: timestamps of each card (phase two only)
+    :param fixations: fixations detected while recording
+    :return: output folder
+    """
+    phase = EyetrackerData(data_type, path, GRID_CARDS, CARD_SIZE, RESOLUTION, DISTANCE_BETWEEN_CARDS, SCREEN_SIZE, gaze)
+    phase.process_data(timestamps, fixations=fixations)
+    output_folder = os.path.splitext(path)[0] + "_" + data_type.name
+    os.makedirs(output_folder)
+    phase.export_data(output_folder)
+
+    return output_folder
+
+
+def wait_for(future):
+    """
+    WAIT FOR THE PROCESSING THREAD, KEEPING THE WINDOW RESPONSIVE
+    :param future: future of process_recording
+    :return: its result
+    """
+    clock = pygame.time.Clock()
+    while not future.done():
+        for ev in pygame.event.get():
+            if ev.type == pygame.QUIT:
+                pygame.quit()
+        clock.tick(FPS)
+
+    return future.result()
+
+
+def recording_path(receiver):
+    """
+    PATH OF THE LAST RECORDING: ITS ARCHIVE FILE (SENT BY THE RECORDER) OR, IF NOT ARCHIVED, A NAME IN DATA_FOLDER
+    """
+    if receiver.archive_path is not None:
+        return receiver.archive_path
+
+    return os.path.join(DATA_FOLDER, "GAZE-DATA-" + time.strftime("%Y-%m-%d-%H-%M-%S") + ".txt")
+
+
 def reveal_card(card_index):
+    """
+    REVEAL THE CARD WITH THE LONGEST FIXATION OF PHASE ONE
+    :param card_index: index of the card (see CardEvidence.card_with_longest_fixation)
+    """
     # clear screen
     screen.fill(BG_COLOR)
 
@@ -154,12 +270,14 @@ def show_cards_passing():
     fade(title_text, (RESOLUTION[0] / 2 - title_text.get_width() / 2, RESOLUTION[1] / 2 - title_text.get_height() / 2), 1, 1.5)
 
     '''
-    SEND MESSAGE TO JAVA (START WRITING GAZE DATA TO FILE)
+    SEND MESSAGE TO JAVA (START RECORDING THE GAZE DATA)
+    - receive the samples of the new recording and detect the fixations live
     '''
-    socket_to_java = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    socket_to_java.connect(('localhost', PORT))
-    message = "WRITE"
-    socket_to_java.sendall(message.encode())
+    receiver = gaze_receiver()
+    detector = FixationDetector(EyetrackerData.DISTANCE_THRESHOLD, EyetrackerData.DURATION_THRESHOLD)
+    fixations = list()
+
+    receiver.start_recording(ARCHIVE_GAZE)
 
     '''
     MAKE EACH CARD PASS BY THE SCREEN
@@ -190,6 +308,8 @@ def show_cards_passing():
 
             pos = (pos[0], pos[1] - ((RESOLUTION[1] + CARD_SIZE[1]) / (TIME_EACH_CARD_PASSING_SECS * FPS)))
 
+            track_fixations(receiver, detector, fixations)
+
             pygame.display.flip()
             clock.tick(FPS)
 
@@ -206,10 +326,9 @@ def show_cards_passing():
     timestamps.append(now_ms)
 
     '''
-    SEND MESSAGE TO JAVA (STOP WRITING GAZE DATA TO FILE)
+    SEND MESSAGE TO JAVA (STOP RECORDING THE GAZE DATA)
     '''
-    message = "STOP"
-    socket_to_java.sendall(message.encode())
+    gaze = finish_fixations(receiver, detector, fixations)
 
     '''
     START THE THREAD THAT WILL COLLECT THE DATA FROM THE EYE-TRACKER (PUPIL AND GAZE)
@@ -224,10 +343,15 @@ def show_cards_passing():
     thread_interface.join()
     '''
 
-    return timestamps
+    return timestamps, gaze, fixations
 
 
-def show_card_grid():
+def show_card_grid(evidence):
+    """
+    PHASE ONE: SHOW THE GRID OF CARDS WHILE THE GAZE IS RECORDED
+    :param evidence: CardEvidence updated live with the gaze samples and fixations
+    :return: tuple (gaze samples, fixations detected while recording)
+    """
     # clear screen
     screen.fill(BG_COLOR)
     pygame.display.flip()
@@ -317,17 +441,21 @@ def show_card_grid():
         clock.tick(FPS)
 
     '''
-    SEND MESSAGE TO JAVA (START WRITING GAZE DATA TO FILE)
+    SEND MESSAGE TO JAVA (START RECORDING THE GAZE DATA)
+    - receive the samples of the new recording and detect the fixations live
     '''
-    socket_to_java = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    socket_to_java.connect(('localhost', PORT))
-    message = "WRITE"
-    socket_to_java.sendall(message.encode())
+    receiver = gaze_receiver()
+    detector = FixationDetector(EyetrackerData.DISTANCE_THRESHOLD, EyetrackerData.DURATION_THRESHOLD)
+    fixations = list()
+
+    receiver.start_recording(ARCHIVE_GAZE)
 
     '''
     LOOP AFTER CARDS SHOWN
     '''
     while True:
+        track_fixations(receiver, detector, fixations, evidence)
+
         # get mouse coordinates
         mouse = pygame.mouse.get_pos()
 
@@ -356,11 +484,10 @@ def show_card_grid():
             if ev.type == pygame.MOUSEBUTTONUP and ev.button == 1:
                 if button_rect.collidepoint(ev.pos):
                     '''
-                    SEND MESSAGE TO JAVA (STOP WRITING GAZE DATA TO FILE)
+                    SEND MESSAGE TO JAVA (STOP RECORDING THE GAZE DATA)
                     '''
-                    message = "STOP"
-                    socket_to_java.sendall(message.encode())
-                    return
+                    gaze = finish_fixations(receiver, detector, fixations, evidence)
+                    return gaze, fixations
 
         pygame.display.flip()
 
@@ -629,32 +756,20 @@ def main():
                     accepted = not accepted
                     player_data = player_data_input()
 
-                    show_card_grid()
-
-                    base = "C:\\Users\\Alexandre-Jacob\\Documents\\TESTING"
-                    if not os.path.exists(base):
-                        os.makedirs(base)
-                    files = [file for file in os.listdir(base) if os.path.isfile(os.path.join(base, file))]
-                    path = files[-1]
-                    phase_one = EyetrackerData(EyetrackerData.DataType.PHASE_ONE, base + os.path.sep + path, GRID_CARDS, CARD_SIZE, RESOLUTION, DISTANCE_BETWEEN_CARDS)
-                    phase_one.process_data(None)
-                    out_1 = os.path.splitext(os.path.basename(path))[0] + "_PHASE_ONE"
-                    os.mkdir(base + os.path.sep + out_1)
-                    phase_one.export_data(base + os.path.sep + out_1)
-
-                    timestamps = show_cards_passing()
-                    files = [file for file in os.listdir(base) if os.path.isfile(os.path.join(base, file))]
-                    path = files[-1]
-                    phase_two = EyetrackerData(EyetrackerData.DataType.PHASE_TWO, base + os.path.sep + path, GRID_CARDS, CARD_SIZE, RESOLUTION, DISTANCE_BETWEEN_CARDS)
-                    phase_two.process_data(timestamps)
-                    out_2 = os.path.splitext(os.path.basename(path))[0] + "_PHASE_TWO"
-                    os.mkdir(base + os.path.sep + out_2)
-                    phase_two.export_data(base + os.path.sep + out_2)
-
-                    # READ RELEVANT DATA FROM JSON FILE
-                    with open(base + os.path.sep + out_1 + os.path.sep + "relevant_data.json", "r") as relevant_data_json:
-                        relevant_data = json.load(relevant_data_json)
-                    reveal_card(int(relevant_data["CARD_WITH_LONGEST_FIXATION"].replace("CARD_", "")) - 1)
+                    evidence = CardEvidence(screen_cards_boundaries(GRID_CARDS, CARD_SIZE, RESOLUTION, DISTANCE_BETWEEN_CARDS, SCREEN_SIZE),
+                                            GRID_CARDS, CARD_SIZE, DISTANCE_BETWEEN_CARDS)
+                    gaze_one, fixations_one = show_card_grid(evidence)
+
+                    # each phase is processed in the background, while the game goes on
+                    phase_one = PROCESSING.submit(process_recording, EyetrackerData.DataType.PHASE_ONE, recording_path(gaze_receiver()), gaze_one, None, fixations_one)
+
+                    timestamps, gaze_two, fixations_two = show_cards_passing()
+                    phase_two = PROCESSING.submit(process_recording, EyetrackerData.DataType.PHASE_TWO, recording_path(gaze_receiver()), gaze_two, timestamps, fixations_two)
+
+                    # the card is known from the live evidence, the processing is only awaited before the next game
+                    reveal_card(evidence.card_with_longest_fixation())
+                    wait_for(phase_one)
+                    wait_for(phase_two)
 
                     initial_logo()
         pygame.display.flip()
@@ -8,6 +8,9 @@ import turtle
 import numpy as np
 from PIL import Image
 
+from cards import grid_from_boundaries, label_cards
+from gaze_file import corrected_timestamps, is_pupil_binary, read_gaze_text, read_pupil_binary
+
 
 def get_file_last_alphabetical_order(path_to_folder, extension):
     """
@@ -22,17 +25,21 @@ def get_file_last_alphabetical_order(path_to_folder, extension):
 
 
 def read_file_gaze(filepath):
-    with open(filepath, "r") as file:
-        lines = file.readlines()
-
-    data = np.array([[float(lines[i].strip()), float(lines[i + 1].strip()), int(lines[i + 2].strip())]
-                     for i in range(0, len(lines), 3)],
-                    dtype=np.uint64)
+    gaze = read_gaze_text(filepath)
 
-    return data
+    return np.column_stack((gaze['X_AXIS'], gaze['Y_AXIS'], gaze['TIMESTAMP'])).astype(np.uint64)
 
 
 def read_file_gaze_pupil(filepath):
+    """
+    Reads a pupil capture file (eyetracker_connection.py) without loading it: the samples are memory-mapped.
+    Old captures (pickled list of dictionaries) are still read.
+    :return: Tuple (timestamp correction, samples: structured array (PUPIL_DTYPE) or list of dictionaries).
+    """
+    if is_pupil_binary(filepath):
+        header, samples = read_pupil_binary(filepath)
+        return header["TIMESTAMP_CORRECTION"], samples
+
     with open(filepath, "rb") as file:
         data = pickle.load(file)
 
@@ -97,30 +104,35 @@ def get_fixations(data, distance_threshold = 25, duration_threshold_ms = 100):
     return fixations_final
 
 
+def get_cards_gaze(points, rectangle_size, list_rectangles_coords_on_screen):
+    """
+    :param points: gaze points or fixations (X and Y in the first two columns)
+    :return: card number (starting at 1) of each point, -1 if the point is not on a card
+    """
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64)
+    points = np.asarray(points, dtype=np.float64)
+    origin, grid_rect, distance_between_cards = grid_from_boundaries(list_rectangles_coords_on_screen, rectangle_size)
+
+    return label_cards(points[:, 0], points[:, 1], origin, grid_rect, rectangle_size, distance_between_cards)
+
+
 def aggregate_gaze_and_visits_by_card_gaze(data, rectangle_size, list_rectangles_coords_on_screen):
     aggregated_gaze = []
     visits_rectangle = []
     for i in range(len(list_rectangles_coords_on_screen)):
         aggregated_gaze.append(list())
         visits_rectangle.append(list())
-    prev_rect = None
-    for gaze in data:
-        i = 0
-        belongs = False
-        for coords in list_rectangles_coords_on_screen:
-            if (coords[0] <= gaze[0] <= coords[0] + rectangle_size[0]) and (coords[1] <= gaze[1] <= coords[1] + rectangle_size[1]):
-                belongs = True
-                aggregated_gaze[i].append(gaze)
-                if prev_rect != coords:
-                    visits_rectangle[i].append([gaze[2], gaze[2], 0])
-                else:
-                    visits_rectangle[i][-1][1] = gaze[2]
-                    visits_rectangle[i][-1][2] = visits_rectangle[i][-1][1] - visits_rectangle[i][-1][0]
-                prev_rect = coords
-                break
-            i = i + 1
-        if not belongs:
-            prev_rect = None
+    prev_card = -1
+    for gaze, card in zip(data, get_cards_gaze(data, rectangle_size, list_rectangles_coords_on_screen).tolist()):
+        if card != -1:
+            aggregated_gaze[card - 1].append(gaze)
+            if card != prev_card:
+                visits_rectangle[card - 1].append([gaze[2], gaze[2], 0])
+            else:
+                visits_rectangle[card - 1][-1][1] = gaze[2]
+                visits_rectangle[card - 1][-1][2] = visits_rectangle[card - 1][-1][1] - visits_rectangle[card - 1][-1][0]
+        prev_card = card
 
     return aggregated_gaze, visits_rectangle
 
@@ -129,13 +141,9 @@ def aggregate_fixations_by_card_gaze(fixations, rectangle_size, list_rectangles_
     aggregated_fixations = []
     for i in range(len(list_rectangles_coords_on_screen)):
         aggregated_fixations.append(list())
-    for fixation in fixations:
-        i = 0
-        for coords in list_rectangles_coords_on_screen:
-            if (coords[0] <= fixation[0] <= coords[0] + rectangle_size[0]) and (coords[1] <= fixation[1] <= coords[1] + rectangle_size[1]):
-                aggregated_fixations[i].append(fixation)
-                break
-            i = i + 1
+    for fixation, card in zip(fixations, get_cards_gaze(fixations, rectangle_size, list_rectangles_coords_on_screen).tolist()):
+        if card != -1:
+            aggregated_fixations[card - 1].append(fixation)
 
     return aggregated_fixations
 
@@ -287,6 +295,14 @@ def visualize_data_gaze(path, gaze, fixations, relevant_data, grid_rect, rectang
 
 
 def data_by_card_period_gaze_pupil(data, time_correction, timestamps):
+    if isinstance(data, np.ndarray):
+        # structured array (see read_file_gaze_pupil): same split on the corrected timestamps (ms), into views of the
+        # (memory-mapped) samples, which keep SYSTEM_TIME_STAMP in us (corrected_timestamps gives them in ms)
+        system_time_stamps = corrected_timestamps(data, time_correction)
+        end = np.searchsorted(system_time_stamps, timestamps[-1])
+        bounds = np.concatenate(([0], np.searchsorted(system_time_stamps[:end], timestamps[1:-1]), [end]))
+        return [data[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
     aggregated_data = []
     for i in range(len(timestamps) - 1):    # last timestamp is just the end
         aggregated_data.append(list())
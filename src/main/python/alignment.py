@@ -0,0 +1,94 @@
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+
+class Alignment(Enum):
+    """
+    How a stream is brought onto the common timebase.
+    INTERPOLATE: linear interpolation between the samples around each timestamp (constant outside the stream).
+    NEAREST: value of the nearest sample.
+    ASOF: value of the last sample at or before each timestamp.
+    """
+    INTERPOLATE = 1
+    NEAREST = 2
+    ASOF = 3
+
+
+def common_timebase(start, end, rate) -> np.ndarray:
+    """
+    Regular timebase covering [start, end].
+    :param start: First timestamp (ms).
+    :param end: Last timestamp (ms).
+    :param rate: Sampling rate (Hz).
+    :return: Timestamps (ms).
+    """
+    period = 1000 / rate
+    return np.round(start + period * np.arange(int(np.floor((end - start) / period)) + 1)).astype(np.int64)
+
+
+def align_stream(timestamps, values, target, method=Alignment.INTERPOLATE, tolerance=None) -> np.ndarray:
+    """
+    Brings a stream onto the target timestamps, by binary search (no merge of the two timelines).
+    :param timestamps: Timestamps (ms) of the stream, in chronological order.
+    :param values: Values of the stream (1-D).
+    :param target: Target timestamps (ms).
+    :param Alignment method: How the values are taken from the stream.
+    :param tolerance: If not None, target timestamps farther than this (ms) from the sample used (or from both
+    samples around it, with INTERPOLATE) get NaN.
+    :return: Values (float) at the target timestamps, NaN where there is no sample.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    target = np.asarray(target, dtype=np.int64)
+    if len(timestamps) == 0:
+        return np.full(len(target), np.nan)
+
+    after = np.searchsorted(timestamps, target, side='left')
+    before = np.searchsorted(timestamps, target, side='right') - 1
+
+    if method == Alignment.INTERPOLATE:
+        aligned = np.interp(target, timestamps, values)
+        if tolerance is not None:
+            distance = np.minimum(np.abs(target - timestamps[np.clip(before, 0, len(timestamps) - 1)]),
+                                  np.abs(timestamps[np.clip(after, 0, len(timestamps) - 1)] - target))
+            aligned[distance > tolerance] = np.nan
+        return aligned
+
+    if method == Alignment.ASOF:
+        index = before
+        valid = index >= 0
+    else:
+        left = np.clip(after - 1, 0, len(timestamps) - 1)
+        right = np.clip(after, 0, len(timestamps) - 1)
+        index = np.where(np.abs(target - timestamps[left]) <= np.abs(timestamps[right] - target), left, right)
+        valid = np.ones(len(target), dtype=bool)
+
+    index = np.clip(index, 0, len(timestamps) - 1)
+    if tolerance is not None:
+        valid &= np.abs(target - timestamps[index]) <= tolerance
+
+    return np.where(valid, values[index], np.nan)
+
+
+def align_streams(target, streams, method=Alignment.INTERPOLATE, tolerance=None) -> pd.DataFrame:
+    """
+    Brings several streams onto the same timestamps.
+    :param target: Target timestamps (ms).
+    :param streams: Dictionary column name -> (timestamps (ms), values); values with one column per axis (2-D) give
+    one column per axis (<name>_x, <name>_y, <name>_z).
+    :param Alignment method: How the values are taken from each stream.
+    :param tolerance: Maximum distance (ms) to the samples used, NaN beyond it (see align_stream).
+    :return: Table with TIMESTAMP and one column per stream (one row per target timestamp).
+    """
+    aligned = {"TIMESTAMP": np.asarray(target, dtype=np.int64)}
+    for name, (timestamps, values) in streams.items():
+        values = np.asarray(values)
+        if values.ndim == 2:
+            for axis, suffix in enumerate(("_x", "_y", "_z")):
+                aligned[name + suffix] = align_stream(timestamps, values[:, axis], target, method, tolerance)
+        else:
+            aligned[name] = align_stream(timestamps, values, target, method, tolerance)
+
+    return pd.DataFrame(aligned)
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from empatica_raw_data import EmpaticaRawData
+from eyetracker_data import EyetrackerData, read_manifest
+from gaze_file import is_gaze_binary, read_gaze_binary_header
+from stage_cache import StageCache
+
+# game layout (same as GUI.py)
+GRID_CARDS = (7, 3)
+CARD_SIZE = (200, 300)
+DISTANCE_BETWEEN_CARDS = 10
+NEXT_BUTTON_PHASE_1 = 75
+RESOLUTION = (GRID_CARDS[0] * (CARD_SIZE[0] + DISTANCE_BETWEEN_CARDS) + DISTANCE_BETWEEN_CARDS, GRID_CARDS[1] * (CARD_SIZE[1] + DISTANCE_BETWEEN_CARDS) + (NEXT_BUTTON_PHASE_1 + 2 * DISTANCE_BETWEEN_CARDS))
+
+SUMMARY_COLUMNS = ['SESSION', 'STATUS', 'SECONDS', 'PHASE_ONE', 'PHASE_TWO', 'AVRO_FOLDER', 'GAZE_SAMPLES_ONE',
+                   'FIXATIONS_ONE', 'CARD_WITH_MORE_VISITS', 'CARD_WITH_LONGEST_VISIT', 'CARD_WITH_LONGEST_FIXATION',
+                   'FIGURES', 'EXECUTED_STAGES', 'ERROR']
+
+
+def find_recordings(folder):
+    """
+    Returns the gaze recordings (GAZE-DATA-*) of a folder, in chronological order (by name, as TobiiDemo.java names
+    them after the time of creation). A recording converted to the binary format (.gaze) replaces its text file.
+    """
+    recordings = dict()
+    for file in sorted(os.listdir(folder)):
+        stem, extension = os.path.splitext(file)
+        if file.startswith("GAZE-DATA-") and extension in (".txt", ".gaze") and os.path.isfile(os.path.join(folder, file)):
+            if stem not in recordings or extension == ".gaze":
+                recordings[stem] = os.path.join(folder, file)
+
+    return [recordings[stem] for stem in sorted(recordings)]
+
+
+def find_avro_folder(folder):
+    """
+    Returns the folder with the .avro files of a session: the session folder itself or its first subfolder with them.
+    """
+    for candidate in [folder] + [os.path.join(folder, name) for name in sorted(os.listdir(folder))]:
+        if os.path.isdir(candidate) and any(file.endswith(".avro") for file in os.listdir(candidate)):
+            return candidate
+
+    return None
+
+
+def recording_phase(recording):
+    """
+    Returns the phase of a recording, from its exported data (manifest, card windows or legacy export folder), or None
+    if it was not exported.
+    :return: EyetrackerData.DataType or None.
+    """
+    stem = os.path.splitext(recording)[0]
+    if os.path.isfile(stem + ".windows.json"):
+        return EyetrackerData.DataType.PHASE_TWO
+    for data_type in EyetrackerData.DataType:
+        output_folder = stem + "_" + data_type.name
+        if os.path.isfile(os.path.join(output_folder, "manifest.json")):
+            return EyetrackerData.DataType[read_manifest(output_folder)["DATA_TYPE"]]
+        if os.path.isdir(output_folder):
+            return data_type
+
+    return None
+
+
+def find_sessions(root):
+    """
+    Discovers the sessions under a folder (root itself and its subfolders). The GUI writes the recordings of every game
+    in the same folder, so the recordings of each folder are paired, in chronological order, into sessions: a recording
+    of phase one followed by the recording of phase two. The phase of an exported recording is known (see
+    recording_phase), the phase of the others is given by their position.
+    A recording left without its pair (an interrupted game or a phase two without phase one) is returned as a session
+    with an ERROR, so it is reported as a failed row.
+    :return: List of dictionaries with SESSION, PHASE_ONE, PHASE_TWO, AVRO_FOLDER (None if missing) and, for the
+    unpaired recordings, ERROR.
+    """
+    sessions = list()
+    for folder in [root] + [os.path.join(root, name) for name in sorted(os.listdir(root))]:
+        if not os.path.isdir(folder):
+            continue
+        recordings = find_recordings(folder)
+        if not recordings:
+            continue
+        avro_folder = find_avro_folder(folder)
+
+        phase_one = None
+        for recording in recordings:
+            phase = recording_phase(recording)
+            if phase_one is None:
+                if phase == EyetrackerData.DataType.PHASE_TWO:
+                    sessions.append({"SESSION": folder, "PHASE_ONE": None, "PHASE_TWO": recording,
+                                      "AVRO_FOLDER": avro_folder, "ERROR": "Recording of phase two without phase one"})
+                else:
+                    phase_one = recording
+            elif phase == EyetrackerData.DataType.PHASE_ONE:
+                sessions.append({"SESSION": folder, "PHASE_ONE": phase_one, "PHASE_TWO": None,
+                                 "AVRO_FOLDER": avro_folder, "ERROR": "Recording of phase one without phase two"})
+                phase_one = recording
+            else:
+                sessions.append({"SESSION": folder, "PHASE_ONE": phase_one, "PHASE_TWO": recording,
+                                 "AVRO_FOLDER": avro_folder})
+                phase_one = None
+        if phase_one is not None:
+            sessions.append({"SESSION": folder, "PHASE_ONE": phase_one, "PHASE_TWO": None,
+                             "AVRO_FOLDER": avro_folder, "ERROR": "Recording of phase one without phase two"})
+
+    return sessions
+
+
+def read_windows(recording):
+    """
+    Returns the card windows of a phase two recording: from <recording>.windows.json, from the manifest exported next
+    to it by the GUI (<recording>_PHASE_TWO) or, for the legacy exports, from the card sheets of
+    <recording>_PHASE_TWO/raw_gaze.xlsx (see EmpaticaRawData.load_phase).
+    """
+    stem = os.path.splitext(recording)[0]
+    output_folder = stem + "_" + EyetrackerData.DataType.PHASE_TWO.name
+    if os.path.isfile(stem + ".windows.json"):
+        with open(stem + ".windows.json", "r") as infile:
+            return json.load(infile)
+    if os.path.isfile(os.path.join(output_folder, "manifest.json")):
+        return read_manifest(output_folder)["CARD_WINDOWS"]
+    if os.path.isfile(os.path.join(output_folder, "raw_gaze.xlsx")):
+        return EmpaticaRawData.load_phase(os.path.join(output_folder, "raw_gaze.xlsx"))[1]
+
+    raise FileNotFoundError("Card windows of phase two not found for " + recording)
+
+
+def recording_screen_size(recording, screen_size):
+    """
+    Returns the screen size stored in a binary recording, or screen_size if it is not known.
+    """
+    if is_gaze_binary(recording):
+        header = read_gaze_binary_header(recording)
+        if header["SCREEN_WIDTH"] > 0 and header["SCREEN_HEIGHT"] > 0:
+            return header["SCREEN_WIDTH"], header["SCREEN_HEIGHT"]
+
+    return screen_size
+
+
+def process_phase(data_type, recording, screen_size, export_format, timestamps=None, cache=None,
+                  fixation_engine=EyetrackerData.FixationEngine.IDT):
+    """
+    Processes and exports a recording (to <recording>_PHASE_ONE or <recording>_PHASE_TWO, as the GUI).
+    """
+    phase = EyetrackerData(data_type, recording, GRID_CARDS, CARD_SIZE, RESOLUTION, DISTANCE_BETWEEN_CARDS,
+                           recording_screen_size(recording, screen_size))
+    phase.process_data(timestamps, fixation_engine, cache=cache)
+    output_folder = os.path.splitext(recording)[0] + "_" + data_type.name
+    os.makedirs(output_folder, exist_ok=True)
+    phase.export_data(output_folder, export_format)
+
+    return phase
+
+
+def process_session(session, screen_size, export_format, variables, cache_folder=None,
+                    fixation_engine=EyetrackerData.FixationEngine.IDT):
+    """
+    Processes a session: both phases of the eye-tracker data and, if there are .avro files, the Empatica signals.
+    Any error is caught and reported in the returned row, so it does not stop the other sessions.
+    :param cache_folder: Folder of the stage cache (see StageCache), None to execute every stage.
+    :param EyetrackerData.FixationEngine fixation_engine: Algorithm used for detecting fixations.
+    :return: Row of the summary table.
+    """
+    row = dict(session)
+    if session.get("ERROR") is not None:
+        row["STATUS"] = "FAILED"
+        return row
+
+    start = time.time()
+    cache = StageCache(cache_folder) if cache_folder is not None else None
+    try:
+        phase_one = process_phase(EyetrackerData.DataType.PHASE_ONE, session["PHASE_ONE"], screen_size, export_format,
+                                  cache=cache, fixation_engine=fixation_engine)
+        relevant_data = phase_one.get_relevant_data()
+        row["GAZE_SAMPLES_ONE"] = len(phase_one.raw_gaze)
+        row["FIXATIONS_ONE"] = len(phase_one.fixations)
+        for feature in ("CARD_WITH_MORE_VISITS", "CARD_WITH_LONGEST_VISIT", "CARD_WITH_LONGEST_FIXATION"):
+            row[feature] = relevant_data[feature]
+
+        if session["PHASE_TWO"] is not None:
+            phase_two = process_phase(EyetrackerData.DataType.PHASE_TWO, session["PHASE_TWO"], screen_size,
+                                      export_format, read_windows(session["PHASE_TWO"]), cache, fixation_engine)
+            if session["AVRO_FOLDER"] is not None and variables:
+                empatica = EmpaticaRawData(session["AVRO_FOLDER"], (phase_one.cards_boundaries, CARD_SIZE[0], CARD_SIZE[1]),
+                                           stage_cache=cache)
+                empatica.set_phases(phase_one, phase_two)
+                row["FIGURES"] = len(empatica.export_all(variables, workers=1))
+
+        row["STATUS"] = "OK"
+    except Exception as error:
+        row["STATUS"] = "FAILED"
+        row["ERROR"] = "".join(traceback.format_exception_only(type(error), error)).strip()
+        traceback.print_exc()
+    row["SECONDS"] = round(time.time() - start, 3)
+    if cache is not None:
+        row["EXECUTED_STAGES"] = " ".join(cache.executed)
+
+    return row
+
+
+def process_sessions(root, workers=None, screen_size=(1920, 1080), export_format=EyetrackerData.ExportFormat.NPZ,
+                     variables=(EmpaticaRawData.Variables.EDA, EmpaticaRawData.Variables.BVP), use_cache=True,
+                     fixation_engine=EyetrackerData.FixationEngine.IDT) -> pd.DataFrame:
+    """
+    Processes every session under a folder, in parallel processes, and writes the summary table (summary.csv).
+    :param root: Folder with the sessions (see find_sessions).
+    :param workers: Number of processes (default: number of CPUs).
+    :param screen_size: (WIDTH, HEIGHT) of the screen where the games were shown (unless stored in the recordings).
+    :param EyetrackerData.ExportFormat export_format: Format of the exported eye-tracker data.
+    :param variables: Empatica variables exported for each session (none to skip the Empatica data).
+    :param use_cache: Keep the output of each processing stage in root/.stage_cache, so a new run only executes the
+    stages whose inputs or parameters changed.
+    :param EyetrackerData.FixationEngine fixation_engine: Algorithm used for detecting fixations.
+    :return: Summary table, one row per session.
+    """
+    sessions = find_sessions(root)
+    cache_folder = os.path.join(root, ".stage_cache") if use_cache else None
+    rows = list()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_session, session, screen_size, export_format, variables, cache_folder,
+                                   fixation_engine)
+                   for session in sessions]
+        for session, future in zip(sessions, futures):
+            try:
+                rows.append(future.result())
+            except Exception as error:
+                # the worker process itself died
+                rows.append(dict(session, STATUS="FAILED", ERROR=repr(error)))
+
+    summary = pd.DataFrame(rows, columns=SUMMARY_COLUMNS).astype({"GAZE_SAMPLES_ONE": "Int64", "FIXATIONS_ONE": "Int64", "FIGURES": "Int64"})
+    summary.to_csv(os.path.join(root, "summary.csv"), index=False)
+
+    return summary
+
+
+def main():
+    """
+    Command line entry point: python batch.py FOLDER [--workers N] [--screen WIDTHxHEIGHT] [--format npz]
+    [--variables eda bvp] [--no-cache] [--engine idt].
+    """
+    parser = argparse.ArgumentParser(description="Processes every recorded session under a folder.")
+    parser.add_argument("folder", help="folder with one subfolder per session (GAZE-DATA-* recordings and .avro files)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: number of CPUs)")
+    parser.add_argument("--screen", default="1920x1080", help="screen size of the games, WIDTHxHEIGHT")
+    parser.add_argument("--format", default=EyetrackerData.ExportFormat.NPZ.value,
+                        choices=[export_format.value for export_format in EyetrackerData.ExportFormat],
+                        help="format of the exported eye-tracker data")
+    parser.add_argument("--variables", nargs="*", default=["eda", "bvp"],
+                        help="Empatica variables to export (none to skip the Empatica data)")
+    parser.add_argument("--engine", default="idt",
+                        choices=[engine.name.lower() for engine in EyetrackerData.FixationEngine],
+                        help="fixation detection algorithm")
+    parser.add_argument("--no-cache", action="store_true", help="execute every processing stage (no stage cache)")
+    arguments = parser.parse_args()
+
+    screen_size = tuple(int(size) for size in arguments.screen.lower().split("x"))
+    summary = process_sessions(arguments.folder, arguments.workers, screen_size,
+                               EyetrackerData.ExportFormat(arguments.format),
+                               [EmpaticaRawData.Variables(variable) for variable in arguments.variables],
+                               not arguments.no_cache, EyetrackerData.FixationEngine[arguments.engine.upper()])
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
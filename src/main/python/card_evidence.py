@@ -0,0 +1,118 @@
+from cards import label_card
+from eyetracker_data import EyetrackerData, relevant_data_from_features
+
+
+class CardEvidence:
+    """
+    Live accumulator of the features of each card (phase one): dwell time, number of visits, longest visit and longest
+    fixation, updated in O(1) for each gaze sample or fixation as it arrives, so the relevant data is known as soon as
+    the last sample is pushed (without re-reading and processing the recording).
+    The visits follow the same rules as card_visits (runs of samples on the same card, merged if apart by up to
+    visit_gap_tolerance, discarded if shorter than min_visit_duration); the last visit stays open, as it can still
+    grow, and is only counted when the features are read.
+    """
+
+    def __init__(self, cards_boundaries, grid_shape, card_dim, dist_cards,
+                 min_visit_duration=EyetrackerData.MIN_VISIT_DURATION,
+                 visit_gap_tolerance=EyetrackerData.VISIT_GAP_TOLERANCE):
+        """
+        Constructor for CardEvidence.
+        :param cards_boundaries: Top left corner (screen coordinates) of each card, row by row.
+        :param grid_shape: (COLUMNS, ROWS) of the grid.
+        :param card_dim: (WIDTH, HEIGHT) of each card.
+        :param dist_cards: Distance between cards.
+        :param min_visit_duration: Visits shorter than this (ms) are discarded.
+        :param visit_gap_tolerance: If not None, visits to the same card apart by up to this (ms) are merged.
+        """
+        self.cards_boundaries = cards_boundaries
+        self.origin = cards_boundaries[0]
+        self.grid_shape = grid_shape
+        self.card_dim = card_dim
+        self.dist_cards = dist_cards
+        self.min_visit_duration = min_visit_duration
+        self.visit_gap_tolerance = visit_gap_tolerance
+
+        cards = len(cards_boundaries)
+        self.dwell_time = [0] * cards
+        self.number_of_visits = [0] * cards
+        self.longest_visit = [float("nan")] * cards
+        self.longest_fixation = [float("nan")] * cards
+        # card of the last sample (-1 if not on a card) and the open visit (card, start, end)
+        self.last_card = -1
+        self.visit = None
+
+    def close_visit(self):
+        """
+        Counts the open visit (if it is long enough).
+        """
+        if self.visit is None:
+            return
+        card, start, end = self.visit
+        duration = end - start
+        if duration >= self.min_visit_duration:
+            self.dwell_time[card - 1] += duration
+            self.number_of_visits[card - 1] += 1
+            if not self.longest_visit[card - 1] >= duration:
+                self.longest_visit[card - 1] = duration
+        self.visit = None
+
+    def push_sample(self, x, y, timestamp):
+        """
+        Adds a gaze sample (coordinates truncated to pixels, as in EyetrackerData.get_data).
+        :param x: X coordinate of the gaze sample.
+        :param y: Y coordinate of the gaze sample.
+        :param timestamp: Timestamp (ms) of the gaze sample.
+        """
+        card = label_card(int(x), int(y), self.origin, self.grid_shape, self.card_dim, self.dist_cards)
+        if card != -1:
+            if card == self.last_card:
+                self.visit[2] = timestamp
+            elif (self.visit is not None and self.visit[0] == card and self.visit_gap_tolerance is not None and
+                  timestamp - self.visit[2] <= self.visit_gap_tolerance):
+                # back to the same card after a short gap off the cards
+                self.visit[2] = timestamp
+            else:
+                self.close_visit()
+                self.visit = [card, timestamp, timestamp]
+        self.last_card = card
+
+    def push_fixation(self, fixation):
+        """
+        Adds a fixation ([X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP], e.g. from a FixationDetector).
+        """
+        card = label_card(fixation[0], fixation[1], self.origin, self.grid_shape, self.card_dim, self.dist_cards)
+        if card != -1 and not self.longest_fixation[card - 1] >= fixation[2]:
+            self.longest_fixation[card - 1] = fixation[2]
+
+    def features(self):
+        """
+        :return: Tuple (dwell time, number of visits, longest visit, longest fixation), one list entry per card,
+        counting the open visit.
+        """
+        dwell_time = list(self.dwell_time)
+        number_of_visits = list(self.number_of_visits)
+        longest_visit = list(self.longest_visit)
+        if self.visit is not None:
+            card, start, end = self.visit
+            duration = end - start
+            if duration >= self.min_visit_duration:
+                dwell_time[card - 1] += duration
+                number_of_visits[card - 1] += 1
+                if not longest_visit[card - 1] >= duration:
+                    longest_visit[card - 1] = duration
+
+        return dwell_time, number_of_visits, longest_visit, list(self.longest_fixation)
+
+    def get_relevant_data(self) -> dict:
+        """
+        Returns the relevant data (same as EyetrackerData.get_relevant_data, for the samples pushed so far).
+        """
+        _, number_of_visits, longest_visit, longest_fixation = self.features()
+
+        return relevant_data_from_features(self.cards_boundaries, number_of_visits, longest_visit, longest_fixation)
+
+    def card_with_longest_fixation(self) -> int:
+        """
+        :return: Index (starting at 0) of the card with the longest fixation.
+        """
+        return int(self.get_relevant_data()["CARD_WITH_LONGEST_FIXATION"].replace("CARD_", "")) - 1
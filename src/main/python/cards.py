@@ -0,0 +1,196 @@
+import math
+from enum import Enum
+
+import numpy as np
+import pandas as pd
+
+VISIT_COLUMNS = ['CARD', 'START_TIMESTAMP', 'END_TIMESTAMP', 'DURATION']
+
+
+class StraddlePolicy(Enum):
+    """
+    What to do with a fixation that crosses the boundary between two card windows (phase two).
+    SPLIT: split it at the boundaries, one piece per window.
+    START: assign it to the window where it starts.
+    DROP: do not assign it to any window (CARD -1).
+    Before, the CARD column of a fixation was the window where it starts (as START, but a fixation starting exactly on
+    a boundary went to the previous card) and only the card sheets left out the straddling fixations; with DROP, their
+    CARD is -1 too.
+    """
+    SPLIT = 1
+    START = 2
+    DROP = 3
+
+
+def grid_from_boundaries(cards_boundaries, card_dim):
+    """
+    Recovers the grid layout from the top left corners of the cards.
+    :param cards_boundaries: List of (X, Y) top left corners of the cards, row by row.
+    :param card_dim: (WIDTH, HEIGHT) of each card.
+    :return: Tuple (origin, grid_shape, dist_cards).
+    """
+    xs = sorted(set(corner[0] for corner in cards_boundaries))
+    ys = sorted(set(corner[1] for corner in cards_boundaries))
+    if len(xs) > 1:
+        dist_cards = xs[1] - xs[0] - card_dim[0]
+    elif len(ys) > 1:
+        dist_cards = ys[1] - ys[0] - card_dim[1]
+    else:
+        dist_cards = 0
+
+    return (xs[0], ys[0]), (len(xs), len(ys)), dist_cards
+
+
+def label_cards(x, y, origin, grid_shape, card_dim, dist_cards) -> np.ndarray:
+    """
+    Returns the card under each gaze point, for whole arrays at once.
+    The column and row are computed by grid arithmetic, instead of testing every card: a point belongs
+    to a card if it is inside its rectangle, edges included.
+    :param x: X coordinates.
+    :param y: Y coordinates.
+    :param origin: (X, Y) top left corner of the first card.
+    :param grid_shape: (COLUMNS, ROWS) of the grid.
+    :param card_dim: (WIDTH, HEIGHT) of each card.
+    :param dist_cards: Distance between cards.
+    :return: Card number (starting at 1) of each point, -1 if the point is not on a card.
+    """
+    x = np.asarray(x, dtype=np.float64) - origin[0]
+    y = np.asarray(y, dtype=np.float64) - origin[1]
+    pitch_x = card_dim[0] + dist_cards
+    pitch_y = card_dim[1] + dist_cards
+
+    # the right/bottom edges of the last column/row are still part of the cards
+    col = np.minimum(np.floor(x / pitch_x), grid_shape[0] - 1)
+    row = np.minimum(np.floor(y / pitch_y), grid_shape[1] - 1)
+    inside = ((col >= 0) & (row >= 0) &
+              (x - col * pitch_x <= card_dim[0]) & (y - row * pitch_y <= card_dim[1]))
+
+    return np.where(inside, row * grid_shape[0] + col + 1, -1).astype(np.int64)
+
+
+def label_card(x, y, origin, grid_shape, card_dim, dist_cards) -> int:
+    """
+    Returns the card under a single gaze point, with the same grid arithmetic as label_cards (without NumPy, for
+    labeling the samples one at a time as they arrive).
+    :return: Card number (starting at 1), -1 if the point is not on a card.
+    """
+    x = float(x) - origin[0]
+    y = float(y) - origin[1]
+    pitch_x = card_dim[0] + dist_cards
+    pitch_y = card_dim[1] + dist_cards
+
+    col = min(math.floor(x / pitch_x), grid_shape[0] - 1)
+    row = min(math.floor(y / pitch_y), grid_shape[1] - 1)
+    if col < 0 or row < 0 or x - col * pitch_x > card_dim[0] or y - row * pitch_y > card_dim[1]:
+        return -1
+
+    return row * grid_shape[0] + col + 1
+
+
+def card_visits(cards, timestamps, min_duration=0, max_gap=None) -> pd.DataFrame:
+    """
+    Splits the sequence of labeled gaze samples into visits (consecutive samples on the same card),
+    by run-length encoding of the card labels.
+    :param cards: Card number of each gaze sample (-1 if not on a card), in chronological order.
+    :param timestamps: Timestamp (ms) of each gaze sample.
+    :param min_duration: Visits shorter than this (ms) are discarded.
+    :param max_gap: If not None, consecutive visits to the same card separated by at most this (ms) off
+    the cards are merged into one visit.
+    :return: One row per visit (CARD, START_TIMESTAMP, END_TIMESTAMP, DURATION), in chronological order.
+    """
+    cards = np.asarray(cards, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(cards) == 0:
+        return pd.DataFrame({column: np.empty(0, dtype=np.int64) for column in VISIT_COLUMNS})
+
+    # runs of equal labels, ignoring the ones off the cards
+    change_points = np.flatnonzero(np.diff(cards)) + 1
+    starts = np.concatenate(([0], change_points))
+    ends = np.append(change_points, len(cards)) - 1
+    on_card = cards[starts] != -1
+    visits_cards = cards[starts][on_card]
+    start_timestamps = timestamps[starts][on_card]
+    end_timestamps = timestamps[ends][on_card]
+
+    if max_gap is not None and len(visits_cards) > 1:
+        merge = np.zeros(len(visits_cards), dtype=bool)
+        merge[1:] = ((visits_cards[1:] == visits_cards[:-1]) &
+                     (start_timestamps[1:] - end_timestamps[:-1] <= max_gap))
+        first = np.flatnonzero(~merge)
+        visits_cards = visits_cards[first]
+        start_timestamps = start_timestamps[first]
+        end_timestamps = np.maximum.reduceat(end_timestamps, first)
+
+    durations = end_timestamps - start_timestamps
+    keep = durations >= min_duration
+
+    return pd.DataFrame({'CARD': visits_cards[keep], 'START_TIMESTAMP': start_timestamps[keep],
+                         'END_TIMESTAMP': end_timestamps[keep], 'DURATION': durations[keep]},
+                        columns=VISIT_COLUMNS)
+
+
+def label_windows(timestamps, windows) -> np.ndarray:
+    """
+    Returns the card window (phase two) of each timestamp, by binary search over the window starts.
+    Card i is shown during [windows[i - 1], windows[i]).
+    Before, a timestamp was in card i up to windows[i] included, the timestamps before the first window were in card 1
+    and the ones after the last window in the last card; they are -1 now.
+    :param timestamps: Timestamps (ms).
+    :param windows: Timestamps of each card first appearance, followed by the end of the last one.
+    :return: Card number (starting at 1) of each timestamp, -1 if it is outside all windows.
+    """
+    windows = np.asarray(windows, dtype=np.int64)
+    cards = np.searchsorted(windows, np.asarray(timestamps, dtype=np.int64), side='right')
+
+    return np.where((cards >= 1) & (cards < len(windows)), cards, -1).astype(np.int64)
+
+
+def label_fixations_windows(fixations, windows, policy=StraddlePolicy.DROP) -> pd.DataFrame:
+    """
+    Assigns fixations to card windows (phase two).
+    :param fixations: Fixations (X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP).
+    :param windows: Timestamps of each card first appearance, followed by the end of the last one.
+    :param StraddlePolicy policy: What to do with the fixations crossing a window boundary (with the default, DROP,
+    their CARD is -1, see StraddlePolicy).
+    :return: Copy of the fixations with a CARD column (-1 if not assigned); with SPLIT, a fixation crossing
+    boundaries becomes one row per window, with the same centroid and the start, end and duration clipped.
+    """
+    windows = np.asarray(windows, dtype=np.int64)
+    number_windows = len(windows) - 1
+    start = fixations['START_TIMESTAMP'].to_numpy(dtype=np.int64)
+    end = fixations['END_TIMESTAMP'].to_numpy(dtype=np.int64)
+    first = np.searchsorted(windows, start, side='right') - 1
+    valid = (first >= 0) & (first < number_windows)
+
+    if policy == StraddlePolicy.START:
+        fixations = fixations.copy()
+        fixations['CARD'] = np.where(valid, first + 1, -1)
+        return fixations
+
+    if policy == StraddlePolicy.DROP:
+        last = np.searchsorted(windows, end, side='right') - 1
+        fixations = fixations.copy()
+        fixations['CARD'] = np.where(valid & (first == last), first + 1, -1)
+        return fixations
+
+    # SPLIT (a fixation ending exactly on a boundary does not reach the next window)
+    last = np.maximum(np.searchsorted(windows, end, side='left') - 1, first)
+    first = np.maximum(first, 0)
+    last = np.minimum(last, number_windows - 1)
+    outside = first > last
+    pieces = np.where(outside, 1, last - first + 1)
+
+    rows = np.repeat(np.arange(len(fixations)), pieces)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    window = first[rows] + offsets
+    outside = outside[rows]
+    split = fixations.iloc[rows].reset_index(drop=True)
+    clipped_window = np.clip(window, 0, number_windows - 1)
+    split_start = np.where(outside, start[rows], np.maximum(start[rows], windows[clipped_window]))
+    split_end = np.where(outside, end[rows], np.minimum(end[rows], windows[clipped_window + 1]))
+    split['START_TIMESTAMP'] = split_start
+    split['END_TIMESTAMP'] = split_end
+    split['DURATION'] = split_end - split_start
+    split['CARD'] = np.where(outside, -1, window + 1)
+
+    return split
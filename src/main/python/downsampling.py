@@ -0,0 +1,93 @@
+from enum import Enum
+
+import numpy as np
+
+
+class Downsampling(Enum):
+    """
+    How a trace is reduced before being plotted.
+    NONE: every sample is plotted.
+    MINMAX: minimum and maximum of each bucket of consecutive samples (keeps every spike).
+    LTTB: Largest-Triangle-Three-Buckets, one sample per bucket (keeps the visual shape).
+    """
+    NONE = 1
+    MINMAX = 2
+    LTTB = 3
+
+
+def bucket_bounds(length, buckets) -> np.ndarray:
+    """
+    :return: First index of each of the buckets of (almost) the same size, followed by length.
+    """
+    return np.linspace(0, length, buckets + 1).astype(np.int64)
+
+
+def minmax_indices(values, buckets) -> np.ndarray:
+    """
+    Indices of the minimum and of the maximum of each bucket.
+    :param values: Values of the trace.
+    :param buckets: Number of buckets (up to 2 points each).
+    :return: Sorted indices.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    width = int(np.ceil(len(values) / buckets))
+    padded = np.full(buckets * width, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, width)
+    valid = ~np.all(np.isnan(padded), axis=1)
+    padded = padded[valid]
+    offsets = np.flatnonzero(valid) * width
+
+    return np.unique(np.concatenate((offsets + np.nanargmin(padded, axis=1), offsets + np.nanargmax(padded, axis=1))))
+
+
+def lttb_indices(x, y, points) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: the first and last samples, plus the sample of each bucket forming the largest
+    triangle with the previous selected sample and the average of the next bucket.
+    :param x: X of the trace (e.g. timestamps).
+    :param y: Values of the trace.
+    :param points: Number of points (at least 3).
+    :return: Sorted indices.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bounds = bucket_bounds(len(x) - 2, points - 2) + 1
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = len(x) - 1
+    for bucket in range(points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        next_end = bounds[bucket + 2] if bucket + 2 < len(bounds) else len(x)
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        previous = indices[bucket]
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (average_y - y[previous]))
+        indices[bucket + 1] = start + np.argmax(areas)
+
+    return indices
+
+
+def downsample_indices(x, y, points, method=Downsampling.MINMAX, keep=None) -> np.ndarray:
+    """
+    Reduces a trace to about a number of points, independently of its length.
+    :param x: X of the trace (e.g. timestamps).
+    :param y: Values of the trace.
+    :param points: Number of points (e.g. two per pixel column, with MINMAX).
+    :param Downsampling method: How the trace is reduced.
+    :param keep: Indices that are always kept (e.g. global maximum, peaks).
+    :return: Sorted indices of the samples to plot.
+    """
+    if method == Downsampling.NONE or len(y) <= points:
+        return np.arange(len(y))
+
+    if method == Downsampling.MINMAX:
+        indices = minmax_indices(y, max(points // 2, 1))
+    else:
+        indices = lttb_indices(x, y, max(points, 3))
+
+    if keep is not None:
+        indices = np.union1d(indices, np.asarray(keep, dtype=np.int64))
+
+    return indices
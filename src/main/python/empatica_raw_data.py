@@ -1,4 +1,8 @@
+import copy
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import json
+import math
 import os
 import tkinter
 import numpy as np
@@ -6,14 +10,278 @@ from enum import Enum
 
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import pandas as pd
 from avro.datafile import DataFileReader
 from avro.io import DatumReader
+from avro.schema import parse
 
 from scipy.signal import find_peaks
 
+from alignment import Alignment, align_streams, common_timebase
+from downsampling import Downsampling, downsample_indices
+from cards import grid_from_boundaries, label_cards, label_windows
+from eyetracker_data import EyetrackerData, markers_from_tables, read_manifest, read_table, read_tables
+from stage_cache import arrays_digest
+
 pd.options.display.float_format = '{:.10f}'.format
 
+# rawData signals with x, y, z values (and imuParams to convert them to physical units)
+IMU_SIGNALS = ("accelerometer", "gyroscope")
+# rawData signals with a list of event times: field and its units per us
+EVENT_SIGNALS = {"tags": ("tagsTimeMicros", 1), "systolicPeaks": ("peaksTimeNanos", 1000)}
+
+
+def projection_schema(writers_schema, signals, fields):
+    """
+    Builds a readers schema with only some fields of some rawData signals, so the Avro reader skips the rest
+    instead of decoding it.
+    :param dict writers_schema: Schema of the .avro file.
+    :param signals: Names of the rawData signals to keep (e.g. 'eda').
+    :param fields: Names of the fields of each signal to keep (e.g. 'timestampStart').
+    :return: Readers schema.
+    """
+    # named types defined by the dropped fields may be referenced by the kept ones
+    definitions = dict()
+
+    def find_definitions(schema_type):
+        if isinstance(schema_type, dict):
+            if schema_type.get("type") == "record":
+                definitions[schema_type["name"]] = schema_type
+                for field in schema_type["fields"]:
+                    find_definitions(field["type"])
+            elif "items" in schema_type:
+                find_definitions(schema_type["items"])
+        elif isinstance(schema_type, list):
+            for option in schema_type:
+                find_definitions(option)
+
+    find_definitions(writers_schema)
+
+    schema = copy.deepcopy(writers_schema)
+    schema["fields"] = [field for field in schema["fields"] if field["name"] == "rawData"]
+    raw_data = schema["fields"][0]["type"]
+    raw_data["fields"] = [field for field in raw_data["fields"] if field["name"] in signals]
+    defined = set()
+
+    def inline(schema_type):
+        if isinstance(schema_type, str):
+            name = schema_type.split(".")[-1]
+            if name not in definitions or name in defined:
+                return schema_type
+            schema_type = copy.deepcopy(definitions[name])
+        if isinstance(schema_type, dict):
+            if schema_type.get("type") == "record":
+                defined.add(schema_type["name"])
+                for field in schema_type["fields"]:
+                    field["type"] = inline(field["type"])
+            elif "items" in schema_type:
+                schema_type["items"] = inline(schema_type["items"])
+        elif isinstance(schema_type, list):
+            schema_type = [inline(option) for option in schema_type]
+        return schema_type
+
+    for field in raw_data["fields"]:
+        field["type"] = inline(field["type"])
+        field["type"]["fields"] = [signal_field for signal_field in field["type"]["fields"] if signal_field["name"] in fields]
+
+    return parse(json.dumps(schema))
+
+
+def timed_signals(signals):
+    """
+    :param signals: Names of the rawData signals (e.g. 'eda').
+    :return: Names of the signals with a timestampStart (event signals have none, but all the signals of a record
+    start together, so EDA is used for them).
+    """
+    return [signal for signal in signals if signal not in EVENT_SIGNALS] or [EmpaticaRawData.Variables.EDA.value]
+
+
+def signal_fields(signal):
+    """
+    :param signal: Name of the rawData signal (e.g. 'eda').
+    :return: Names of the fields decoded for the signal.
+    """
+    if signal in IMU_SIGNALS:
+        return "timestampStart", "samplingFrequency", "imuParams", "x", "y", "z"
+    if signal in EVENT_SIGNALS:
+        return EVENT_SIGNALS[signal][0],
+
+    return "timestampStart", "samplingFrequency", "values"
+
+
+def records_to_arrays(records, signal):
+    """
+    Converts the decoded records of a signal into typed arrays.
+    IMU signals (x, y, z) are converted to physical units with the imuParams of each record, event signals (tags,
+    systolicPeaks) are kept as the time (us) of each event.
+    :param records: Decoded Avro records (with the signal_fields of rawData.<signal>).
+    :param signal: Name of the rawData signal (e.g. 'eda').
+    :return: Dictionary with STARTS (timestampStart of each record, us), FREQUENCIES (Hz, 0 for event signals), OFFSETS
+    (first value of each record in VALUES, followed by the total) and VALUES (all records, concatenated; one row of
+    x, y, z per sample for IMU signals).
+    """
+    signals = [record["rawData"][signal] for record in records]
+    if signal in EVENT_SIGNALS:
+        field, units_per_us = EVENT_SIGNALS[signal]
+        values = [np.asarray(data[field], dtype=np.int64) // units_per_us for data in signals]
+        starts = [record_values[0] if len(record_values) > 0 else 0 for record_values in values]
+        frequencies = np.zeros(len(signals))
+    else:
+        if signal in IMU_SIGNALS:
+            values = [np.column_stack((data["x"], data["y"], data["z"])).astype(np.float64).reshape(-1, 3) *
+                      ((data["imuParams"]["physicalMax"] - data["imuParams"]["physicalMin"]) /
+                       (data["imuParams"]["digitalMax"] - data["imuParams"]["digitalMin"])) for data in signals]
+        else:
+            values = [np.asarray(data["values"]) for data in signals]
+        starts = [data["timestampStart"] for data in signals]
+        frequencies = np.array([data["samplingFrequency"] for data in signals], dtype=np.float64)
+
+    return {"STARTS": np.array(starts, dtype=np.int64),
+            "FREQUENCIES": frequencies,
+            "OFFSETS": np.concatenate(([0], np.cumsum([len(record_values) for record_values in values]))).astype(np.int64),
+            "VALUES": np.concatenate(values) if values else np.empty(0)}
+
+
+def arrays_to_samples(arrays, signal):
+    """
+    Gets the timestamp of each value of a signal (see records_to_arrays), vectorized over all the records.
+    :return: Tuple (timestamps (ms), values).
+    """
+    values = arrays["VALUES"]
+    if signal in EVENT_SIGNALS:
+        # one value (1) for each event
+        return np.round(values / 1000).astype(np.int64), np.ones(len(values))
+
+    # index of each value inside its record
+    counts = np.diff(arrays["OFFSETS"])
+    records = np.repeat(np.arange(len(counts)), counts)
+    positions = np.arange(len(records)) - arrays["OFFSETS"][records]
+
+    period = (1 / arrays["FREQUENCIES"]) * 1000
+    start = np.round(arrays["STARTS"] / 1000)
+
+    return np.round(start[records] + period[records] * positions).astype(np.int64), values
+
+
+def file_fingerprint(path):
+    """
+    :return: Array (SIZE, MTIME_NS) identifying the version of a file.
+    """
+    stat = os.stat(path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def cache_path(cache_folder, path, signal):
+    """
+    :return: Path of the cache file of a signal of an .avro file.
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:20]
+    return os.path.join(cache_folder, key + "_" + signal + ".npz")
+
+
+def read_signal_cache(cache_folder, path, signal):
+    """
+    Reads the cached arrays of a signal of an .avro file (see records_to_arrays).
+    :return: Dictionary of arrays, or None if not cached or if the file changed since it was cached.
+    """
+    cached_path = cache_path(cache_folder, path, signal)
+    if not os.path.isfile(cached_path):
+        return None
+    with np.load(cached_path) as cached:
+        if not np.array_equal(cached["FINGERPRINT"], file_fingerprint(path)):
+            return None
+        return {name: cached[name] for name in ("STARTS", "FREQUENCIES", "OFFSETS", "VALUES")}
+
+
+def write_signal_cache(cache_folder, path, signal, arrays):
+    """
+    Caches the arrays of a signal of an .avro file (see records_to_arrays), with the fingerprint of the file.
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    cached_path = cache_path(cache_folder, path, signal)
+    temporary_path = cached_path.replace(".npz", ".tmp.npz")
+    np.savez(temporary_path, FINGERPRINT=file_fingerprint(path), **arrays)
+    os.replace(temporary_path, cached_path)
+
+
+# shade of each card (1 to 21)
+CARD_COLORS = [(1, 0.4, 0.4, 1), (1, 0.698, 0.4, 1), (1, 1, 0.6, 1), (0.4, 1, 0.4, 1), (0.4, 0.6, 1, 1), (0.616, 0.506, 0.729, 1), (0.867, 0.627, 0.867, 1),
+               (1, 0, 0, 1), (1, 0.498, 0, 1), (1, 1, 0, 1), (0, 1, 0, 1), (0, 0, 1, 1), (0.294, 0, 0.514, 1), (0.545, 0, 1, 1),
+               (0.4, 0, 0, 1), (0.8, 0.2, 0, 1), (0.8, 0.6, 0, 1), (0, 0.3, 0, 1), (0, 0, 0.4, 1), (0.13, 0, 0.24, 1), (0.4, 0, 0.6, 1)]
+
+
+def plot_signal(path, phase, variable, timestamps, values, cards, markers=None, downsampling=Downsampling.MINMAX, figure=None):
+    """
+    Plots a signal of a phase, with its local/global peaks and each card region shaded, and saves it.
+    Without a figure, it does not use pyplot (nor a GUI backend), so it can run in worker processes.
+    :param path: Path of the image.
+    :param phase: 0 (phase one) or 1 (phase two).
+    :param variable: EmpaticaRawData.Variables of the signal.
+    :param timestamps: Timestamps (ms).
+    :param values: Values of the signal.
+    :param cards: Card of each sample (-1 if none).
+    :param markers: Bounds of the longest fixation and visit (see EyetrackerData.get_markers), marked with vertical lines.
+    :param Downsampling downsampling: How the trace of the signal is reduced to the pixels of the figure, so the
+    rendering time does not depend on the length of the signal. The global maximum, minimum and absolute maximum are
+    always kept; every local peak is still marked.
+    :param figure: Figure to draw on (default: a new figure, not managed by pyplot).
+    :return: Path of the image.
+    """
+    var = variable.value
+    figure = figure if figure is not None else Figure(figsize=(25, 10))
+    axes = figure.add_subplot()
+    legend = [mpatches.Patch(color=color, label=str(i + 1)) for i, color in enumerate(CARD_COLORS)]
+
+    # local peaks
+    peaks, _ = find_peaks(abs(values))
+
+    max_pos = np.argmax(values)
+    min_neg = np.argmin(values)
+    max_abs = np.argmax(abs(values))
+
+    # two points per pixel column (only the trace, the peak markers are all drawn)
+    points = 2 * int(figure.get_figwidth() * figure.dpi)
+    shown = downsample_indices(timestamps, values, points, downsampling, keep=[max_pos, min_neg, max_abs])
+
+    axes.plot(timestamps[shown], values[shown], marker='', linestyle='-', color='black', linewidth="0.25")
+    axes.plot(timestamps[peaks], values[peaks], 'o', label='Local Peaks', color='GREY')
+    axes.plot(timestamps[max_pos], values[max_pos], 'o', label='Global maximum', color='RED')
+    axes.plot(timestamps[min_neg], values[min_neg], 'o', label='Global minimum', color='BLUE')
+    axes.plot(timestamps[max_abs], values[max_abs], 'o', label='Global absolute maximum', color='GREEN')
+    print("MAX PHASE {} VAR {}: {} -> {}".format(phase, variable.__str__(), timestamps[max_pos], values[max_pos]))
+    print("MIN PHASE {} VAR {}: {} -> {}".format(phase, variable.__str__(), timestamps[min_neg], values[min_neg]))
+
+    # vertical lines: longest fixation (black) and longest visit (grey)
+    if markers is not None:
+        for name, color in (("LONGEST_FIXATION", 'black'), ("LONGEST_VISIT", 'grey')):
+            if markers.get(name) is not None:
+                for bound in markers[name]:
+                    axes.plot([bound, bound], [values.min(), values.max()], linestyle='--', color=color)
+
+    # each card is shaded over its runs of consecutive samples (where=), there is no fill across the gaps
+    for region in np.unique(cards):
+        if region == -1:
+            continue
+        axes.fill_between(timestamps[shown], values[shown], where=cards[shown] == region, color=CARD_COLORS[region - 1], alpha=1)
+
+    axes.legend(handles=legend, loc='upper left', bbox_to_anchor=(0, 1), ncol=7, fontsize='small')
+
+    axes.set_xlim(timestamps.min(), timestamps.max())
+    axes.set_ylim(values.min(), values.max())
+
+    if phase == 0:
+        axes.set_title("PHASE ONE: " + var.upper())
+    else:
+        axes.set_title("PHASE TWO: " + var.upper())
+    axes.set_xlabel("TIMESTAMP")
+    axes.set_ylabel(var.upper())
+    axes.grid(True)
+
+    figure.savefig(path)
+
+    return path
+
 
 class EmpaticaRawData:
     class Variables(Enum):
@@ -22,167 +290,417 @@ class EmpaticaRawData:
         """
         EDA = 'eda'
         BVP = 'bvp'
+        ACCELEROMETER = 'accelerometer'
+        GYROSCOPE = 'gyroscope'
+        TEMPERATURE = 'temperature'
+        STEPS = 'steps'
+        TAGS = 'tags'
+        SYSTOLIC_PEAKS = 'systolicPeaks'
+
+    # reduction of the plotted signals (see plot_signal)
+    DOWNSAMPLING = Downsampling.MINMAX
 
-    def __init__(self, avro_folder_path, cards_data):
+    def __init__(self, avro_folder_path, cards_data, use_cache=True, cache_folder=None, stage_cache=None):
         """
         Constructor for EmpaticaData object.
         :param avro_folder_path: Path to .avro file.
+        :param use_cache: Keep the decoded signals on disk, so the next runs do not decode the .avro files again.
+        :param cache_folder: Folder of the decoded signals (default: .avro_cache inside avro_folder_path).
+        :param StageCache stage_cache: If not None, the aligned tables (see align_phase) are cached too.
         """
         self.cards_data = cards_data
+        self.stage_cache = stage_cache
+        self.cache_folder = None
+        if use_cache:
+            self.cache_folder = cache_folder if cache_folder is not None else os.path.join(avro_folder_path, ".avro_cache")
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.gaze_one = None
+        self.gaze_two = None
+        self.windows_two = None
+        self.markers_one = None
+        self.output_one = None
+        self.output_two = None
+        self.avro_files = list()
         self.schema = list()
-        self.data = list()
+        self.files_start = dict()
+        self.data = dict()
+        self.rates = dict()
+        self.signals_one = dict()
+        self.signals_two = dict()
         self.raw_data_one = None
         self.raw_data_two = None
         self.variable = None
-        '''
-        self.raw_accelerometer = None
-        self.raw_steps = None
-        self.raw_temperature = None
-        self.raw_gyroscope = None
-        self.raw_tags = None
-        self.raw_systolic_peaks = None
-        '''
 
-        for i, avro_file in enumerate(os.listdir(avro_folder_path)):
+        # only the headers are read here, the records are decoded when needed (load_data)
+        for avro_file in sorted(os.listdir(avro_folder_path)):
             if avro_file.endswith('.avro'):
                 reader = DataFileReader(open(os.path.join(avro_folder_path, avro_file), 'rb'), DatumReader())
 
+                self.avro_files.append(os.path.join(avro_folder_path, avro_file))
                 self.schema.append(json.loads(reader.meta.get('avro.schema').decode('utf-8')))
 
-                for datum in reader:
-                    self.data.append(datum)
                 reader.close()
 
-    def variable_raw_data(self, variable, phase_one_path, phase_two_path):
+    def read_files_start(self, signals):
+        """
+        Gets the start of each .avro file, from the timestampStart of its first record only.
+        :param signals: Names of the rawData signals (e.g. 'eda').
+        :return: List of (start (us), file index), sorted by start.
+        """
+        signals = timed_signals(signals)
+        key = tuple(sorted(signals))
+        if key not in self.files_start:
+            files_start = list()
+            for i, (avro_file, schema) in enumerate(zip(self.avro_files, self.schema)):
+                if self.cache_folder is not None:
+                    cached = [read_signal_cache(self.cache_folder, avro_file, signal) for signal in signals]
+                    if all(arrays is not None and len(arrays["STARTS"]) > 0 for arrays in cached):
+                        files_start.append((min(int(arrays["STARTS"][0]) for arrays in cached), i))
+                        continue
+
+                reader = DataFileReader(open(avro_file, 'rb'), DatumReader(readers_schema=projection_schema(schema, signals, ("timestampStart",))))
+                datum = next(reader, None)
+                reader.close()
+                if datum is not None:
+                    files_start.append((min(datum["rawData"][signal]["timestampStart"] for signal in signals), i))
+            self.files_start[key] = sorted(files_start)
+
+        return self.files_start[key]
+
+    def load_data(self, signals, intervals):
+        """
+        Decodes only the requested signals of the files that overlap the requested time intervals, into self.data
+        (signal name -> (timestamps (ms), values), only the samples inside the intervals) and self.rates (signal name ->
+        sampling frequency (Hz), None for event signals).
+        The files starting after the end of an interval, or whose next file starts before it, are not decoded; inside the
+        other files, without the decode cache (which keeps whole files), neither are the records outside the intervals
+        (see read_arrays).
+        :param signals: Names of the rawData signals (e.g. 'eda').
+        :param intervals: List of (start, end) timestamps (ms).
+        """
+        # file boundaries in us (as timestampStart), widened by the rounding of the timestamps to ms
+        intervals_us = [((start - 1) * 1000, (end + 1) * 1000) for start, end in intervals]
+
+        def overlaps(start, end):
+            return any(start <= interval_end and end >= interval_start for interval_start, interval_end in intervals_us)
+
+        files_start = self.read_files_start(signals)
+        files_arrays = list()
+        for i, (file_start, file_index) in enumerate(files_start):
+            file_end = files_start[i + 1][0] if i + 1 < len(files_start) else math.inf
+            if overlaps(file_start, file_end):
+                files_arrays.append(self.read_arrays(file_index, signals, overlaps, file_end))
+
+        self.data = dict()
+        self.rates = dict()
+        for signal in signals:
+            samples = [arrays_to_samples(arrays[signal], signal) for arrays in files_arrays]
+            timestamps = np.concatenate([sample[0] for sample in samples]) if samples else np.empty(0, dtype=np.int64)
+            values = np.concatenate([sample[1] for sample in samples]) if samples else np.empty(0)
+            if np.any(np.diff(timestamps) < 0):
+                order = np.argsort(timestamps, kind='stable')
+                timestamps, values = timestamps[order], values[order]
+
+            inside = np.zeros(len(timestamps), dtype=bool)
+            for start, end in intervals:
+                inside[np.searchsorted(timestamps, start, side='left'):np.searchsorted(timestamps, end, side='right')] = True
+            self.data[signal] = (timestamps[inside], values[inside])
+
+            frequencies = [arrays[signal]["FREQUENCIES"] for arrays in files_arrays if len(arrays[signal]["FREQUENCIES"]) > 0]
+            self.rates[signal] = None if signal in EVENT_SIGNALS or not frequencies else float(frequencies[0][0])
+
+        if self.cache_folder is not None:
+            print("AVRO CACHE: {} hits, {} misses".format(self.cache_hits, self.cache_misses))
+
+    def read_records_start(self, file_index, signals):
+        """
+        Gets the start of each record of an .avro file, decoding only its timestampStart (the rest is skipped).
+        :param file_index: Index of the file in self.avro_files.
+        :param signals: Names of the rawData signals (e.g. 'eda').
+        :return: List of starts (us), one per record.
+        """
+        signals = timed_signals(signals)
+        reader = DataFileReader(open(self.avro_files[file_index], 'rb'), DatumReader(readers_schema=projection_schema(self.schema[file_index], signals, ("timestampStart",))))
+        starts = [min(datum["rawData"][signal]["timestampStart"] for signal in signals) for datum in reader]
+        reader.close()
+
+        return starts
+
+    def read_arrays(self, file_index, signals, overlaps=None, file_end=math.inf):
+        """
+        Gets the requested signals of an .avro file as typed arrays (see records_to_arrays), from the cache or decoding
+        the file (only the signals not cached), in one pass over its records.
+        Without the decode cache, if overlaps is given, the start of each record is read first (see read_records_start)
+        and only the records that overlap the requested intervals are decoded, the others are skipped.
+        :param file_index: Index of the file in self.avro_files.
+        :param signals: Names of the rawData signals (e.g. 'eda').
+        :param overlaps: Function (start, end) (us) -> whether a record lasting from start to end is needed.
+        :param file_end: Start (us) of the next file, end of the last record.
+        :return: Dictionary signal name -> arrays.
+        """
+        avro_file = self.avro_files[file_index]
+        arrays = dict()
+        if self.cache_folder is not None:
+            for signal in signals:
+                cached = read_signal_cache(self.cache_folder, avro_file, signal)
+                if cached is not None:
+                    arrays[signal] = cached
+            self.cache_hits += len(arrays)
+            self.cache_misses += len(signals) - len(arrays)
+
+        missing = [signal for signal in signals if signal not in arrays]
+        if missing:
+            fields = set(field for signal in missing for field in signal_fields(signal))
+            schema = projection_schema(self.schema[file_index], missing, fields)
+            if self.cache_folder is None and overlaps is not None:
+                # each record lasts until the next one starts
+                starts = self.read_records_start(file_index, missing)
+                needed = [overlaps(start, end) for start, end in zip(starts, starts[1:] + [file_end])]
+            else:
+                needed = None
+
+            reader = DataFileReader(open(avro_file, 'rb'), DatumReader(readers_schema=schema))
+            if needed is None:
+                records = list(reader)
+            else:
+                skipped = projection_schema(self.schema[file_index], (), ())
+                records = list()
+                for record_needed in needed:
+                    reader.datum_reader.readers_schema = schema if record_needed else skipped
+                    datum = next(reader)
+                    if record_needed:
+                        records.append(datum)
+            reader.close()
+            for signal in missing:
+                arrays[signal] = records_to_arrays(records, signal)
+                if self.cache_folder is not None:
+                    write_signal_cache(self.cache_folder, avro_file, signal, arrays[signal])
+
+        return arrays
+
+    @staticmethod
+    def load_phase(phase):
+        """
+        Gets the raw gaze data of a game phase.
+        :param phase: EyetrackerData object (processed), folder exported by EyetrackerData.export_data, Excel
+        workbook (raw_gaze.xlsx) or DataFrame with X_AXIS, Y_AXIS and TIMESTAMP columns.
+        :return: Tuple (raw gaze, card windows or None, prefix of the output paths or None, markers or None (see
+        EyetrackerData.get_markers)).
+        """
+        if isinstance(phase, EyetrackerData):
+            if phase.output_folder is not None:
+                output = os.path.join(phase.output_folder, "raw_gaze_")
+            else:
+                output = os.path.splitext(phase.filepath)[0] + "_"
+            return phase.raw_gaze[["X_AXIS", "Y_AXIS", "TIMESTAMP"]], phase.timestamps, output, phase.get_markers()
+
+        if isinstance(phase, pd.DataFrame):
+            return phase[["X_AXIS", "Y_AXIS", "TIMESTAMP"]], None, None, None
+
+        if os.path.isdir(phase):
+            manifest = read_manifest(phase)
+            raw_gaze_path = os.path.join(phase, manifest["RAW_GAZE"])
+            markers = manifest.get("MARKERS")
+            if raw_gaze_path.endswith(".xlsx"):
+                raw_gaze = pd.read_excel(raw_gaze_path, sheet_name="RAW_GAZE")
+            else:
+                raw_gaze = read_table(raw_gaze_path)
+                if markers is None and manifest["DATA_TYPE"] == EyetrackerData.DataType.PHASE_ONE.name:
+                    tables = read_tables(phase)
+                    markers = markers_from_tables(tables["fixations"], tables["visits"])
+            return raw_gaze[["X_AXIS", "Y_AXIS", "TIMESTAMP"]], manifest["CARD_WINDOWS"], os.path.join(phase, "raw_gaze_"), markers
+
+        # Excel workbook: card windows from the first timestamp of each card sheet
+        with pd.ExcelFile(phase) as workbook:
+            raw_gaze = workbook.parse("RAW_GAZE")
+            windows = [workbook.parse(sheet_name)["TIMESTAMP"].iloc[0] for sheet_name in workbook.sheet_names
+                       if sheet_name.startswith("CARD_") and sheet_name.endswith("_GAZE")]
+            windows.append(raw_gaze["TIMESTAMP"].iloc[-1] + 1)
+            markers = None
+            fixations_path = os.path.join(os.path.dirname(phase), "fixations.xlsx")
+            if "VISITS" in workbook.sheet_names and os.path.isfile(fixations_path):
+                markers = markers_from_tables(pd.read_excel(fixations_path, sheet_name="FIXATIONS"), workbook.parse("VISITS"))
+        return raw_gaze[["X_AXIS", "Y_AXIS", "TIMESTAMP"]], windows, phase.replace(".xlsx", "_"), markers
+
+    def set_phases(self, phase_one, phase_two, windows_two=None, output_one=None, output_two=None):
+        """
+        Sets the gaze data of both game phases, once for every variable.
+        :param phase_one: Phase one (see load_phase).
+        :param phase_two: Phase two (see load_phase).
+        :param windows_two: Timestamps of each card first appearance in phase two, followed by the end of the last one
+        (default: from phase_two).
+        :param output_one: Prefix of the phase one output paths (default: from phase_one).
+        :param output_two: Prefix of the phase two output paths (default: from phase_two).
+        """
+        self.gaze_one, _, default_output_one, self.markers_one = self.load_phase(phase_one)
+        self.gaze_two, default_windows_two, default_output_two, _ = self.load_phase(phase_two)
+        self.windows_two = windows_two if windows_two is not None else default_windows_two
+        self.output_one = output_one if output_one is not None else default_output_one
+        self.output_two = output_two if output_two is not None else default_output_two
+
+    def signals_raw_data(self, variables, phase_one_path=None, phase_two_path=None):
+        """
+        Extracts raw data for several variables from the .avro files, in one pass over the records.
+        Sets self.signals_one and self.signals_two (variable -> (timestamps (ms), values) during each phase) and
+        self.rates (variable -> sampling frequency (Hz), None for TAGS and SYSTOLIC_PEAKS).
+        :param variables: Variables to extract raw data for.
+        :param phase_one_path: Phase one raw gaze data (see load_phase), if not already set by set_phases.
+        :param phase_two_path: Phase two raw gaze data (see load_phase), if not already set by set_phases.
+        """
+        if phase_one_path is not None and phase_two_path is not None:
+            self.set_phases(phase_one_path, phase_two_path)
+
+        start_timestamp_one = self.gaze_one.iloc[0]['TIMESTAMP']
+        end_timestamp_one = self.gaze_one.iloc[-1]['TIMESTAMP']
+
+        start_timestamp_two = self.gaze_two.iloc[0]['TIMESTAMP']
+        end_timestamp_two = self.gaze_two.iloc[-1]['TIMESTAMP']
+
+        variables = [EmpaticaRawData.Variables(variable) for variable in variables]
+        self.load_data([variable.value for variable in variables], [(start_timestamp_one, end_timestamp_one), (start_timestamp_two, end_timestamp_two)])
+
+        # the samples are in chronological order, so each phase is a contiguous slice
+        for variable in variables:
+            timestamps, values = self.data[variable.value]
+            first, last = np.searchsorted(timestamps, start_timestamp_one, side='left'), np.searchsorted(timestamps, end_timestamp_one, side='right')
+            self.signals_one[variable] = (timestamps[first:last], values[first:last])
+            first, last = np.searchsorted(timestamps, start_timestamp_two, side='left'), np.searchsorted(timestamps, end_timestamp_two, side='right')
+            self.signals_two[variable] = (timestamps[first:last], values[first:last])
+            self.rates[variable] = self.rates.pop(variable.value)
+
+    def select_variable(self, variable):
+        """
+        Sets the raw data of both phases (self.raw_data_one and self.raw_data_two) to an extracted variable.
+        IMU variables get one column per axis (e.g. accelerometer_x).
+        :param variable: Variable extracted by signals_raw_data.
+        """
+        self.variable = variable
+
+        def frame(signal):
+            timestamps, values = signal
+            if values.ndim == 2:
+                return pd.DataFrame({"TIMESTAMP": timestamps, variable.value + "_x": values[:, 0],
+                                     variable.value + "_y": values[:, 1], variable.value + "_z": values[:, 2]})
+            return pd.DataFrame({"TIMESTAMP": timestamps, variable.value: values})
+
+        self.raw_data_one = frame(self.signals_one[variable])
+        self.raw_data_two = frame(self.signals_two[variable])
+
+    def variable_raw_data(self, variable, phase_one_path=None, phase_two_path=None):
         """
         Extracts raw data for a specific variable from the .avro files.
         :param variable: Variable to extract raw data for.
-        :param phase_one_path: Path to phase one raw gaze data.
-        :param phase_two_path: Path to phase two raw gaze data.
-        """
-        var = str()
-        if variable == EmpaticaRawData.Variables.EDA:
-            self.variable = variable
-            var = "eda"
-        elif variable == EmpaticaRawData.Variables.BVP:
-            self.variable = variable
-            var = "bvp"
-        else:
-            assert "Invalid variable name"
+        :param phase_one_path: Phase one raw gaze data (see load_phase), if not already set by set_phases.
+        :param phase_two_path: Phase two raw gaze data (see load_phase), if not already set by set_phases.
+        """
+        self.signals_raw_data([variable], phase_one_path, phase_two_path)
+        self.select_variable(variable)
 
-        phase_one_gaze = pd.read_excel(phase_one_path, sheet_name="RAW_GAZE")
-        start_timestamp_one = phase_one_gaze.iloc[0]['TIMESTAMP']
-        end_timestamp_one = phase_one_gaze.iloc[-1]['TIMESTAMP']
+    def align_phase(self, phase, variables, rate=None, method=Alignment.INTERPOLATE, tolerance=None):
+        """
+        Brings the gaze and some extracted variables of a phase onto a common timebase, in one compact table.
+        :param EyetrackerData.DataType phase: Phase to align.
+        :param variables: Variables extracted by signals_raw_data.
+        :param rate: Rate (Hz) of the common timebase, from the first to the last gaze sample. If None, the timestamps of
+        the first variable are used (its own samples are kept as they are).
+        :param Alignment method: How each stream is brought onto the timebase.
+        :param tolerance: Maximum distance (ms) to the samples used, NaN beyond it (see align_stream).
+        :return: Table with X_AXIS, Y_AXIS, TIMESTAMP and one column per variable (one per axis for IMU variables).
+        """
+        gaze, signals = (self.gaze_one, self.signals_one) if phase == EyetrackerData.DataType.PHASE_ONE else (self.gaze_two, self.signals_two)
+        gaze_timestamps = gaze["TIMESTAMP"].to_numpy(dtype=np.int64)
+        if rate is None:
+            target = signals[variables[0]][0]
+        else:
+            target = common_timebase(gaze_timestamps[0], gaze_timestamps[-1], rate)
 
-        phase_two_gaze = pd.read_excel(phase_two_path, sheet_name="RAW_GAZE")
-        start_timestamp_two = phase_two_gaze.iloc[0]['TIMESTAMP']
-        end_timestamp_two = phase_two_gaze.iloc[-1]['TIMESTAMP']
+        streams = {"X_AXIS": (gaze_timestamps, gaze["X_AXIS"].to_numpy()), "Y_AXIS": (gaze_timestamps, gaze["Y_AXIS"].to_numpy())}
+        for variable in variables:
+            streams[variable.value] = signals[variable]
 
-        self.raw_data_one = pd.DataFrame(columns=["TIMESTAMP", self.variable.value])
-        self.raw_data_two = pd.DataFrame(columns=["TIMESTAMP", self.variable.value])
-        for data in self.data:
-            period = (1 / data["rawData"][var]["samplingFrequency"]) * 1000
-            start = round(data["rawData"][var]["timestampStart"] / 1000)
+        if self.stage_cache is None:
+            aligned = align_streams(target, streams, method, tolerance)
+        else:
+            inputs = [arrays_digest(target)] + [arrays_digest(*streams[name]) for name in streams]
+            _, tables = self.stage_cache.run("alignment", inputs,
+                                             {"STREAMS": list(streams), "METHOD": method.name, "TOLERANCE": tolerance},
+                                             lambda: {"aligned": align_streams(target, streams, method, tolerance)})
+            aligned = tables["aligned"]
 
-            temp = pd.DataFrame({self.variable.value: data["rawData"][var]["values"],
-                                 'TIMESTAMP': [round(start + (period * i)) for i in
-                                               range(len(data["rawData"][var]["values"]))]})
-            temp_one = temp[(temp['TIMESTAMP'] >= start_timestamp_one) & (temp['TIMESTAMP'] <= end_timestamp_one)]
-            temp_two = temp[(temp['TIMESTAMP'] >= start_timestamp_two) & (temp['TIMESTAMP'] <= end_timestamp_two)]
-            self.raw_data_one = pd.concat([self.raw_data_one, temp_one])
-            self.raw_data_two = pd.concat([self.raw_data_two, temp_two])
+        return aligned[["X_AXIS", "Y_AXIS", "TIMESTAMP"] + [column for column in aligned.columns if column not in ("X_AXIS", "Y_AXIS", "TIMESTAMP")]]
 
-    def export_data(self, variable, phase_one_path, phase_two_path):
+    def export_tables(self, variable, rate=None, method=Alignment.INTERPOLATE, tolerance=None):
         """
-        Exports raw data for a specific variable.
-        Maps EDA/BVP raw data to each card region.
-        Plots the data and sinalizes local/global peaks.
-        :param variable: Variable to export raw data for.
-        :param phase_one_path: Path to phase one raw gaze data.
-        :param phase_two_path: Path to phase two raw gaze data.
-        """
-        var = str()
-        if variable == EmpaticaRawData.Variables.EDA:
-            self.variable = variable
-            var = "eda"
-        elif variable == EmpaticaRawData.Variables.BVP:
-            self.variable = variable
-            var = "bvp"
-        else:
-            assert "Invalid variable name"
+        Maps the raw data of an extracted variable to each card region and exports it (one Excel file per phase).
+        :param variable: Variable extracted by signals_raw_data.
+        :param rate: Rate (Hz) of the common timebase (default: the samples of the variable), see align_phase.
+        :param Alignment method: How the gaze (and the variable) are brought onto the timebase.
+        :param tolerance: Maximum distance (ms) to the samples used.
+        :return: Tuple (phase one table, phase two table).
+        """
+        if self.signals_one[variable][1].ndim != 1:
+            raise ValueError("Only single channel variables can be exported: " + str(variable))
+        self.select_variable(variable)
+        var = variable.value
 
         # PHASE ONE
-        final_p1 = pd.merge(pd.read_excel(phase_one_path, sheet_name="RAW_GAZE"), self.raw_data_one, on="TIMESTAMP", how='outer')
-        final_p1.sort_values(by="TIMESTAMP", inplace=True)
-        final_p1.reset_index(inplace=True, drop=True)
-        final_p1["X_AXIS"] = final_p1["X_AXIS"].interpolate(method='linear', limit_direction='both')
-        final_p1["Y_AXIS"] = final_p1["Y_AXIS"].interpolate(method='linear', limit_direction='both')
+        final_p1 = self.align_phase(EyetrackerData.DataType.PHASE_ONE, [variable], rate, method, tolerance)
         final_p1 = final_p1[final_p1[var].notna()].reset_index(drop=True)
 
-        def get_card_phase1(point):
-            for i, card_top_left in enumerate(self.cards_data[0]):
-                if card_top_left[0] < point[0] < card_top_left[0] + self.cards_data[1] and card_top_left[1] < point[1] < card_top_left[1] + self.cards_data[2]:
-                    return i + 1
-            return -1
-
-        final_p1['CARD'] = final_p1.apply(lambda row: get_card_phase1((row['X_AXIS'], row['Y_AXIS'])), axis=1)
+        card_dim = (self.cards_data[1], self.cards_data[2])
+        origin, grid_shape, dist_cards = grid_from_boundaries(self.cards_data[0], card_dim)
+        final_p1['CARD'] = label_cards(final_p1['X_AXIS'], final_p1['Y_AXIS'], origin, grid_shape, card_dim, dist_cards)
 
-        path = phase_one_path.replace(".xlsx", "_") + self.variable.value + '.xlsx'
+        path = self.output_one + self.variable.value + '.xlsx'
         final_p1.to_excel(path)
 
         # PHASE TWO
-        phase_two_data = pd.ExcelFile(phase_two_path)
-        dfs = {sheet_name: phase_two_data.parse(sheet_name) for sheet_name in phase_two_data.sheet_names}
-        final_p2 = pd.merge(pd.read_excel(phase_two_path, sheet_name="RAW_GAZE"), self.raw_data_two, on="TIMESTAMP", how='outer')
-        final_p2.sort_values(by="TIMESTAMP", inplace=True)
-        final_p2.reset_index(inplace=True, drop=True)
-        final_p2["X_AXIS"] = final_p2["X_AXIS"].interpolate(method='linear', limit_direction='both')
-        final_p2["Y_AXIS"] = final_p2["Y_AXIS"].interpolate(method='linear', limit_direction='both')
+        final_p2 = self.align_phase(EyetrackerData.DataType.PHASE_TWO, [variable], rate, method, tolerance)
         final_p2 = final_p2[final_p2[var].notna()].reset_index(drop=True)
 
-        timestamps = []
-        for sheet_name, df in dfs.items():
-            if sheet_name != "RAW_GAZE":
-                timestamps.append(df.iloc[0, 2])
+        final_p2['CARD'] = label_windows(final_p2['TIMESTAMP'], self.windows_two)
 
-        def get_card_phase2(timestamps, timestamp):
-            for i, window_start in enumerate(timestamps):
-                if timestamp < window_start:
-                    return i
-            return len(timestamps)
+        path = self.output_two + self.variable.value + '.xlsx'
+        final_p2.to_excel(path)
 
-        final_p2['CARD'] = final_p2.apply(lambda row: get_card_phase2(timestamps, row["TIMESTAMP"]), axis=1)
+        return final_p1, final_p2
 
-        path = phase_two_path.replace(".xlsx", "_") + self.variable.value + '.xlsx'
-        final_p2.to_excel(path)
+    def plot_jobs(self, variable, final_p1, final_p2):
+        """
+        :return: Arguments of plot_signal for the figure of each phase of a variable (see export_tables).
+        """
+        var = variable.value
+        return [(self.output_one + var + '.png', 0, variable, final_p1['TIMESTAMP'].to_numpy(), final_p1[var].to_numpy(), final_p1['CARD'].to_numpy(), self.markers_one, self.DOWNSAMPLING),
+                (self.output_two + var + '.png', 1, variable, final_p2['TIMESTAMP'].to_numpy(), final_p2[var].to_numpy(), final_p2['CARD'].to_numpy(), None, self.DOWNSAMPLING)]
+
+    def export_data(self, variable, phase_one_path=None, phase_two_path=None, rate=None, method=Alignment.INTERPOLATE, tolerance=None, interactive=True):
+        """
+        Exports raw data for a specific variable.
+        Maps EDA/BVP raw data to each card region.
+        Plots the data and sinalizes local/global peaks.
+        :param variable: Variable to export raw data for.
+        :param phase_one_path: Phase one raw gaze data (see load_phase), if not already set by set_phases.
+        :param phase_two_path: Phase two raw gaze data (see load_phase), if not already set by set_phases.
+        :param rate: Rate (Hz) of the common timebase (default: the samples of the variable), see align_phase.
+        :param Alignment method: How the gaze (and the variable) are brought onto the timebase.
+        :param tolerance: Maximum distance (ms) to the samples used.
+        :param interactive: Show each figure (and ask for the longest fixation/visit bounds if they are not known from
+        phase one). If False, the figures are only saved, without a GUI backend.
+        """
+        if (phase_one_path is not None and phase_two_path is not None) or variable not in self.signals_one:
+            self.signals_raw_data([variable], phase_one_path, phase_two_path)
+        final_p1, final_p2 = self.export_tables(variable, rate, method, tolerance)
 
         '''
         PLOT PHASE 1 & 2
         '''
-        for i, data in enumerate(((final_p1['TIMESTAMP'], final_p1[var], final_p1['CARD']),
-                                (final_p2['TIMESTAMP'], final_p2[var], final_p2['CARD']))):
-            plt.figure(figsize=(25, 10))
-            cards_regions = data[2].unique()
-            colors = [(1, 0.4, 0.4, 1), (1, 0.698, 0.4, 1), (1, 1, 0.6, 1), (0.4, 1, 0.4, 1), (0.4, 0.6, 1, 1), (0.616, 0.506, 0.729, 1), (0.867, 0.627, 0.867, 1),
-                      (1, 0, 0, 1), (1, 0.498, 0, 1), (1, 1, 0, 1), (0, 1, 0, 1), (0, 0, 1, 1), (0.294, 0, 0.514, 1), (0.545, 0, 1, 1),
-                      (0.4, 0, 0, 1), (0.8, 0.2, 0, 1), (0.8, 0.6, 0, 1), (0, 0.3, 0, 1), (0, 0, 0.4, 1), (0.13, 0, 0.24, 1), (0.4, 0, 0.6, 1)]
-            legend = [mpatches.Patch(color=color, label=str(i + 1)) for i, color in enumerate(colors)]
-            plt.plot(data[0], data[1], marker='', linestyle='-', color='black', linewidth="0.25")
-
-            # local peaks
-            peaks, _ = find_peaks(abs(data[1]))
-            plt.plot(data[0][peaks], data[1][peaks], 'o', label='Local Peaks', color='GREY')
-
-            max_pos = np.argmax(data[1])
-            min_neg = np.argmin(data[1])
-            max_abs = np.argmax(abs(data[1]))
-            plt.plot(data[0][max_pos], data[1][max_pos], 'o', label='Global maximum', color='RED')
-            plt.plot(data[0][min_neg], data[1][min_neg], 'o', label='Global minimum', color='BLUE')
-            plt.plot(data[0][max_abs], data[1][max_abs], 'o', label='Global absolute maximum', color='GREEN')
-            print("MAX PHASE {} VAR {}: {} -> {}".format(i, self.variable.__str__(), data[0][max_pos], data[1][max_pos]))
-            print("MIN PHASE {} VAR {}: {} -> {}".format(i, self.variable.__str__(), data[0][min_neg], data[1][min_neg]))
-
-            if i == 0:
+        for job in self.plot_jobs(variable, final_p1, final_p2):
+            if not interactive:
+                plot_signal(*job)
+                continue
+
+            if job[1] == 0 and job[6] is None:
                 # input longest fixation boundaries
                 start_longest_fixation = int(input("Start Longest Fixation: "))
                 end_longest_fixation = int(input("End Longest Fixation: "))
@@ -191,55 +709,37 @@ class EmpaticaRawData:
                 start_longest_visit = int(input("Start Longest Visit: "))
                 end_longest_visit = int(input("End Longest Visit: "))
 
-                # plot vertical lines
-                plt.plot([start_longest_fixation, start_longest_fixation], [min(data[1]), max(data[1])], linestyle='--', color='black')
-                plt.plot([end_longest_fixation, end_longest_fixation], [min(data[1]), max(data[1])], linestyle='--', color='black')
-                plt.plot([start_longest_visit, start_longest_visit], [min(data[1]), max(data[1])], linestyle='--', color='grey')
-                plt.plot([end_longest_visit, end_longest_visit], [min(data[1]), max(data[1])], linestyle='--', color='grey')
-
-
-                for region in cards_regions:
-                    if region != -1:
-                        subset = final_p1[final_p1['CARD'] == region].reset_index()
+                markers = {"LONGEST_FIXATION": [start_longest_fixation, end_longest_fixation], "LONGEST_VISIT": [start_longest_visit, end_longest_visit]}
+                job = job[:6] + (markers,) + job[7:]
 
-                        rows_to_add = []
-                        for row in range(1, len(subset)):
-                            if subset.iloc[row]["index"] - subset.iloc[row - 1]["index"] > 1:
-                                time = subset.iloc[row - 1]["TIMESTAMP"]
-                                for indexes in range(subset.iloc[row - 1]["index"] + 1, subset.iloc[row]["index"]):
-                                    if indexes == subset.iloc[row]["index"] - 1:
-                                        time = subset.iloc[row]["TIMESTAMP"]
-                                    rows_to_add.append({'index': indexes, 'TIMESTAMP': time, 'X_AXIS': 0, 'Y_AXIS': 0, var: 0, 'CARD': region})
-
-                        to_add = pd.DataFrame(rows_to_add)
-                        subset = pd.concat([subset, pd.DataFrame(to_add)]).sort_values(by='index')
+            plot_signal(*job, figure=plt.figure(figsize=(25, 10)))
+            plt.show()
 
-                        plt.fill_between(subset["TIMESTAMP"].tolist(), subset[var].tolist(), color=colors[region - 1], alpha=1)
-            else:
-                for region in cards_regions:
-                    subset = final_p2[final_p2['CARD'] == region]
-                    plt.fill_between(subset["TIMESTAMP"].tolist(), subset[var].tolist(), color=colors[region - 1], alpha=1)
+    def export_all(self, variables, workers=None, rate=None, method=Alignment.INTERPOLATE, tolerance=None):
+        """
+        Exports several variables without any interaction: the markers come from phase one (see set_phases) and the
+        figures (phase x variable) are rendered headless, in parallel processes.
+        :param variables: Single channel variables to export.
+        :param workers: Number of processes (default: number of CPUs); with 1, the figures are rendered in this process.
+        :param rate: Rate (Hz) of the common timebase (default: the samples of each variable), see align_phase.
+        :param Alignment method: How the gaze (and the variables) are brought onto the timebase.
+        :param tolerance: Maximum distance (ms) to the samples used.
+        :return: Paths of the figures.
+        """
+        missing = [variable for variable in variables if variable not in self.signals_one]
+        if missing:
+            self.signals_raw_data(missing)
 
-            plt.legend(handles=legend, loc='upper left', bbox_to_anchor=(0, 1), ncol=7, fontsize='small')
+        jobs = list()
+        for variable in variables:
+            jobs.extend(self.plot_jobs(variable, *self.export_tables(variable, rate, method, tolerance)))
 
-            plt.xlim(min(data[0]), max(data[0]))
-            plt.ylim(min(data[1]), max(data[1]))
+        if workers == 1:
+            return [plot_signal(*job) for job in jobs]
 
-            if i == 0:
-                plt.title("PHASE ONE: " + var.upper())
-            else:
-                plt.title("PHASE TWO: " + var.upper())
-            plt.xlabel("TIMESTAMP")
-            plt.ylabel(var.upper())
-            plt.grid(True)
-
-            if i == 0:
-                path = phase_one_path.replace('.xlsx', '_') + self.variable.value + '.png'
-                plt.savefig(path)
-            else:
-                path = phase_two_path.replace('.xlsx', '_') + self.variable.value + '.png'
-                plt.savefig(path)
-            plt.show()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(plot_signal, *job) for job in jobs]
+            return [future.result() for future in futures]
 
 
 def main():
@@ -270,12 +770,12 @@ def main():
     Run data processing.
     '''
     empatica_testing = EmpaticaRawData(r"path/to/directory/with/avro/files", (cards_boundaries, 200, 300))
-    path1 = r"path/to/phase/one/raw_gaze.xlsx"
-    path2 = r"path/to/phase/two/raw_gaze.xlsx"
-    empatica_testing.variable_raw_data(EmpaticaRawData.Variables.EDA, path1, path2)
-    empatica_testing.export_data(EmpaticaRawData.Variables.EDA, path1, path2)
-    empatica_testing.variable_raw_data(EmpaticaRawData.Variables.BVP, path1, path2)
-    empatica_testing.export_data(EmpaticaRawData.Variables.BVP, path1, path2)
+    path1 = r"path/to/phase/one/output/folder"
+    path2 = r"path/to/phase/two/output/folder"
+    empatica_testing.set_phases(path1, path2)
+    empatica_testing.signals_raw_data([EmpaticaRawData.Variables.EDA, EmpaticaRawData.Variables.BVP])
+    empatica_testing.export_data(EmpaticaRawData.Variables.EDA)
+    empatica_testing.export_data(EmpaticaRawData.Variables.BVP)
 
 
 if __name__ == '__main__':
@@ -1,19 +1,141 @@
 import os
-import pickle
+import threading
 import time
 import tkinter
 from datetime import datetime
 
+import numpy as np
 import tobii_research as tobii
 
+from gaze_file import PUPIL_DTYPE, PupilBinaryWriter
+
 # duration of data collection
 TIME = 60
+# highest sampling rate (Hz) expected from the eye-tracker and seconds kept by the capture buffer (it is written to the
+# file every DRAIN_INTERVAL seconds, so it only has to hold a few intervals)
+MAX_FREQUENCY = 600
+BUFFER_SECONDS = 10
+DRAIN_INTERVAL = 0.5
 
 LICENSE_PATH = r"path/to/license"
 
 FOLDER_PATH = r"path/to/output/folder"
 
-DATA = list()
+# fields copied from each gaze sample (both eyes: gaze point on the display area, pupil diameter and validities)
+CAPTURE_FIELDS = {name: PUPIL_DTYPE[name] for name in PUPIL_DTYPE.names}
+
+
+class GazeRingBuffer:
+    """
+    Capture buffer of the gaze samples: one preallocated array per field (struct of arrays), used as a ring.
+    Each sample costs the same (a few scalar copies, no new objects) and the memory is fixed; if more samples than the
+    capacity arrive before being read, the oldest ones are overwritten (see read_since, which drains it while capturing
+    and counts them as lost).
+    """
+
+    def __init__(self, capacity):
+        """
+        Constructor for GazeRingBuffer.
+        :param capacity: Number of samples kept.
+        """
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in CAPTURE_FIELDS.items()}
+        # samples started and finished (they differ only while a sample is being copied)
+        self.started = 0
+        self.written = 0
+
+    def push(self, gaze_data):
+        """
+        Copies the needed fields of a gaze sample (tobii_research GazeData object, no dictionary is built) into the
+        buffer.
+        """
+        i = self.started % self.capacity
+        self.started += 1
+        columns = self.columns
+        left, right = gaze_data.left_eye, gaze_data.right_eye
+        columns['LEFT_X'][i], columns['LEFT_Y'][i] = left.gaze_point.position_on_display_area
+        columns['RIGHT_X'][i], columns['RIGHT_Y'][i] = right.gaze_point.position_on_display_area
+        columns['LEFT_PUPIL'][i] = left.pupil.diameter
+        columns['RIGHT_PUPIL'][i] = right.pupil.diameter
+        columns['LEFT_GAZE_VALIDITY'][i] = left.gaze_point.validity
+        columns['RIGHT_GAZE_VALIDITY'][i] = right.gaze_point.validity
+        columns['LEFT_PUPIL_VALIDITY'][i] = left.pupil.validity
+        columns['RIGHT_PUPIL_VALIDITY'][i] = right.pupil.validity
+        columns['DEVICE_TIME_STAMP'][i] = gaze_data.device_time_stamp
+        columns['SYSTEM_TIME_STAMP'][i] = gaze_data.system_time_stamp
+        self.written += 1
+
+    def read_since(self, position):
+        """
+        Copies the samples written since a position (a previous value of written), e.g. to drain them to a file while
+        the capture goes on.
+        :param position: Number of samples already read.
+        :return: Tuple (dictionary of arrays, new position, samples lost: overwritten before being read).
+        """
+        end = self.written
+        start = max(position, end - self.capacity)
+        indices = np.arange(start, end) % self.capacity
+        columns = {name: column[indices] for name, column in self.columns.items()}
+
+        # the samples overwritten (or being overwritten) while they were copied are lost too
+        lost = min(max(self.started - self.capacity - start, 0), end - start)
+        if lost > 0:
+            columns = {name: column[lost:] for name, column in columns.items()}
+
+        return columns, end, start - position + lost
+
+
+BUFFER = GazeRingBuffer(BUFFER_SECONDS * MAX_FREQUENCY)
+
+
+class CaptureWriter(threading.Thread):
+    """
+    Background thread that drains the capture buffer into a pupil capture file (see PupilBinaryWriter), one chunk
+    every interval, so the capture can be as long as needed and a crash only loses the last interval.
+    """
+
+    def __init__(self, buffer, writer, interval=DRAIN_INTERVAL):
+        """
+        Constructor for CaptureWriter.
+        :param GazeRingBuffer buffer: Capture buffer.
+        :param PupilBinaryWriter writer: Writer of the capture file.
+        :param interval: Time (s) between chunks.
+        """
+        super().__init__(daemon=True)
+        self.buffer = buffer
+        self.writer = writer
+        self.interval = interval
+        self.position = buffer.written
+        self.samples = 0
+        self.lost = 0
+        self.stopping = threading.Event()
+
+    def drain(self):
+        """
+        Appends the samples captured since the last chunk to the file.
+        """
+        columns, self.position, lost = self.buffer.read_since(self.position)
+        self.lost += lost
+        chunk = np.empty(len(columns['SYSTEM_TIME_STAMP']), dtype=PUPIL_DTYPE)
+        if len(chunk) == 0:
+            return
+        for name in PUPIL_DTYPE.names:
+            chunk[name] = columns[name]
+        self.writer.append(chunk)
+        self.samples += len(chunk)
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.drain()
+        self.drain()
+
+    def stop(self):
+        """
+        Writes the last samples and closes the file.
+        """
+        self.stopping.set()
+        self.join()
+        self.writer.close()
 
 
 def create_filename():
@@ -62,38 +184,26 @@ def apply_license(eyetracker):
 def gaze_data_callback(gaze_data):
     """
     THIS FUNCTION DETERMINES WHAT IS DONE WITH THE DATA COLLECTED.
-    THIS IS THE STRUCTURE OF THE DATA COLLECTED:
-        self.__left = EyeData(
-                data["left_gaze_point_on_display_area"],
-                data["left_gaze_point_in_user_coordinate_system"],
-                data["left_gaze_point_validity"],
-                data["left_pupil_diameter"],
-                data["left_pupil_validity"],
-                data["left_gaze_origin_in_user_coordinate_system"],
-                data["left_gaze_origin_in_trackbox_coordinate_system"],
-                data["left_gaze_origin_validity"])
-
-        self.__right = EyeData(
-                data["right_gaze_point_on_display_area"],
-                data["right_gaze_point_in_user_coordinate_system"],
-                data["right_gaze_point_validity"],
-                data["right_pupil_diameter"],
-                data["right_pupil_validity"],
-                data["right_gaze_origin_in_user_coordinate_system"],
-                data["right_gaze_origin_in_trackbox_coordinate_system"],
-                data["right_gaze_origin_validity"])
-
-        self.__device_time_stamp = data["device_time_stamp"]
-
-        self.__system_time_stamp = data["system_time_stamp"]
+    THIS IS THE STRUCTURE OF THE DATA COLLECTED (GazeData OBJECT):
+        gaze_data.left_eye = EyeData(
+                gaze_point = GazePoint(position_on_display_area, position_in_user_coordinates, validity),
+                pupil = PupilData(diameter, validity),
+                gaze_origin = GazeOrigin(position_in_user_coordinates, position_in_track_box_coordinates, validity))
+
+        gaze_data.right_eye = EyeData(...)
+
+        gaze_data.device_time_stamp
+
+        gaze_data.system_time_stamp
     """
-    # just store the data with time correction (writing to file is too slow, it would compromise the frequency of the eye-tracker)
-    DATA.append(gaze_data)
+    # just store the data (writing to file is too slow, it would compromise the frequency of the eye-tracker)
+    BUFFER.push(gaze_data)
 
 
 def get_data_with_pupil():
     """
-    GET DATA FROM EYE-TRACKER AND STORE IT IN A FILE (WITH PUPIL DIAMETER)
+    GET DATA FROM EYE-TRACKER AND STORE IT IN A FILE (WITH PUPIL DIAMETER), WRITTEN IN CHUNKS DURING THE CAPTURE
+    (SEE gaze_file.read_pupil_binary)
     """
     # look for connected eye-trackers
     found_eyetrackers = tobii.find_all_eyetrackers()
@@ -120,18 +230,20 @@ def get_data_with_pupil():
         now_ns = time.time_ns()  # Time in nanoseconds
         now_ms = int(now_ns / 1000000)
         timestamp_correction = now_ms - int(tobii.get_system_time_stamp() / 1000)
-        DATA.append(timestamp_correction)
+
+        # the samples are written to the file in the background
+        writer = CaptureWriter(BUFFER, PupilBinaryWriter(filename, timestamp_correction, (width, height)))
+        writer.start()
 
         # get data
-        eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA, gaze_data_callback, as_dictionary=True)
+        eyetracker.subscribe_to(tobii.EYETRACKER_GAZE_DATA, gaze_data_callback, as_dictionary=False)
 
         # data collection duration
         time.sleep(TIME)
         eyetracker.unsubscribe_from(tobii.EYETRACKER_GAZE_DATA, gaze_data_callback)
 
-        # write data to file
-        with open(filename, "wb") as file:
-            pickle.dump(DATA, file)
+        writer.stop()
+        print("GAZE CAPTURE: {} samples written, {} lost (buffer overflow)".format(writer.samples, writer.lost))
 
         return timestamp_correction
 
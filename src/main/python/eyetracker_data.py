@@ -7,6 +7,11 @@ from enum import Enum
 import numpy as np
 import pandas as pd
 
+from cards import StraddlePolicy, card_visits, label_cards, label_fixations_windows, label_windows
+from fixations import FIXATION_COLUMNS, FIXATION_DTYPES, fixations_frame, idt_fixations, ivt_fixations
+from gaze_file import read_gaze
+from stage_cache import arrays_digest, file_digest, frame_digest
+
 pd.options.display.float_format = '{:.10f}'.format
 
 
@@ -15,15 +20,44 @@ class EyetrackerData:
         PHASE_ONE = 1
         PHASE_TWO = 2
 
+    class FixationEngine(Enum):
+        """
+        Algorithms available for detecting fixations.
+        """
+        LEGACY = 1
+        IDT = 2
+        IVT = 3
+
+    class ExportFormat(Enum):
+        """
+        File formats for exporting the processed data.
+        """
+        EXCEL = 'xlsx'
+        PARQUET = 'parquet'
+        FEATHER = 'feather'
+        NPZ = 'npz'
+
     DISTANCE_THRESHOLD = 25
     DURATION_THRESHOLD = 100
-
-    def __init__(self, data_type, filepath, grid_shape, card_dim, window_dim, dist_cards):
+    # I-VT engine: samples faster than VELOCITY_THRESHOLD (px/ms) are saccades, consecutive fixations apart by up to
+    # MERGE_GAP (ms) and MERGE_DISTANCE (px) are merged
+    VELOCITY_THRESHOLD = 1.0
+    MERGE_GAP = 75
+    MERGE_DISTANCE = 25
+    # visits shorter than MIN_VISIT_DURATION are discarded, visits to the same card apart by up to VISIT_GAP_TOLERANCE are merged
+    MIN_VISIT_DURATION = 0
+    VISIT_GAP_TOLERANCE = None
+    # phase two: what to do with the fixations crossing the boundary between two cards (DROP: CARD -1, see StraddlePolicy)
+    STRADDLE_POLICY = StraddlePolicy.DROP
+
+    def __init__(self, data_type, filepath, grid_shape, card_dim, window_dim, dist_cards, screen_size=None, gaze=None):
         """
         Constructor for EyetrackerData.
 
         :param EyeTracker.DataType data_type: Game phase from which the data was acquired
         :param str filepath: Filename/Filepath containing the data
+        :param screen_size: (WIDTH, HEIGHT) of the screen where the game was shown (default: the current screen)
+        :param gaze: Gaze samples already in memory (GAZE_DTYPE, e.g. from a GazeStreamReceiver), read instead of filepath
         """
         self.data_type = data_type
         self.filepath = filepath
@@ -31,48 +65,42 @@ class EyetrackerData:
         self.card_dim = card_dim
         self.window_dim = window_dim
         self.dist_cards = dist_cards
+        self.gaze = gaze
+        self.screen_size = screen_size
         self.raw_gaze = None
         self.cards_boundaries = None
         self.fixations = None
         self.aggregated_gaze = None
         self.visits_cards = None
         self.aggregated_fixations = None
+        self.timestamps = None
+        self.output_folder = None
+        self.cache = None
 
     def get_cards_boundaries(self):
         """
         Returns boundaries of the cards on the GUI.
         """
-        root_rect = tkinter.Tk()
-        width = root_rect.winfo_screenwidth()
-        height = root_rect.winfo_screenheight()
-        root_rect.deiconify()
+        if self.screen_size is not None:
+            width, height = self.screen_size
+        else:
+            root_rect = tkinter.Tk()
+            width = root_rect.winfo_screenwidth()
+            height = root_rect.winfo_screenheight()
+            root_rect.deiconify()
 
-        self.cards_boundaries = []
-        for j in range(self.grid_shape[1]):
-            for k in range(self.grid_shape[0]):
-                x = ((width / 2) - (self.window_dim[0] / 2)) + (
-                        ((k + 1) * self.dist_cards) + (k * self.card_dim[0]))
-                y = ((height / 2) - (self.window_dim[1] / 2)) + (
-                        ((j + 1) * self.dist_cards) + (j * self.card_dim[1]))
-                self.cards_boundaries.append((x, y))
+        self.cards_boundaries = screen_cards_boundaries(self.grid_shape, self.card_dim, self.window_dim, self.dist_cards,
+                                                        (width, height))
 
     def get_data(self) -> pd.DataFrame:
         """
-        Gets raw gaze data from text file.
+        Gets raw gaze data from the gaze file (text or binary format), or from the samples in memory.
         :return: Raw gaze data.
         """
-        with open(self.filepath, "r") as file:
-            raw_data = file.readlines()
-
-        # text file structure:
-        # X_AXIS_1
-        # Y_AXIS_1
-        # TIMESTAMP_1
-        # [...]
-        self.raw_gaze = pd.DataFrame(
-            (np.array([[float(raw_data[i].strip()), float(raw_data[i + 1].strip()), int(raw_data[i + 2].strip())]
-                       for i in range(0, len(raw_data), 3)], dtype=np.int64)),
-            columns=['X_AXIS', 'Y_AXIS', 'TIMESTAMP'])
+        gaze = self.gaze if self.gaze is not None else read_gaze(self.filepath)
+        self.raw_gaze = pd.DataFrame({'X_AXIS': gaze['X_AXIS'].astype(np.int64),
+                                      'Y_AXIS': gaze['Y_AXIS'].astype(np.int64),
+                                      'TIMESTAMP': gaze['TIMESTAMP']})
 
         self.get_cards_boundaries()
 
@@ -98,13 +126,11 @@ class EyetrackerData:
         fixations = []
         current_fixation = []
 
-        print(self.raw_gaze.shape)
         for index, gaze in self.raw_gaze.iterrows():
             if not current_fixation:
                 current_fixation.append(gaze)
             else:
                 current_fixation.append(gaze)
-                print(index)
                 if max_distance(current_fixation) <= self.DISTANCE_THRESHOLD:
                     current_fixation.append(gaze)
                 else:
@@ -133,200 +159,395 @@ class EyetrackerData:
 
         return self.fixations
 
-    def aggregated_gaze_fixations(self, timestamps):
+    def get_fixations_idt(self) -> pd.DataFrame:
+        """
+        Returns fixations from raw gaze data, using the linear-time I-DT engine.
+        :return: Fixations.
+        """
+        self.fixations = idt_fixations(self.raw_gaze['X_AXIS'].to_numpy(), self.raw_gaze['Y_AXIS'].to_numpy(),
+                                       self.raw_gaze['TIMESTAMP'].to_numpy(), self.DISTANCE_THRESHOLD,
+                                       self.DURATION_THRESHOLD)
+
+        return self.fixations
+
+    def get_fixations_ivt(self) -> pd.DataFrame:
+        """
+        Returns fixations from raw gaze data, using the vectorized I-VT engine.
+        :return: Fixations.
+        """
+        self.fixations = ivt_fixations(self.raw_gaze['X_AXIS'].to_numpy(), self.raw_gaze['Y_AXIS'].to_numpy(),
+                                       self.raw_gaze['TIMESTAMP'].to_numpy(), self.VELOCITY_THRESHOLD,
+                                       self.DURATION_THRESHOLD, self.MERGE_DISTANCE, self.MERGE_GAP)
+
+        return self.fixations
+
+    def get_card_numbers(self, x, y) -> np.ndarray:
+        """
+        Returns the card (phase one grid) under each gaze point.
+        :param x: X coordinates.
+        :param y: Y coordinates.
+        :return: Card number (starting at 1) of each point, -1 if the point is not on a card.
+        """
+        return label_cards(x, y, self.cards_boundaries[0], self.grid_shape, self.card_dim, self.dist_cards)
+
+    def label_data(self, timestamps) -> dict:
         """
-        Aggregates gaze and fixations data by card.
-        :param list timestamps: List of timestamps of each card first appearance.
+        Labels gaze and fixations data with the card (CARD column).
+        :param list timestamps: List of timestamps of each card first appearance, followed by the end of the last one.
+        :return: Dictionary with the labeled raw_gaze and fixations.
         """
         if self.data_type == EyetrackerData.DataType.PHASE_ONE:
-            aggregated_gaze = []
-            visits_cards = []
-            for i in range(len(self.cards_boundaries)):
-                aggregated_gaze.append(list())
-                visits_cards.append(list())
-            prev_rect = None
-            for index, gaze in self.raw_gaze.iterrows():
-                i = 0
-                belongs = False
-                for j in range(len(self.cards_boundaries)):
-                    if ((self.cards_boundaries[j][0] <= gaze["X_AXIS"] <= self.cards_boundaries[j][0] + self.card_dim[
-                        0]) and
-                            (self.cards_boundaries[j][1] <= gaze["Y_AXIS"] <= self.cards_boundaries[j][1] +
-                             self.card_dim[
-                                 1])):
-                        belongs = True
-                        aggregated_gaze[i].append(gaze)
-                        if prev_rect != self.cards_boundaries[j]:
-                            visits_cards[i].append([gaze["TIMESTAMP"], gaze["TIMESTAMP"], 0])
-                        else:
-                            visits_cards[i][-1][1] = gaze["TIMESTAMP"]
-                            visits_cards[i][-1][2] = visits_cards[i][-1][1] - visits_cards[i][-1][0]
-                        prev_rect = self.cards_boundaries[j]
-                        break
-                    i = i + 1
-                if not belongs:
-                    prev_rect = None
-
-            self.aggregated_gaze = list()
-            self.visits_cards = list()
-            for i in range(len(self.cards_boundaries)):
-                self.aggregated_gaze.append(pd.DataFrame(aggregated_gaze[i], columns=["X_AXIS", "Y_AXIS", "TIMESTAMP"]))
-                self.visits_cards.append(
-                    pd.DataFrame(visits_cards[i], columns=["START_TIMESTAMP", "END_TIMESTAMP", "DURATION"]))
-
-            aggregated_fixations = []
-            for i in range(len(self.cards_boundaries)):
-                aggregated_fixations.append(list())
-            for index, fixation in self.fixations.iterrows():
-                i = 0
-                for coords in self.cards_boundaries:
-                    if (coords[0] <= fixation["X_AXIS"] <= coords[0] + self.card_dim[0]) and (
-                            coords[1] <= fixation["Y_AXIS"] <= coords[1] + self.card_dim[1]):
-                        aggregated_fixations[i].append(fixation)
-                        break
-                    i = i + 1
-
-            self.aggregated_fixations = list()
-            for i in range(len(self.cards_boundaries)):
-                self.aggregated_fixations.append(pd.DataFrame(aggregated_fixations[i],
-                                                              columns=['X_AXIS', 'Y_AXIS', 'DURATION',
-                                                                       'START_TIMESTAMP',
-                                                                       'END_TIMESTAMP']))
+            self.raw_gaze["CARD"] = self.get_card_numbers(self.raw_gaze["X_AXIS"], self.raw_gaze["Y_AXIS"])
+            self.fixations["CARD"] = self.get_card_numbers(self.fixations["X_AXIS"], self.fixations["Y_AXIS"])
 
         elif self.data_type == EyetrackerData.DataType.PHASE_TWO:
-            self.visits_cards = None
+            self.raw_gaze["CARD"] = label_windows(self.raw_gaze["TIMESTAMP"], timestamps)
+            self.fixations = label_fixations_windows(self.fixations, timestamps, self.STRADDLE_POLICY)
 
-            i = 0
-            aggregated_gaze = []
-            for _ in range(self.grid_shape[0] * self.grid_shape[1]):
-                aggregated_gaze.append(list())
-            for index, gaze in self.raw_gaze.iterrows():
-                if i == len(timestamps) - 1:
-                    break
-                if timestamps[i] <= gaze["TIMESTAMP"] < timestamps[i + 1]:
-                    aggregated_gaze[i].append(gaze)
-                else:
-                    i += 1
-                    if i == len(timestamps) - 1:
-                        break
-                    aggregated_gaze[i].append(gaze)
-
-            self.aggregated_gaze = list()
-            for i in range(len(self.cards_boundaries)):
-                self.aggregated_gaze.append(pd.DataFrame(aggregated_gaze[i], columns=["X_AXIS", "Y_AXIS", "TIMESTAMP"]))
-
-            i = 0
-            aggregated_fixations = []
-            for _ in range(self.grid_shape[0] * self.grid_shape[1]):
-                aggregated_fixations.append(list())
-            for index, fixation in self.fixations.iterrows():
-                if i == len(timestamps) - 1:
-                    break
-                if timestamps[i] <= fixation["START_TIMESTAMP"] < timestamps[i + 1] and timestamps[i] <= fixation[
-                    "END_TIMESTAMP"] < timestamps[i + 1]:
-                    aggregated_fixations[i].append(fixation)
-                elif timestamps[i + 2] > fixation["START_TIMESTAMP"] >= timestamps[i + 1] and timestamps[i + 2] > \
-                        fixation["END_TIMESTAMP"] >= timestamps[i + 1]:
-                    i += 1
-                    aggregated_fixations[i].append(fixation)
-                else:
-                    i += 1
+        return {"raw_gaze": self.raw_gaze, "fixations": self.fixations}
+
+    def get_visits(self):
+        """
+        Returns the visits to each card (phase one), from the labeled gaze data.
+        """
+        if self.data_type != EyetrackerData.DataType.PHASE_ONE:
+            return None
 
-            self.aggregated_fixations = list()
-            for i in range(len(self.cards_boundaries)):
-                self.aggregated_fixations.append(pd.DataFrame(aggregated_fixations[i],
-                                                              columns=['X_AXIS', 'Y_AXIS', 'DURATION',
-                                                                       'START_TIMESTAMP',
-                                                                       'END_TIMESTAMP']))
+        return card_visits(self.raw_gaze["CARD"], self.raw_gaze["TIMESTAMP"], self.MIN_VISIT_DURATION,
+                           self.VISIT_GAP_TOLERANCE)
 
-    def process_data(self, timestamps_phase_two=None):
+    def aggregate(self) -> dict:
         """
-        Process raw data to get fixations and aggregate data.
+        Aggregates the labeled gaze and fixations data by card.
+        :return: Dictionary with the gaze and fixations on the cards, sorted by card (in chronological order for each
+        card), see split_aggregated.
         """
-        # ADD CARD NUMBER TO DATA
-        def get_card_number(data):
-            if self.data_type == EyetrackerData.DataType.PHASE_ONE:
-                # PHASE ONE
-                for i, top_left in enumerate(self.cards_boundaries):
-                    if top_left[0] <= data[0] <= top_left[0] + self.card_dim[0] and top_left[1] <= data[1] <= top_left[1] + self.card_dim[1]:
-                        return i + 1
+        gaze_cards = self.raw_gaze["CARD"].to_numpy()
+        fixations_cards = self.fixations["CARD"].to_numpy()
+        gaze_order = np.argsort(gaze_cards, kind='stable')
+        fixations_order = np.argsort(fixations_cards, kind='stable')
+        gaze = self.raw_gaze.iloc[gaze_order[gaze_cards[gaze_order] >= 1]]
+        fixations = self.fixations.iloc[fixations_order[fixations_cards[fixations_order] >= 1]]
 
-                return -1
-            else:
-                # PHASE TWO
-                for i, window_start in enumerate(timestamps_phase_two):
-                    if i != 0:
-                        if data <= window_start:
-                            return i
-                return self.grid_shape[0] * self.grid_shape[1]
+        return {"gaze": gaze[["X_AXIS", "Y_AXIS", "TIMESTAMP", "CARD"]].reset_index(drop=True),
+                "fixations": fixations[FIXATION_COLUMNS + ["CARD"]].reset_index(drop=True)}
+
+    def split_aggregated(self, tables):
+        """
+        Splits the aggregated data (see aggregate) into one table per card (aggregated_gaze and aggregated_fixations).
+        """
+        cards = np.arange(1, len(self.cards_boundaries) + 2)
+        gaze_bounds = np.searchsorted(tables["gaze"]["CARD"].to_numpy(), cards)
+        fixations_bounds = np.searchsorted(tables["fixations"]["CARD"].to_numpy(), cards)
+        self.aggregated_gaze = [tables["gaze"].iloc[gaze_bounds[i]:gaze_bounds[i + 1]][["X_AXIS", "Y_AXIS", "TIMESTAMP"]]
+                                for i in range(len(self.cards_boundaries))]
+        self.aggregated_fixations = [tables["fixations"].iloc[fixations_bounds[i]:fixations_bounds[i + 1]][FIXATION_COLUMNS]
+                                     for i in range(len(self.cards_boundaries))]
+
+    def aggregated_gaze_fixations(self, timestamps):
+        """
+        Labels gaze and fixations data with the card (CARD column) and aggregates them by card.
+        :param list timestamps: List of timestamps of each card first appearance, followed by the end of the last one.
+        """
+        if self.data_type == EyetrackerData.DataType.PHASE_TWO:
+            self.timestamps = list(timestamps)
+        self.label_data(timestamps)
+        self.visits_cards = self.get_visits()
+        self.split_aggregated(self.aggregate())
 
-        self.get_data()
-        self.get_fixations()
-        self.aggregated_gaze_fixations(timestamps_phase_two)
+    def run_stage(self, stage, inputs, parameters, compute):
+        """
+        Executes a processing stage, or gets its output from the stage cache (see process_data).
+        :return: Tuple (key of the output or None without cache, dictionary of tables).
+        """
+        if self.cache is None:
+            return None, compute()
 
+        return self.cache.run(stage, inputs, parameters, compute)
+
+    def process_data(self, timestamps_phase_two=None, fixation_engine=FixationEngine.IDT, fixations=None, cache=None):
+        """
+        Process raw data to get fixations and aggregate data.
+        :param list timestamps_phase_two: List of timestamps of each card first appearance, followed by the end of the last one (phase two only).
+        :param EyetrackerData.FixationEngine fixation_engine: Algorithm used for detecting fixations.
+        :param list fixations: Fixations already detected while recording (e.g. by a FixationDetector), skips detection.
+        :param StageCache cache: If not None, the output of each stage (load, fixations, labels, visits, aggregation) is
+        cached under a key made from its inputs and parameters, and only the stages whose key changed are executed.
+        """
+        self.cache = cache
+        if self.data_type == EyetrackerData.DataType.PHASE_TWO:
+            self.timestamps = [int(timestamp) for timestamp in timestamps_phase_two]
+
+        # LOAD
+        source = None
+        if cache is not None:
+            source = arrays_digest(self.gaze) if self.gaze is not None else file_digest(self.filepath)
+        load_key, tables = self.run_stage("load", [source], {}, lambda: {"raw_gaze": self.get_data()})
+        self.raw_gaze = tables["raw_gaze"]
+        if self.cards_boundaries is None:
+            self.get_cards_boundaries()
+
+        # FIXATIONS
+        if fixations is not None:
+            self.fixations = fixations_frame(fixations)
+            fixations_key = frame_digest(self.fixations) if cache is not None else None
+        else:
+            if fixation_engine == EyetrackerData.FixationEngine.LEGACY:
+                detect = self.get_fixations
+            elif fixation_engine == EyetrackerData.FixationEngine.IVT:
+                detect = self.get_fixations_ivt
+            else:
+                detect = self.get_fixations_idt
+            parameters = {"ENGINE": fixation_engine.name, "DISTANCE_THRESHOLD": self.DISTANCE_THRESHOLD,
+                          "DURATION_THRESHOLD": self.DURATION_THRESHOLD}
+            if fixation_engine == EyetrackerData.FixationEngine.IVT:
+                parameters.update(VELOCITY_THRESHOLD=self.VELOCITY_THRESHOLD, MERGE_GAP=self.MERGE_GAP,
+                                  MERGE_DISTANCE=self.MERGE_DISTANCE)
+            fixations_key, tables = self.run_stage("fixations", [load_key], parameters,
+                                                   lambda: {"fixations": detect().astype(FIXATION_DTYPES)})
+            self.fixations = tables["fixations"]
+
+        # LABELS
+        labels_key, tables = self.run_stage("labels", [load_key, fixations_key],
+                                            {"DATA_TYPE": self.data_type.name, "CARDS_BOUNDARIES": self.cards_boundaries,
+                                             "GRID_SHAPE": self.grid_shape, "CARD_DIM": self.card_dim,
+                                             "DIST_CARDS": self.dist_cards, "WINDOWS": self.timestamps,
+                                             "STRADDLE_POLICY": self.STRADDLE_POLICY.name},
+                                            lambda: self.label_data(self.timestamps))
+        self.raw_gaze = tables["raw_gaze"]
+        self.fixations = tables["fixations"]
+
+        # VISITS
         if self.data_type == EyetrackerData.DataType.PHASE_ONE:
-            self.raw_gaze['CARD'] = self.raw_gaze.apply(lambda row: get_card_number((row['X_AXIS'], row['Y_AXIS'])), axis=1)
-            self.fixations['CARD'] = self.fixations.apply(lambda row: get_card_number((row['X_AXIS'], row['Y_AXIS'])), axis=1)
+            _, tables = self.run_stage("visits", [labels_key],
+                                       {"MIN_VISIT_DURATION": self.MIN_VISIT_DURATION, "VISIT_GAP_TOLERANCE": self.VISIT_GAP_TOLERANCE},
+                                       lambda: {"visits": self.get_visits()})
+            self.visits_cards = tables["visits"]
         else:
-            self.raw_gaze['CARD'] = self.raw_gaze.apply(lambda row: get_card_number(row['TIMESTAMP']), axis=1)
-            self.fixations['CARD'] = self.fixations.apply(lambda row: get_card_number(row['START_TIMESTAMP']), axis=1)
+            self.visits_cards = None
 
-    def export_data(self, output_folder):
+        # AGGREGATION
+        _, tables = self.run_stage("aggregation", [labels_key], {"CARDS": len(self.cards_boundaries)}, self.aggregate)
+        self.split_aggregated(tables)
+
+    def get_relevant_data(self) -> dict:
         """
-        Export data to Excel files and relevant data to JSON file.
+        Returns the relevant data (phase one).
         FEATURES:
+            - NUMBER OF VISITS
             - LONGEST VISIT
             - LONGEST FIXATION
             - CARD WITH MORE VISITS
             - CARD WITH LONGEST VISIT
             - CARD WITH LONGEST FIXATION
         """
-        number_of_visits = list()
-        longest_visit = list()
-        longest_fixation = list()
+        cards = range(1, self.grid_shape[0] * self.grid_shape[1] + 1)
+        visits_by_card = self.visits_cards.groupby("CARD")["DURATION"]
+        number_of_visits = visits_by_card.size().reindex(cards, fill_value=0).tolist()
+        longest_visit = visits_by_card.max().reindex(cards).tolist()
+        longest_fixation = self.fixations.groupby("CARD")["DURATION"].max().reindex(cards).tolist()
+
+        return relevant_data_from_features(self.cards_boundaries, number_of_visits, longest_visit, longest_fixation)
+
+    def get_markers(self):
+        """
+        Returns the bounds of the longest fixation and of the longest visit to a card (phase one), to be marked on the
+        physiological signals (see EmpaticaRawData).
+        """
+        if self.visits_cards is None:
+            return None
+
+        return markers_from_tables(self.fixations, self.visits_cards)
+
+    def get_tables(self) -> dict:
+        """
+        Returns the processed tables, each one with a CARD column: raw gaze, fixations and visits (phase one only).
+        """
+        tables = {"raw_gaze": self.raw_gaze, "fixations": self.fixations}
+        if self.visits_cards is not None:
+            tables["visits"] = self.visits_cards
+
+        return tables
 
+    def get_manifest(self) -> dict:
+        """
+        Returns the sidecar manifest of the exported data: phase, phase bounds, card windows (phase two) and markers
+        (phase one, see get_markers), so the other scripts (e.g. EmpaticaRawData) do not need to parse the exported tables to get them.
+        """
+        timestamps = self.raw_gaze["TIMESTAMP"]
+        return {"DATA_TYPE": self.data_type.name,
+                "START_TIMESTAMP": int(timestamps.iloc[0]) if len(timestamps) > 0 else None,
+                "END_TIMESTAMP": int(timestamps.iloc[-1]) if len(timestamps) > 0 else None,
+                "CARD_WINDOWS": None if self.timestamps is None else [int(timestamp) for timestamp in self.timestamps],
+                "MARKERS": self.get_markers(),
+                "RAW_GAZE": None}
+
+    def export_excel(self, output_folder):
+        """
+        Export data to Excel files (report format, with one sheet per card).
+        """
         with pd.ExcelWriter(os.path.join(output_folder, "raw_gaze.xlsx")) as writer:
             self.raw_gaze.to_excel(writer, sheet_name="RAW_GAZE", index=False)
             for i, sheet in enumerate(self.aggregated_gaze):
                 sheet.to_excel(writer, sheet_name="CARD_" + str(i + 1) + "_GAZE", index=False)
             if self.visits_cards is not None:
-                for i, sheet in enumerate(self.visits_cards):
-                    sheet.to_excel(writer, sheet_name="CARD_" + str(i + 1) + "_VISITS", index=False)
-                    number_of_visits.append(self.visits_cards[i].shape[0])
-                    longest_visit.append(self.visits_cards[i]['DURATION'].max())
+                self.visits_cards.to_excel(writer, sheet_name="VISITS", index=False)
 
         with pd.ExcelWriter(os.path.join(output_folder, "fixations.xlsx")) as writer:
             self.fixations.to_excel(writer, sheet_name="FIXATIONS", index=False)
             for i, sheet in enumerate(self.aggregated_fixations):
                 sheet.to_excel(writer, sheet_name="CARD_" + str(i + 1) + "_FIXATIONS", index=False)
-                longest_fixation.append(self.aggregated_fixations[i]['DURATION'].max())
+
+    def export_data(self, output_folder, export_format=ExportFormat.NPZ):
+        """
+        Export data to files, the manifest to a JSON file and relevant data to JSON file (phase one).
+        :param str output_folder: Folder where the files are written.
+        :param EyetrackerData.ExportFormat export_format: Format of the files. The columnar formats write each table
+        once (raw_gaze, fixations and visits), with a CARD column; EXCEL also writes one sheet per card.
+        """
+        if export_format == EyetrackerData.ExportFormat.EXCEL:
+            self.export_excel(output_folder)
+        else:
+            for name, table in self.get_tables().items():
+                write_table(table, os.path.join(output_folder, name + "." + export_format.value), export_format)
+        self.output_folder = output_folder
+
+        manifest = self.get_manifest()
+        manifest["RAW_GAZE"] = "raw_gaze." + export_format.value
+        with open(os.path.join(output_folder, "manifest.json"), "w") as outfile:
+            json.dump(manifest, outfile)
 
         if self.data_type == EyetrackerData.DataType.PHASE_ONE:
-            relevant_data = {"COORDS": dict(), "NUMBER_VISITS": dict(), "LONGEST_VISITS": dict(), "LONGEST_FIXATIONS": dict(), "CARD_WITH_MORE_VISITS": 0, "CARD_WITH_LONGEST_VISIT": 0, "CARD_WITH_LONGEST_FIXATION": 0}
-            for i in range(self.grid_shape[0] * self.grid_shape[1]):
-                card = "CARD_" + str(i + 1)
-                relevant_data["COORDS"][card] = {"X": self.cards_boundaries[i][0], "Y": self.cards_boundaries[i][1]}
-                if number_of_visits[i] is None or pd.isna(number_of_visits[i]):
-                    relevant_data["NUMBER_VISITS"][card] = 0
-                else:
-                    relevant_data["NUMBER_VISITS"][card] = float(number_of_visits[i])
+            with open(os.path.join(output_folder, "relevant_data.json"), "w") as outfile:
+                json.dump(self.get_relevant_data(), outfile)
+
+
+def screen_cards_boundaries(grid_shape, card_dim, window_dim, dist_cards, screen_size) -> list:
+    """
+    Returns the top left corner (screen coordinates) of each card of the grid, row by row, with the window centered on
+    the screen.
+    :param screen_size: (WIDTH, HEIGHT) of the screen.
+    """
+    width, height = screen_size
+    cards_boundaries = []
+    for j in range(grid_shape[1]):
+        for k in range(grid_shape[0]):
+            x = ((width / 2) - (window_dim[0] / 2)) + (((k + 1) * dist_cards) + (k * card_dim[0]))
+            y = ((height / 2) - (window_dim[1] / 2)) + (((j + 1) * dist_cards) + (j * card_dim[1]))
+            cards_boundaries.append((x, y))
+
+    return cards_boundaries
+
+
+def relevant_data_from_features(cards_boundaries, number_of_visits, longest_visit, longest_fixation) -> dict:
+    """
+    Builds the relevant data (see EyetrackerData.get_relevant_data) from the features of each card.
+    :param cards_boundaries: Top left corner of each card.
+    :param list number_of_visits: Number of visits to each card.
+    :param list longest_visit: Duration of the longest visit to each card (NaN if none).
+    :param list longest_fixation: Duration of the longest fixation on each card (NaN if none).
+    :return: Relevant data.
+    """
+    relevant_data = {"COORDS": dict(), "NUMBER_VISITS": dict(), "LONGEST_VISITS": dict(), "LONGEST_FIXATIONS": dict(), "CARD_WITH_MORE_VISITS": 0, "CARD_WITH_LONGEST_VISIT": 0, "CARD_WITH_LONGEST_FIXATION": 0}
+    for i in range(len(cards_boundaries)):
+        card = "CARD_" + str(i + 1)
+        relevant_data["COORDS"][card] = {"X": cards_boundaries[i][0], "Y": cards_boundaries[i][1]}
+        if number_of_visits[i] is None or pd.isna(number_of_visits[i]):
+            relevant_data["NUMBER_VISITS"][card] = 0
+        else:
+            relevant_data["NUMBER_VISITS"][card] = float(number_of_visits[i])
 
-                if longest_visit[i] is None or pd.isna(longest_visit[i]):
-                    relevant_data["LONGEST_VISITS"][card] = 0
-                else:
-                    relevant_data["LONGEST_VISITS"][card] = float(longest_visit[i])
+        if longest_visit[i] is None or pd.isna(longest_visit[i]):
+            relevant_data["LONGEST_VISITS"][card] = 0
+        else:
+            relevant_data["LONGEST_VISITS"][card] = float(longest_visit[i])
 
-                if longest_fixation[i] is None or pd.isna(longest_fixation[i]):
-                    relevant_data["LONGEST_FIXATIONS"][card] = 0
-                else:
-                    relevant_data["LONGEST_FIXATIONS"][card] = float(longest_fixation[i])
+        if longest_fixation[i] is None or pd.isna(longest_fixation[i]):
+            relevant_data["LONGEST_FIXATIONS"][card] = 0
+        else:
+            relevant_data["LONGEST_FIXATIONS"][card] = float(longest_fixation[i])
 
-            longest_visit = [0 if math.isnan(x) else x for x in longest_visit]
-            longest_fixation = [0 if math.isnan(x) else x for x in longest_fixation]
+    longest_visit = [0 if math.isnan(x) else x for x in longest_visit]
+    longest_fixation = [0 if math.isnan(x) else x for x in longest_fixation]
 
-            relevant_data["CARD_WITH_MORE_VISITS"] = "CARD_" + str(number_of_visits.index(max(number_of_visits)) + 1)
-            relevant_data["CARD_WITH_LONGEST_VISIT"] = "CARD_" + str(longest_visit.index(max(longest_visit)) + 1)
-            relevant_data["CARD_WITH_LONGEST_FIXATION"] = "CARD_" + str(longest_fixation.index(max(longest_fixation)) + 1)
+    relevant_data["CARD_WITH_MORE_VISITS"] = "CARD_" + str(number_of_visits.index(max(number_of_visits)) + 1)
+    relevant_data["CARD_WITH_LONGEST_VISIT"] = "CARD_" + str(longest_visit.index(max(longest_visit)) + 1)
+    relevant_data["CARD_WITH_LONGEST_FIXATION"] = "CARD_" + str(longest_fixation.index(max(longest_fixation)) + 1)
 
-            with open(os.path.join(output_folder, "relevant_data.json"), "w") as outfile:
-                json.dump(relevant_data, outfile)
+    return relevant_data
+
+
+def markers_from_tables(fixations, visits) -> dict:
+    """
+    Gets the bounds of the longest fixation on a card and of the longest visit.
+    :param fixations: Fixations, with a CARD column.
+    :param visits: Visits (see card_visits).
+    :return: Dictionary with LONGEST_FIXATION and LONGEST_VISIT: [START_TIMESTAMP, END_TIMESTAMP] (or None).
+    """
+    markers = dict()
+    for name, table in (("LONGEST_FIXATION", fixations[fixations["CARD"] != -1]), ("LONGEST_VISIT", visits)):
+        if len(table) == 0:
+            markers[name] = None
+        else:
+            longest = table.loc[table["DURATION"].idxmax()]
+            markers[name] = [int(longest["START_TIMESTAMP"]), int(longest["END_TIMESTAMP"])]
+
+    return markers
+
+
+def write_table(table, path, export_format):
+    """
+    Writes a table in a columnar format.
+    :param pd.DataFrame table: Table to write.
+    :param str path: Path to the file.
+    :param EyetrackerData.ExportFormat export_format: PARQUET, FEATHER (both require pyarrow) or NPZ.
+    """
+    if export_format == EyetrackerData.ExportFormat.PARQUET:
+        table.to_parquet(path, index=False)
+    elif export_format == EyetrackerData.ExportFormat.FEATHER:
+        table.reset_index(drop=True).to_feather(path)
+    elif export_format == EyetrackerData.ExportFormat.NPZ:
+        np.savez(path, **{column: table[column].to_numpy() for column in table.columns})
+    else:
+        raise ValueError("Invalid export format: " + str(export_format))
+
+
+def read_table(path) -> pd.DataFrame:
+    """
+    Reads a table written by write_table (format from the file extension).
+    :param str path: Path to the file.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".parquet":
+        return pd.read_parquet(path)
+    elif extension == ".feather":
+        return pd.read_feather(path)
+    elif extension == ".npz":
+        with np.load(path) as columns:
+            return pd.DataFrame({column: columns[column] for column in columns.files})
+    else:
+        raise ValueError("Invalid table file: " + str(path))
+
+
+def read_tables(output_folder) -> dict:
+    """
+    Reads the tables exported by EyetrackerData.export_data in a columnar format.
+    :param str output_folder: Folder where the files were written.
+    :return: Dictionary with the raw_gaze, fixations and visits (if present) tables.
+    """
+    tables = dict()
+    for file in sorted(os.listdir(output_folder)):
+        name, extension = os.path.splitext(file)
+        if name in ("raw_gaze", "fixations", "visits") and extension in (".parquet", ".feather", ".npz"):
+            tables[name] = read_table(os.path.join(output_folder, file))
+
+    return tables
+
+
+def read_manifest(output_folder) -> dict:
+    """
+    Reads the manifest written by EyetrackerData.export_data.
+    :param str output_folder: Folder where the files were written.
+    """
+    with open(os.path.join(output_folder, "manifest.json"), "r") as infile:
+        return json.load(infile)
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+
+FIXATION_COLUMNS = ['X_AXIS', 'Y_AXIS', 'DURATION', 'START_TIMESTAMP', 'END_TIMESTAMP']
+FIXATION_DTYPES = {'X_AXIS': np.float64, 'Y_AXIS': np.float64, 'DURATION': np.int64, 'START_TIMESTAMP': np.int64,
+                   'END_TIMESTAMP': np.int64}
+
+
+def fixations_frame(fixations) -> pd.DataFrame:
+    """
+    Builds the fixations table, with typed columns even when there are no fixations.
+    :param fixations: List of [X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP] fixations.
+    """
+    return pd.DataFrame(fixations, columns=FIXATION_COLUMNS).astype(FIXATION_DTYPES)
+
+
+class FixationDetector:
+    """
+    Online dispersion-threshold (I-DT) fixation detector.
+    Gaze samples are pushed one at a time, as they arrive, and each fixation is returned as soon as
+    the first sample outside of it is pushed.
+    A fixation keeps growing while the diagonal of the bounding box of its samples is at most
+    distance_threshold. The diagonal is an upper bound of the maximum distance between any two
+    samples, so only the bounding box and the running sums of the current fixation are kept:
+    each sample costs O(1) and memory is constant.
+    Every fixation shorter than duration_threshold is discarded.
+    """
+
+    def __init__(self, distance_threshold=25, duration_threshold=100):
+        """
+        Constructor for FixationDetector.
+        :param distance_threshold: Maximum dispersion (px) of a fixation.
+        :param duration_threshold: Minimum duration (ms) of a fixation.
+        """
+        self.distance_threshold = distance_threshold
+        self.duration_threshold = duration_threshold
+        self.threshold_squared = distance_threshold ** 2
+        self.count = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.min_x = self.max_x = 0.0
+        self.min_y = self.max_y = 0.0
+        self.start_timestamp = 0
+        self.end_timestamp = 0
+
+    def start(self, x, y, timestamp):
+        """
+        Starts a new fixation candidate with a single sample.
+        """
+        self.count = 1
+        self.sum_x = x
+        self.sum_y = y
+        self.min_x = self.max_x = x
+        self.min_y = self.max_y = y
+        self.start_timestamp = timestamp
+        self.end_timestamp = timestamp
+
+    def current_fixation(self):
+        """
+        Returns the fixation being built, if it already is long enough.
+        :return: [X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP] or None.
+        """
+        duration = self.end_timestamp - self.start_timestamp
+        if self.count < 2 or duration < self.duration_threshold:
+            return None
+
+        return [self.sum_x / self.count, self.sum_y / self.count, duration, self.start_timestamp, self.end_timestamp]
+
+    def push(self, x, y, timestamp):
+        """
+        Adds a gaze sample.
+        :param x: X coordinate of the gaze sample.
+        :param y: Y coordinate of the gaze sample.
+        :param timestamp: Timestamp (ms) of the gaze sample.
+        :return: Fixation completed by this sample ([X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP]) or None.
+        """
+        if self.count == 0:
+            self.start(x, y, timestamp)
+            return None
+
+        min_x = min(self.min_x, x)
+        max_x = max(self.max_x, x)
+        min_y = min(self.min_y, y)
+        max_y = max(self.max_y, y)
+        if (max_x - min_x) ** 2 + (max_y - min_y) ** 2 <= self.threshold_squared:
+            self.min_x, self.max_x, self.min_y, self.max_y = min_x, max_x, min_y, max_y
+            self.sum_x += x
+            self.sum_y += y
+            self.count += 1
+            self.end_timestamp = timestamp
+            return None
+
+        fixation = self.current_fixation()
+        self.start(x, y, timestamp)
+
+        return fixation
+
+    def flush(self):
+        """
+        Ends the data stream: returns the last fixation (if any) and resets the detector.
+        :return: Last fixation ([X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP]) or None.
+        """
+        fixation = self.current_fixation()
+        self.count = 0
+
+        return fixation
+
+
+def stream_fixations(samples, distance_threshold=25, duration_threshold=100):
+    """
+    Generator of fixations from an iterable of gaze samples, yielding each one as soon as it is complete.
+    :param samples: Iterable of (X, Y, TIMESTAMP) gaze samples.
+    :param distance_threshold: Maximum dispersion (px) of a fixation.
+    :param duration_threshold: Minimum duration (ms) of a fixation.
+    """
+    detector = FixationDetector(distance_threshold, duration_threshold)
+    for x, y, timestamp in samples:
+        fixation = detector.push(x, y, timestamp)
+        if fixation is not None:
+            yield fixation
+
+    fixation = detector.flush()
+    if fixation is not None:
+        yield fixation
+
+
+def idt_fixations(x, y, timestamps, distance_threshold, duration_threshold) -> pd.DataFrame:
+    """
+    Dispersion-threshold (I-DT) fixation detection in linear time (see FixationDetector).
+    :param x: X coordinates of the gaze samples.
+    :param y: Y coordinates of the gaze samples.
+    :param timestamps: Timestamps (ms) of the gaze samples.
+    :param distance_threshold: Maximum dispersion (px) of a fixation.
+    :param duration_threshold: Minimum duration (ms) of a fixation.
+    :return: Fixations (X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP).
+    """
+    samples = zip(np.asarray(x, dtype=np.float64).tolist(), np.asarray(y, dtype=np.float64).tolist(),
+                  np.asarray(timestamps, dtype=np.int64).tolist())
+
+    return fixations_frame(list(stream_fixations(samples, distance_threshold, duration_threshold)))
+
+
+def ivt_fixations(x, y, timestamps, velocity_threshold, duration_threshold, merge_distance, merge_gap) -> pd.DataFrame:
+    """
+    Velocity-threshold (I-VT) fixation detection, vectorized.
+    Each sample is a fixation sample if the velocity (px/ms) from the previous sample is at most velocity_threshold,
+    otherwise a saccade sample (the first sample takes the velocity of the second). Each run of fixation samples is a
+    fixation; consecutive fixations apart by up to merge_gap (ms) whose centers are up to merge_distance (px) apart
+    are merged, and then every fixation shorter than duration_threshold is discarded.
+    :param x: X coordinates of the gaze samples.
+    :param y: Y coordinates of the gaze samples.
+    :param timestamps: Timestamps (ms) of the gaze samples.
+    :param velocity_threshold: Maximum velocity (px/ms) of a fixation sample.
+    :param duration_threshold: Minimum duration (ms) of a fixation.
+    :param merge_distance: Maximum distance (px) between the centers of two merged fixations.
+    :param merge_gap: Maximum time (ms) between two merged fixations.
+    :return: Fixations (X_AXIS, Y_AXIS, DURATION, START_TIMESTAMP, END_TIMESTAMP).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(x) < 2:
+        return fixations_frame([])
+
+    # velocity of each sample, from the previous one (a repeated timestamp counts as 1 ms)
+    velocity = np.hypot(np.diff(x), np.diff(y)) / np.maximum(np.diff(timestamps), 1)
+    fixation = np.concatenate(([velocity[0] <= velocity_threshold], velocity <= velocity_threshold))
+
+    # runs of fixation samples: [starts[i], ends[i])
+    edges = np.diff(np.concatenate(([0], fixation.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return fixations_frame([])
+
+    # sums of the coordinates of each run
+    cumulative_x = np.concatenate(([0.0], np.cumsum(x)))
+    cumulative_y = np.concatenate(([0.0], np.cumsum(y)))
+    sum_x = cumulative_x[ends] - cumulative_x[starts]
+    sum_y = cumulative_y[ends] - cumulative_y[starts]
+    count = ends - starts
+
+    # merge each run into the previous one if they are close in time and space (centers before merging)
+    gap = timestamps[starts[1:]] - timestamps[ends[:-1] - 1]
+    distance = np.hypot(np.diff(sum_x / count), np.diff(sum_y / count))
+    merged = np.concatenate(([False], (gap <= merge_gap) & (distance <= merge_distance)))
+    first = np.flatnonzero(~merged)
+    last = np.concatenate((first[1:], [len(starts)])) - 1
+    sum_x = np.add.reduceat(sum_x, first)
+    sum_y = np.add.reduceat(sum_y, first)
+    count = np.add.reduceat(count, first)
+    start_timestamps = timestamps[starts[first]]
+    end_timestamps = timestamps[ends[last] - 1]
+
+    durations = end_timestamps - start_timestamps
+    kept = (durations >= duration_threshold) & (count >= 2)
+
+    return pd.DataFrame({'X_AXIS': sum_x[kept] / count[kept], 'Y_AXIS': sum_y[kept] / count[kept],
+                         'DURATION': durations[kept], 'START_TIMESTAMP': start_timestamps[kept],
+                         'END_TIMESTAMP': end_timestamps[kept]}, columns=FIXATION_COLUMNS).astype(FIXATION_DTYPES)
@@ -0,0 +1,336 @@
+import os
+
+import numpy as np
+
+# one gaze sample
+GAZE_DTYPE = np.dtype([('X_AXIS', '<f4'), ('Y_AXIS', '<f4'), ('TIMESTAMP', '<i8')])
+
+# binary format: header followed by fixed-width GAZE_DTYPE records
+BINARY_MAGIC = b"GAZEBIN"
+BINARY_VERSION = 1
+BINARY_HEADER_DTYPE = np.dtype([('MAGIC', 'S8'), ('VERSION', '<u4'), ('SCREEN_WIDTH', '<u4'),
+                                ('SCREEN_HEIGHT', '<u4'), ('RATE', '<f4'), ('RESERVED', 'S8')])
+
+# pupil capture (eyetracker_connection.py): header followed by fixed-width PUPIL_DTYPE records, appended in chunks
+# (gaze points on the display area, pupil diameters and validities of both eyes, device and system timestamps in us)
+PUPIL_DTYPE = np.dtype([('LEFT_X', '<f4'), ('LEFT_Y', '<f4'), ('RIGHT_X', '<f4'), ('RIGHT_Y', '<f4'),
+                        ('LEFT_PUPIL', '<f4'), ('RIGHT_PUPIL', '<f4'),
+                        ('LEFT_GAZE_VALIDITY', 'i1'), ('RIGHT_GAZE_VALIDITY', 'i1'),
+                        ('LEFT_PUPIL_VALIDITY', 'i1'), ('RIGHT_PUPIL_VALIDITY', 'i1'),
+                        ('DEVICE_TIME_STAMP', '<i8'), ('SYSTEM_TIME_STAMP', '<i8')])
+PUPIL_MAGIC = b"PUPILBIN"
+PUPIL_VERSION = 1
+# TIMESTAMP_CORRECTION (ms): added to SYSTEM_TIME_STAMP (in ms) to get the time of the computer (see corrected_timestamps)
+PUPIL_HEADER_DTYPE = np.dtype([('MAGIC', 'S8'), ('VERSION', '<u4'), ('SCREEN_WIDTH', '<u4'), ('SCREEN_HEIGHT', '<u4'),
+                               ('RESERVED', 'S4'), ('TIMESTAMP_CORRECTION', '<i8')])
+
+# rough size of a sample in the text format, used for sizing the reads
+TEXT_BYTES_PER_SAMPLE = 24
+
+
+def values_to_gaze(values) -> np.ndarray:
+    """
+    Converts the flat sequence of values of the text format into gaze samples.
+    An incomplete last sample (recorder killed mid-write) is ignored.
+    :param values: X_AXIS_1, Y_AXIS_1, TIMESTAMP_1, X_AXIS_2, ...
+    :return: Structured array of gaze samples (GAZE_DTYPE).
+    """
+    values = values[:len(values) - len(values) % 3].reshape(-1, 3)
+    gaze = np.empty(len(values), dtype=GAZE_DTYPE)
+    gaze['X_AXIS'] = values[:, 0]
+    gaze['Y_AXIS'] = values[:, 1]
+    gaze['TIMESTAMP'] = values[:, 2]
+
+    return gaze
+
+
+def read_gaze_text(filepath) -> np.ndarray:
+    """
+    Reads the whole gaze text file (written by TobiiDemo.java) at once, parsing it straight into NumPy.
+    text file structure:
+    X_AXIS_1
+    Y_AXIS_1
+    TIMESTAMP_1
+    [...]
+    :param filepath: Path to the text file.
+    :return: Structured array of gaze samples (GAZE_DTYPE).
+    """
+    values = np.fromfile(filepath, dtype=np.float64, sep=' ')
+
+    # a last line without line break may have been cut while being written
+    with open(filepath, "rb") as file:
+        file.seek(0, 2)
+        if file.tell() > 0:
+            file.seek(-1, 2)
+            if file.read(1) != b"\n":
+                values = values[:-1]
+
+    return values_to_gaze(values)
+
+
+def iter_gaze_text(filepath, chunk_size=65536):
+    """
+    Reads the gaze text file (written by TobiiDemo.java) in blocks of chunk_size samples (the last one may be
+    smaller), so long recordings can be processed without keeping the whole text in memory.
+    :param filepath: Path to the text file.
+    :param chunk_size: Number of samples of each block.
+    """
+    values = np.empty(0, dtype=np.float64)
+    pending = b""
+    with open(filepath, "rb") as file:
+        while True:
+            data = file.read(chunk_size * TEXT_BYTES_PER_SAMPLE)
+            if not data:
+                break
+
+            # only parse complete lines, the rest is kept for the next read
+            data = pending + data
+            cut = data.rfind(b"\n") + 1
+            pending = data[cut:]
+            values = np.concatenate((values, np.fromstring(data[:cut], dtype=np.float64, sep=' ')))
+
+            while len(values) >= 3 * chunk_size:
+                yield values_to_gaze(values[:3 * chunk_size])
+                values = values[3 * chunk_size:]
+
+    # the pending text (last line without line break) may have been cut while being written
+    if len(values) >= 3:
+        yield values_to_gaze(values)
+
+
+def is_gaze_binary(filepath):
+    """
+    Checks if a gaze file is in the binary format.
+    :param filepath: Path to the gaze file.
+    """
+    with open(filepath, "rb") as file:
+        return file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def header_to_dict(header):
+    """
+    :param header: Binary gaze file header (BINARY_HEADER_DTYPE record).
+    :return: Dictionary with VERSION, SCREEN_WIDTH, SCREEN_HEIGHT and RATE.
+    """
+    return {"VERSION": int(header['VERSION']), "SCREEN_WIDTH": int(header['SCREEN_WIDTH']),
+            "SCREEN_HEIGHT": int(header['SCREEN_HEIGHT']), "RATE": float(header['RATE'])}
+
+
+def read_gaze_binary_header(filepath):
+    """
+    Reads the header of a binary gaze file.
+    :param filepath: Path to the binary file.
+    :return: Dictionary with VERSION, SCREEN_WIDTH, SCREEN_HEIGHT and RATE.
+    """
+    header = np.fromfile(filepath, dtype=BINARY_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['MAGIC'] != BINARY_MAGIC:
+        raise ValueError("Not a binary gaze file: " + str(filepath))
+    if header[0]['VERSION'] != BINARY_VERSION:
+        raise ValueError("Unsupported binary gaze file version: " + str(header[0]['VERSION']))
+
+    return header_to_dict(header[0])
+
+
+def read_gaze_binary(filepath):
+    """
+    Memory-maps a binary gaze file, without copying the samples.
+    An incomplete last record (writer killed mid-write) is ignored.
+    :param filepath: Path to the binary file.
+    :return: Tuple (header, samples): header dictionary and read-only structured array (GAZE_DTYPE).
+    """
+    header = read_gaze_binary_header(filepath)
+    number_samples = (os.path.getsize(filepath) - BINARY_HEADER_DTYPE.itemsize) // GAZE_DTYPE.itemsize
+    if number_samples <= 0:
+        return header, np.empty(0, dtype=GAZE_DTYPE)
+
+    return header, np.memmap(filepath, dtype=GAZE_DTYPE, mode='r', offset=BINARY_HEADER_DTYPE.itemsize,
+                             shape=(number_samples,))
+
+
+class GazeBinaryWriter:
+    """
+    Appends gaze samples to a binary gaze file, creating it (with its header) if it does not exist.
+    """
+
+    def __init__(self, filepath, screen_size=(0, 0), rate=0.0):
+        """
+        Constructor for GazeBinaryWriter.
+        :param filepath: Path to the binary file.
+        :param screen_size: (WIDTH, HEIGHT) of the screen, in pixels.
+        :param rate: Nominal sampling rate (Hz).
+        """
+        self.filepath = filepath
+        if os.path.isfile(filepath) and os.path.getsize(filepath) > 0:
+            self.header = read_gaze_binary_header(filepath)
+            # drop an incomplete last record, so the new ones stay aligned
+            size = os.path.getsize(filepath) - BINARY_HEADER_DTYPE.itemsize
+            self.file = open(filepath, "r+b")
+            self.file.truncate(BINARY_HEADER_DTYPE.itemsize + size - size % GAZE_DTYPE.itemsize)
+            self.file.seek(0, 2)
+        else:
+            header = np.zeros(1, dtype=BINARY_HEADER_DTYPE)
+            header['MAGIC'] = BINARY_MAGIC
+            header['VERSION'] = BINARY_VERSION
+            header['SCREEN_WIDTH'] = screen_size[0]
+            header['SCREEN_HEIGHT'] = screen_size[1]
+            header['RATE'] = rate
+            self.file = open(filepath, "wb")
+            self.file.write(header.tobytes())
+            self.header = header_to_dict(header[0])
+
+    def append(self, gaze):
+        """
+        Appends gaze samples.
+        :param gaze: Structured array of gaze samples (GAZE_DTYPE or with the same fields).
+        """
+        self.file.write(np.asarray(gaze).astype(GAZE_DTYPE, copy=False).tobytes())
+
+    def flush(self):
+        """
+        Writes the buffered samples to disk.
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
+
+
+def convert_gaze_text(text_path, binary_path=None, screen_size=(0, 0), rate=64.0):
+    """
+    Converts a gaze text file (GAZE-DATA-*.txt) to the binary format, block by block.
+    :param text_path: Path to the text file.
+    :param binary_path: Path to the binary file (default: same name, with .gaze extension).
+    :param screen_size: (WIDTH, HEIGHT) of the screen, in pixels.
+    :param rate: Nominal sampling rate (Hz).
+    :return: Path to the binary file.
+    """
+    if binary_path is None:
+        binary_path = os.path.splitext(text_path)[0] + ".gaze"
+
+    writer = GazeBinaryWriter(binary_path, screen_size, rate)
+    for block in iter_gaze_text(text_path):
+        writer.append(block)
+    writer.close()
+
+    return binary_path
+
+
+def read_gaze(filepath) -> np.ndarray:
+    """
+    Reads a gaze file, in the text or the binary format.
+    :param filepath: Path to the gaze file.
+    :return: Structured array of gaze samples (GAZE_DTYPE).
+    """
+    if is_gaze_binary(filepath):
+        return read_gaze_binary(filepath)[1]
+
+    return read_gaze_text(filepath)
+
+
+def is_pupil_binary(filepath):
+    """
+    Checks if a file is a pupil capture file (binary format).
+    :param filepath: Path to the file.
+    """
+    with open(filepath, "rb") as file:
+        return file.read(len(PUPIL_MAGIC)) == PUPIL_MAGIC
+
+
+def read_pupil_binary_header(filepath):
+    """
+    Reads the header of a pupil capture file.
+    :param filepath: Path to the binary file.
+    :return: Dictionary with VERSION, SCREEN_WIDTH, SCREEN_HEIGHT and TIMESTAMP_CORRECTION.
+    """
+    header = np.fromfile(filepath, dtype=PUPIL_HEADER_DTYPE, count=1)
+    if len(header) == 0 or header[0]['MAGIC'] != PUPIL_MAGIC:
+        raise ValueError("Not a pupil capture file: " + str(filepath))
+    if header[0]['VERSION'] != PUPIL_VERSION:
+        raise ValueError("Unsupported pupil capture file version: " + str(header[0]['VERSION']))
+
+    return {"VERSION": int(header[0]['VERSION']), "SCREEN_WIDTH": int(header[0]['SCREEN_WIDTH']),
+            "SCREEN_HEIGHT": int(header[0]['SCREEN_HEIGHT']),
+            "TIMESTAMP_CORRECTION": int(header[0]['TIMESTAMP_CORRECTION'])}
+
+
+def read_pupil_binary(filepath):
+    """
+    Memory-maps a pupil capture file, without copying the samples.
+    An incomplete last record (capture killed mid-write) is ignored.
+    :param filepath: Path to the binary file.
+    :return: Tuple (header, samples): header dictionary and read-only structured array (PUPIL_DTYPE).
+    """
+    header = read_pupil_binary_header(filepath)
+    number_samples = (os.path.getsize(filepath) - PUPIL_HEADER_DTYPE.itemsize) // PUPIL_DTYPE.itemsize
+    if number_samples <= 0:
+        return header, np.empty(0, dtype=PUPIL_DTYPE)
+
+    return header, np.memmap(filepath, dtype=PUPIL_DTYPE, mode='r', offset=PUPIL_HEADER_DTYPE.itemsize,
+                             shape=(number_samples,))
+
+
+def corrected_timestamps(samples, timestamp_correction) -> np.ndarray:
+    """
+    :param samples: Structured array of pupil capture samples (PUPIL_DTYPE).
+    :param timestamp_correction: TIMESTAMP_CORRECTION of the file (ms).
+    :return: Timestamp (ms, time of the computer) of each sample.
+    """
+    return samples['SYSTEM_TIME_STAMP'] // 1000 + timestamp_correction
+
+
+class PupilBinaryWriter:
+    """
+    Appends pupil capture samples to a binary file, creating it (with its header) if it does not exist.
+    Each chunk is synced to disk, so a crash only loses the samples not yet appended.
+    """
+
+    def __init__(self, filepath, timestamp_correction=0, screen_size=(0, 0)):
+        """
+        Constructor for PupilBinaryWriter.
+        :param filepath: Path to the binary file.
+        :param timestamp_correction: See PUPIL_HEADER_DTYPE (ignored if the file exists).
+        :param screen_size: (WIDTH, HEIGHT) of the screen, in pixels (ignored if the file exists).
+        """
+        self.filepath = filepath
+        if os.path.isfile(filepath) and os.path.getsize(filepath) > 0:
+            self.header = read_pupil_binary_header(filepath)
+            # drop an incomplete last record, so the new ones stay aligned
+            size = os.path.getsize(filepath) - PUPIL_HEADER_DTYPE.itemsize
+            self.file = open(filepath, "r+b")
+            self.file.truncate(PUPIL_HEADER_DTYPE.itemsize + size - size % PUPIL_DTYPE.itemsize)
+            self.file.seek(0, 2)
+        else:
+            header = np.zeros(1, dtype=PUPIL_HEADER_DTYPE)
+            header['MAGIC'] = PUPIL_MAGIC
+            header['VERSION'] = PUPIL_VERSION
+            header['SCREEN_WIDTH'] = screen_size[0]
+            header['SCREEN_HEIGHT'] = screen_size[1]
+            header['TIMESTAMP_CORRECTION'] = timestamp_correction
+            self.file = open(filepath, "wb")
+            self.file.write(header.tobytes())
+            self.sync()
+            self.header = read_pupil_binary_header(filepath)
+
+    def append(self, samples):
+        """
+        Appends a chunk of samples and syncs it to disk.
+        :param samples: Structured array of samples (PUPIL_DTYPE or with the same fields).
+        """
+        self.file.write(np.asarray(samples).astype(PUPIL_DTYPE, copy=False).tobytes())
+        self.sync()
+
+    def sync(self):
+        """
+        Writes the buffered samples to disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
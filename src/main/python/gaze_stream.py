@@ -0,0 +1,141 @@
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from gaze_file import GAZE_DTYPE
+
+# stream protocol (TobiiDemo.java): frames of [length (uint32, little-endian), type (1 byte), payload], the length
+# counting the type and the payload
+FRAME_HEADER = struct.Struct("<IB")
+# Python -> recorder: command (ASCII): WRITE (stream and archive to a GAZE-DATA-*.txt file), STREAM (only stream), STOP
+FRAME_COMMAND = ord("C")
+# recorder -> Python: gaze samples (GAZE_DTYPE records), path of the archive file (UTF-8), end of the recording
+FRAME_SAMPLES = ord("S")
+FRAME_ARCHIVE = ord("F")
+FRAME_END = ord("E")
+
+
+class GazeStreamReceiver:
+    """
+    Receives the gaze samples from the Java recorder (TobiiDemo.java) over a persistent local connection, as they are
+    recorded, into an in-memory buffer (see the stream protocol above), so they can be processed during the game and
+    right after it, without reading the recording from disk. The recorder only writes the file if asked to (archive).
+    """
+
+    def __init__(self, host="localhost", port=1234):
+        """
+        Constructor for GazeStreamReceiver (connects to the recorder).
+        :param host: Host of the recorder.
+        :param port: Port of the recorder.
+        """
+        self.socket = socket.create_connection((host, port))
+        self.buffer = bytearray()
+        self.polled = 0
+        self.archive_path = None
+        self.lock = threading.Lock()
+        self.ended = threading.Event()
+        self.ended.set()
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+    def send_command(self, command):
+        """
+        Sends a command (WRITE, STREAM or STOP) to the recorder.
+        """
+        payload = command.encode("ascii")
+        self.socket.sendall(FRAME_HEADER.pack(len(payload) + 1, FRAME_COMMAND) + payload)
+
+    def receive_exactly(self, size):
+        """
+        :return: The next size bytes of the connection, or None if it was closed.
+        """
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                return None
+            data.extend(chunk)
+
+        return data
+
+    def receive(self):
+        """
+        Receives the frames of the recorder until the connection is closed (runs in its own thread).
+        """
+        while True:
+            try:
+                header = self.receive_exactly(FRAME_HEADER.size)
+                payload = self.receive_exactly(FRAME_HEADER.unpack(header)[0] - 1) if header is not None else None
+            except OSError:
+                payload = None
+            if payload is None:
+                self.ended.set()
+                return
+
+            frame_type = FRAME_HEADER.unpack(header)[1]
+            if frame_type == FRAME_SAMPLES:
+                with self.lock:
+                    self.buffer.extend(payload)
+            elif frame_type == FRAME_ARCHIVE:
+                self.archive_path = payload.decode("utf-8")
+            elif frame_type == FRAME_END:
+                self.ended.set()
+
+    def start_recording(self, archive=True):
+        """
+        Starts a new recording (the samples of the previous one are discarded).
+        :param archive: Also write the recording to a GAZE-DATA-*.txt file (see archive_path).
+        """
+        with self.lock:
+            self.buffer = bytearray()
+            self.polled = 0
+        self.archive_path = None
+        self.ended.clear()
+        self.send_command("WRITE" if archive else "STREAM")
+
+    def stop_recording(self, timeout=5.0) -> np.ndarray:
+        """
+        Stops the recording and waits for its end (sent by the recorder after its last sample and after closing the
+        archive file) or for the connection to be closed.
+        :param timeout: Maximum time (s) to wait for the recorder (None: no limit).
+        :return: Structured array (GAZE_DTYPE) with every sample of the recording.
+        :raises TimeoutError: If the recording did not end in time (its last samples may be missing).
+        """
+        self.send_command("STOP")
+        if not self.ended.wait(timeout):
+            raise TimeoutError("The recorder did not end the recording within {} s".format(timeout))
+
+        return self.samples()
+
+    def samples(self) -> np.ndarray:
+        """
+        :return: Structured array (GAZE_DTYPE) with every sample received so far.
+        """
+        with self.lock:
+            size = len(self.buffer) - len(self.buffer) % GAZE_DTYPE.itemsize
+            return np.frombuffer(bytes(self.buffer[:size]), dtype=GAZE_DTYPE)
+
+    def poll(self):
+        """
+        Returns the gaze samples received since the last call.
+        :return: List of (X_AXIS, Y_AXIS, TIMESTAMP) tuples.
+        """
+        with self.lock:
+            size = len(self.buffer) - len(self.buffer) % GAZE_DTYPE.itemsize
+            new = np.frombuffer(bytes(self.buffer[self.polled:size]), dtype=GAZE_DTYPE)
+            self.polled = size
+
+        return new.tolist()
+
+    def close(self):
+        """
+        Closes the connection to the recorder.
+        """
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+        self.thread.join()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# part of every key: increase it when the output of a stage changes for the same inputs and parameters
+CACHE_VERSION = 1
+# separates the table name from the column name in the cache files
+SEPARATOR = "__"
+
+
+def file_digest(path, block_size=1 << 20):
+    """
+    :return: Digest of the content of a file.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def arrays_digest(*arrays):
+    """
+    :return: Digest of the content (dtype, shape and values) of some arrays.
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        digest.update(str((array.dtype.str, array.shape)).encode("utf-8"))
+        digest.update(array.tobytes())
+
+    return digest.hexdigest()
+
+
+def frame_digest(frame):
+    """
+    :return: Digest of the content (columns and values) of a table.
+    """
+    return arrays_digest(np.array(list(frame.columns), dtype=str), *(frame[column].to_numpy() for column in frame.columns))
+
+
+class StageCache:
+    """
+    Content-addressed cache of the outputs of the processing stages.
+    The output of a stage (one or more tables) is stored under a key made from the stage name, the keys (or
+    digests) of its inputs and its parameters, so it is executed again only if one of them changes; as the key of
+    a stage is an input of the next ones, they are executed again too.
+    """
+
+    def __init__(self, folder):
+        """
+        Constructor for StageCache.
+        :param folder: Folder of the cached outputs (shared by every session).
+        """
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self.executed = list()
+
+    @staticmethod
+    def key(stage, inputs, parameters):
+        """
+        :param stage: Name of the stage.
+        :param inputs: Keys or digests of the inputs.
+        :param parameters: Dictionary of parameters (JSON serializable, NumPy scalars included).
+        :return: Key of the output of the stage.
+        """
+        description = json.dumps([CACHE_VERSION, stage, list(inputs), parameters], sort_keys=True,
+                                 default=lambda value: value.item() if hasattr(value, "item") else str(value))
+
+        return stage + "-" + hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def path(self, key):
+        """
+        :return: Path of the cached output.
+        """
+        return os.path.join(self.folder, key + ".npz")
+
+    def load(self, key):
+        """
+        :return: Dictionary of tables, or None if not cached.
+        """
+        if not os.path.isfile(self.path(key)):
+            return None
+
+        tables = dict()
+        with np.load(self.path(key)) as columns:
+            for name in columns.files:
+                table, column = name.split(SEPARATOR, 1)
+                tables.setdefault(table, dict())[column] = columns[name]
+
+        return {table: pd.DataFrame(columns) for table, columns in tables.items()}
+
+    def store(self, key, tables):
+        """
+        Stores the tables of a stage (written to a temporary file first, so a reader never gets a partial file).
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        columns = {table + SEPARATOR + column: frame[column].to_numpy()
+                   for table, frame in tables.items() for column in frame.columns}
+        temporary_path = os.path.join(self.folder, key + "." + str(os.getpid()) + ".tmp.npz")
+        np.savez(temporary_path, **columns)
+        os.replace(temporary_path, self.path(key))
+
+    def run(self, stage, inputs, parameters, compute):
+        """
+        Gets the output of a stage from the cache, executing it only if it is not cached.
+        :param stage: Name of the stage.
+        :param inputs: Keys or digests of the inputs.
+        :param parameters: Dictionary of parameters.
+        :param compute: Function executing the stage, returning a dictionary of tables.
+        :return: Tuple (key, dictionary of tables).
+        """
+        key = self.key(stage, inputs, parameters)
+        tables = self.load(key)
+        if tables is None:
+            self.misses += 1
+            self.executed.append(stage)
+            tables = compute()
+            self.store(key, tables)
+        else:
+            self.hits += 1
+
+        return key, tables
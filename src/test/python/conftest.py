@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+
+# the scripts of src/main/python are run from their folder and import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "main", "python"))
+
+
+def write_gaze_recording(path, seed=0, count=3000, fixation_samples=30, interval=16, jitter=0, start=1700000000000):
+    """
+    Writes a synthetic gaze text recording (as TobiiDemo.java): fixations of fixation_samples samples, with a little
+    noise, anywhere on a 1920x1080 screen.
+    :param seed: Seed of the positions (and intervals).
+    :param interval: Time (ms) between two samples, plus or minus up to jitter.
+    :param start: Timestamp (ms) of the first sample.
+    :return: Tuple (x, y, timestamps) arrays of the samples.
+    """
+    rng = np.random.default_rng(seed)
+    fixations = count // fixation_samples + 1
+    x = np.repeat(rng.uniform(0, 1920, fixations), fixation_samples)[:count] + rng.normal(0, 2, count)
+    y = np.repeat(rng.uniform(0, 1080, fixations), fixation_samples)[:count] + rng.normal(0, 2, count)
+    x, y = np.round(x).astype(np.int64), np.round(y).astype(np.int64)
+    steps = rng.integers(interval - jitter, interval + jitter + 1, count)
+    steps[0] = 0
+    timestamps = start + np.cumsum(steps)
+    with open(path, "w") as outfile:
+        for sample in zip(x, y, timestamps):
+            outfile.write("{}\n{}\n{}\n".format(*sample))
+
+    return x, y, timestamps
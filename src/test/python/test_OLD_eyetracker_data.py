@@ -0,0 +1,61 @@
+import pickle
+
+import numpy as np
+
+from OLD_eyetracker_data import data_by_card_period_gaze_pupil, read_file_gaze_pupil
+from gaze_file import PUPIL_DTYPE, PupilBinaryWriter, corrected_timestamps
+
+CORRECTION = 5000
+COUNT = 3000
+
+
+def capture_samples(count=COUNT):
+    """
+    Returns pupil capture samples (PUPIL_DTYPE) at about 120 Hz.
+    """
+    samples = np.zeros(count, dtype=PUPIL_DTYPE)
+    samples["LEFT_X"] = np.arange(count) % 997 / 1000
+    samples["LEFT_PUPIL"] = 3.25
+    samples["LEFT_PUPIL_VALIDITY"] = 1
+    samples["DEVICE_TIME_STAMP"] = 10 ** 9 + np.arange(count)
+    samples["SYSTEM_TIME_STAMP"] = 2 * 10 ** 12 + 8333 * np.arange(count)
+
+    return samples
+
+
+def test_split_matches_legacy_capture(tmp_path):
+    samples = capture_samples()
+    writer = PupilBinaryWriter(str(tmp_path / "capture.bin"), CORRECTION, (1920, 1080))
+    writer.append(samples)
+    writer.close()
+    with open(tmp_path / "capture.pkl", "wb") as file:
+        pickle.dump([CORRECTION] + [{"left_gaze_point_on_display_area": (float(sample["LEFT_X"]), 0.0),
+                                     "system_time_stamp": int(sample["SYSTEM_TIME_STAMP"])} for sample in samples], file)
+
+    correction, binary = read_file_gaze_pupil(str(tmp_path / "capture.bin"))
+    legacy_correction, legacy = read_file_gaze_pupil(str(tmp_path / "capture.pkl"))
+    assert correction == legacy_correction == CORRECTION
+    assert isinstance(binary, np.memmap)
+
+    times = corrected_timestamps(binary, correction)
+    windows = [int(times[100]), int(times[900]), int(times[1500]), int(times[2500])]
+    cards = data_by_card_period_gaze_pupil(binary, correction, windows)
+    legacy_cards = data_by_card_period_gaze_pupil(legacy, legacy_correction, windows)
+
+    # as in the legacy split, the samples before the first window go to the first card
+    assert [len(card) for card in cards] == [len(card) for card in legacy_cards] == [900, 600, 1000]
+    for card, legacy_card in zip(cards, legacy_cards):
+        np.testing.assert_array_equal(corrected_timestamps(card, correction),
+                                      [gaze["system_time_stamp"] for gaze in legacy_card])
+
+
+def test_split_returns_views(tmp_path):
+    samples = capture_samples()
+    original = samples.copy()
+    windows = [int(time) for time in corrected_timestamps(samples, CORRECTION)[[0, 1000, 2000]]]
+    cards = data_by_card_period_gaze_pupil(samples, CORRECTION, windows)
+
+    assert all(np.shares_memory(card, samples) for card in cards)
+    np.testing.assert_array_equal(samples, original)
+    # the samples are not converted: SYSTEM_TIME_STAMP stays in us
+    np.testing.assert_array_equal(cards[1]["SYSTEM_TIME_STAMP"], original["SYSTEM_TIME_STAMP"][1000:2000])
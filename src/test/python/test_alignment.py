@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+from alignment import Alignment, align_stream, align_streams, common_timebase
+
+TIMESTAMPS = [100, 200, 300, 500]
+VALUES = [1.0, 2.0, 4.0, 8.0]
+
+
+def test_common_timebase():
+    assert common_timebase(1000, 1100, 50).tolist() == [1000, 1020, 1040, 1060, 1080, 1100]
+    assert common_timebase(1000, 1099, 64).tolist() == [1000, 1016, 1031, 1047, 1062, 1078, 1094]
+    assert common_timebase(1000, 1000, 4).tolist() == [1000]
+
+
+def test_interpolate():
+    aligned = align_stream(TIMESTAMPS, VALUES, [50, 100, 150, 400, 600])
+
+    assert aligned.tolist() == [1.0, 1.0, 1.5, 6.0, 8.0]
+
+
+def test_asof_and_nearest():
+    target = [50, 100, 149, 151, 399, 401, 600]
+
+    assert np.isnan(align_stream(TIMESTAMPS, VALUES, target, Alignment.ASOF)[0])
+    assert align_stream(TIMESTAMPS, VALUES, target, Alignment.ASOF)[1:].tolist() == [1.0, 1.0, 1.0, 4.0, 4.0, 8.0]
+    # a tie goes to the earlier sample
+    assert align_stream(TIMESTAMPS, VALUES, target + [150], Alignment.NEAREST).tolist() == [1.0, 1.0, 1.0, 2.0, 4.0,
+                                                                                           8.0, 8.0, 1.0]
+
+
+def test_matches_merge_asof():
+    rng = np.random.default_rng(0)
+    timestamps = np.sort(rng.choice(100000, 2000, replace=False))
+    values = rng.normal(size=2000)
+    target = common_timebase(-500, 100500, 64)
+    frame = pd.DataFrame({"TIMESTAMP": timestamps, "VALUE": values})
+    left = pd.DataFrame({"TIMESTAMP": target})
+
+    for method, direction in ((Alignment.ASOF, "backward"), (Alignment.NEAREST, "nearest")):
+        for tolerance in (None, 20):
+            expected = pd.merge_asof(left, frame, on="TIMESTAMP", direction=direction, tolerance=tolerance)["VALUE"]
+            aligned = align_stream(timestamps, values, target, method, tolerance)
+            if method == Alignment.NEAREST and tolerance is None:
+                # merge_asof leaves no NaN either, but may break the ties differently
+                assert not np.isnan(aligned).any()
+                continue
+            np.testing.assert_array_equal(aligned, expected.to_numpy())
+
+
+def test_tolerance():
+    target = [100, 150, 400]
+
+    assert np.isnan(align_stream(TIMESTAMPS, VALUES, target, tolerance=40)).tolist() == [False, True, True]
+    assert align_stream(TIMESTAMPS, VALUES, target, tolerance=100).tolist() == [1.0, 1.5, 6.0]
+    assert np.isnan(align_stream([], [], target)).all()
+
+
+def test_align_streams():
+    accelerometer = np.array([[1, 2, 3], [3, 4, 5]], dtype=np.float64)
+    aligned = align_streams([0, 50, 100], {"eda": ([0, 100], [0.0, 1.0]), "accelerometer": ([0, 100], accelerometer)})
+
+    assert list(aligned.columns) == ["TIMESTAMP", "eda", "accelerometer_x", "accelerometer_y", "accelerometer_z"]
+    assert aligned.values.tolist() == [[0, 0.0, 1, 2, 3], [50, 0.5, 2, 3, 4], [100, 1.0, 3, 4, 5]]
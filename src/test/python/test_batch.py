@@ -0,0 +1,113 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch import find_sessions, process_session, process_sessions, read_windows, recording_phase
+from conftest import write_gaze_recording
+from eyetracker_data import EyetrackerData
+
+
+def write_recording(folder, name, start=1700000000000, count=600):
+    """
+    Writes a GAZE-DATA-* text recording with a fixation of 10 samples every 100 ms.
+    :return: Path to the recording.
+    """
+    path = os.path.join(folder, "GAZE-DATA-" + name + ".txt")
+    write_gaze_recording(path, seed=len(name), count=count, fixation_samples=10, interval=10, start=start)
+
+    return path
+
+
+def write_windows(recording, start=1700000000000, count=600):
+    """
+    Writes the card windows of a phase two recording (<recording>.windows.json): 21 cards over the recording.
+    """
+    windows = [int(window) for window in np.linspace(start, start + 10 * count, 22)]
+    with open(os.path.splitext(recording)[0] + ".windows.json", "w") as outfile:
+        json.dump(windows, outfile)
+
+    return windows
+
+
+def test_flat_folder_is_paired_in_order(tmp_path):
+    # two games written by the GUI to the same folder
+    recordings = [write_recording(tmp_path, "2024-01-01-10-0{}-00-000".format(minute)) for minute in range(4)]
+    sessions = find_sessions(str(tmp_path))
+
+    assert [(session["PHASE_ONE"], session["PHASE_TWO"]) for session in sessions] == [(recordings[0], recordings[1]),
+                                                                                      (recordings[2], recordings[3])]
+    assert all(session["SESSION"] == str(tmp_path) and "ERROR" not in session for session in sessions)
+
+
+def test_unpaired_recordings_are_reported(tmp_path):
+    recordings = [write_recording(tmp_path, "2024-01-01-10-0{}-00-000".format(minute)) for minute in range(4)]
+    # the second recording is a phase one (its game was interrupted), the third one a phase two
+    os.makedirs(os.path.splitext(recordings[1])[0] + "_PHASE_ONE")
+    write_windows(recordings[2])
+    sessions = find_sessions(str(tmp_path))
+
+    assert [(session["PHASE_ONE"], session["PHASE_TWO"], "ERROR" in session) for session in sessions] == [
+        (recordings[0], None, True), (recordings[1], recordings[2], False), (recordings[3], None, True)]
+
+    row = process_session(sessions[0], (1920, 1080), EyetrackerData.ExportFormat.NPZ, ())
+    assert row["STATUS"] == "FAILED" and row["ERROR"] == "Recording of phase one without phase two"
+    assert not os.path.exists(os.path.splitext(recordings[0])[0] + "_PHASE_ONE")
+
+
+def test_phase_two_without_phase_one(tmp_path):
+    recording = write_recording(tmp_path, "2024-01-01-10-00-00-000")
+    write_windows(recording)
+    sessions = find_sessions(str(tmp_path))
+
+    assert recording_phase(recording) == EyetrackerData.DataType.PHASE_TWO
+    assert [(session["PHASE_ONE"], session["PHASE_TWO"]) for session in sessions] == [(None, recording)]
+    assert sessions[0]["ERROR"] == "Recording of phase two without phase one"
+
+
+def test_session_subfolders(tmp_path):
+    for name in ("a", "b"):
+        os.makedirs(tmp_path / name)
+        write_recording(tmp_path / name, "2024-01-01-10-00-00-000")
+        write_recording(tmp_path / name, "2024-01-01-10-05-00-000")
+    (tmp_path / "notes.txt").write_text("not a recording")
+    sessions = find_sessions(str(tmp_path))
+
+    assert [session["SESSION"] for session in sessions] == [str(tmp_path / "a"), str(tmp_path / "b")]
+
+
+def test_read_windows_from_legacy_workbook(tmp_path):
+    recording = write_recording(tmp_path, "2024-01-01-10-00-00-000")
+    output_folder = os.path.splitext(recording)[0] + "_PHASE_TWO"
+    os.makedirs(output_folder)
+    raw_gaze = pd.DataFrame({"X_AXIS": [1, 2, 3, 4], "Y_AXIS": [1, 2, 3, 4], "TIMESTAMP": [100, 110, 120, 130]})
+    with pd.ExcelWriter(os.path.join(output_folder, "raw_gaze.xlsx")) as writer:
+        raw_gaze.to_excel(writer, sheet_name="RAW_GAZE", index=False)
+        raw_gaze.iloc[:2].to_excel(writer, sheet_name="CARD_1_GAZE", index=False)
+        raw_gaze.iloc[2:].to_excel(writer, sheet_name="CARD_2_GAZE", index=False)
+
+    assert recording_phase(recording) == EyetrackerData.DataType.PHASE_TWO
+    assert [int(window) for window in read_windows(recording)] == [100, 120, 131]
+
+
+def test_read_windows_missing(tmp_path):
+    recording = write_recording(tmp_path, "2024-01-01-10-00-00-000")
+
+    with pytest.raises(FileNotFoundError):
+        read_windows(recording)
+
+
+def test_process_sessions_summary(tmp_path):
+    first = write_recording(tmp_path, "2024-01-01-10-00-00-000")
+    second = write_recording(tmp_path, "2024-01-01-10-05-00-000")
+    write_windows(second)
+    extra = write_recording(tmp_path, "2024-01-01-10-10-00-000")
+    summary = process_sessions(str(tmp_path), workers=1, variables=(), use_cache=False)
+
+    assert summary["PHASE_ONE"].tolist() == [first, extra]
+    assert summary["STATUS"].tolist() == ["OK", "FAILED"]
+    assert summary["GAZE_SAMPLES_ONE"].iloc[0] == 600
+    assert os.path.isfile(os.path.join(os.path.splitext(second)[0] + "_PHASE_TWO", "manifest.json"))
+    assert pd.read_csv(tmp_path / "summary.csv")["STATUS"].tolist() == ["OK", "FAILED"]
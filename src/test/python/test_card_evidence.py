@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from card_evidence import CardEvidence
+from conftest import write_gaze_recording
+from eyetracker_data import EyetrackerData, screen_cards_boundaries
+from fixations import FixationDetector
+
+# game layout (GUI.py) on a 1920x1080 screen
+GRID_SHAPE = (7, 3)
+CARD_DIM = (200, 300)
+DIST_CARDS = 10
+WINDOW_DIM = (1480, 1025)
+SCREEN_SIZE = (1920, 1080)
+BOUNDARIES = screen_cards_boundaries(GRID_SHAPE, CARD_DIM, WINDOW_DIM, DIST_CARDS, SCREEN_SIZE)
+
+
+def card_center(card):
+    """
+    :return: (X, Y) center of a card (starting at 1).
+    """
+    left, top = BOUNDARIES[card - 1]
+
+    return left + CARD_DIM[0] / 2, top + CARD_DIM[1] / 2
+
+
+def test_visits_and_fixations():
+    evidence = CardEvidence(BOUNDARIES, GRID_SHAPE, CARD_DIM, DIST_CARDS, min_visit_duration=0, visit_gap_tolerance=50)
+    samples = [(3, 0), (3, 100), (-1, 120), (3, 150), (5, 200), (5, 400), (-1, 500), (5, 700), (5, 710)]
+    for card, timestamp in samples:
+        x, y = card_center(card) if card != -1 else (0, 0)
+        evidence.push_sample(x, y, timestamp)
+    evidence.push_fixation([*card_center(5), 180, 200, 380])
+    evidence.push_fixation([*card_center(3), 90, 0, 90])
+    evidence.push_fixation([0, 0, 500, 500, 1000])
+
+    dwell_time, number_of_visits, longest_visit, longest_fixation = evidence.features()
+    # card 3: one visit (back within 50 ms), card 5: two visits (the second one still open)
+    assert (dwell_time[2], number_of_visits[2], longest_visit[2]) == (150, 1, 150)
+    assert (dwell_time[4], number_of_visits[4], longest_visit[4]) == (210, 2, 200)
+    assert (longest_fixation[2], longest_fixation[4]) == (90, 180)
+    assert np.isnan(longest_visit[0]) and np.isnan(longest_fixation[0])
+    assert evidence.card_with_longest_fixation() == 4
+
+
+@pytest.mark.parametrize("min_visit_duration, visit_gap_tolerance", [(0, None), (100, None), (0, 50), (150, 300)])
+def test_matches_offline_processing(tmp_path, monkeypatch, min_visit_duration, visit_gap_tolerance):
+    monkeypatch.setattr(EyetrackerData, "MIN_VISIT_DURATION", min_visit_duration)
+    monkeypatch.setattr(EyetrackerData, "VISIT_GAP_TOLERANCE", visit_gap_tolerance)
+    recording = str(tmp_path / "GAZE-DATA-2024-01-01-10-00-00-000.txt")
+    x, y, timestamps = write_gaze_recording(recording, seed=min_visit_duration, interval=20, jitter=20)
+
+    # live, as in the GUI
+    detector = FixationDetector(EyetrackerData.DISTANCE_THRESHOLD, EyetrackerData.DURATION_THRESHOLD)
+    evidence = CardEvidence(BOUNDARIES, GRID_SHAPE, CARD_DIM, DIST_CARDS, min_visit_duration, visit_gap_tolerance)
+    fixations = list()
+    for sample in zip(x, y, timestamps):
+        evidence.push_sample(*sample)
+        fixation = detector.push(*sample)
+        if fixation is not None:
+            fixations.append(fixation)
+            evidence.push_fixation(fixation)
+    fixation = detector.flush()
+    if fixation is not None:
+        fixations.append(fixation)
+        evidence.push_fixation(fixation)
+
+    phase = EyetrackerData(EyetrackerData.DataType.PHASE_ONE, recording, GRID_SHAPE, CARD_DIM, WINDOW_DIM, DIST_CARDS,
+                           SCREEN_SIZE)
+    phase.process_data(fixations=fixations)
+    dwell_time = phase.visits_cards.groupby("CARD")["DURATION"].sum().reindex(range(1, 22), fill_value=0).tolist()
+
+    assert evidence.get_relevant_data() == phase.get_relevant_data()
+    assert evidence.features()[0] == dwell_time
@@ -0,0 +1,82 @@
+import numpy as np
+
+from cards import (StraddlePolicy, card_visits, grid_from_boundaries, label_card, label_cards,
+                   label_fixations_windows, label_windows)
+from eyetracker_data import screen_cards_boundaries
+from fixations import fixations_frame
+
+# game layout (GUI.py) on a 1920x1080 screen
+GRID_SHAPE = (7, 3)
+CARD_DIM = (200, 300)
+DIST_CARDS = 10
+WINDOW_DIM = (1480, 1025)
+BOUNDARIES = screen_cards_boundaries(GRID_SHAPE, CARD_DIM, WINDOW_DIM, DIST_CARDS, (1920, 1080))
+ORIGIN = BOUNDARIES[0]
+
+
+def test_grid_from_boundaries():
+    assert grid_from_boundaries(BOUNDARIES, CARD_DIM) == (ORIGIN, GRID_SHAPE, DIST_CARDS)
+
+
+def test_label_cards_at_boundaries():
+    left, top = BOUNDARIES[8]     # card 9: second row, second column
+    right, bottom = left + CARD_DIM[0], top + CARD_DIM[1]
+    points = [(left, top, 9), (right, bottom, 9), ((left + right) / 2, (top + bottom) / 2, 9),
+              (left - 0.5, top, -1), (right + 0.5, top, -1), (left, top - 0.5, -1), (left, bottom + 0.5, -1),
+              (left - DIST_CARDS, top, 8), (right + DIST_CARDS, bottom, 10)]
+    x, y, cards = zip(*points)
+
+    assert label_cards(x, y, ORIGIN, GRID_SHAPE, CARD_DIM, DIST_CARDS).tolist() == list(cards)
+
+
+def test_label_cards_outside_the_grid():
+    last_left, last_top = BOUNDARIES[-1]
+    right, bottom = last_left + CARD_DIM[0], last_top + CARD_DIM[1]
+    x = [right, right + 0.5, ORIGIN[0] - 0.5, ORIGIN[0], -100, 5000]
+    y = [bottom, bottom, ORIGIN[1], bottom + 0.5, 500, 500]
+
+    # the right and bottom edges of the last card are still on it
+    assert label_cards(x, y, ORIGIN, GRID_SHAPE, CARD_DIM, DIST_CARDS).tolist() == [21, -1, -1, -1, -1, -1]
+
+
+def test_label_card_matches_label_cards():
+    rng = np.random.default_rng(0)
+    x = np.concatenate((rng.uniform(0, 1920, 5000), [corner[0] for corner in BOUNDARIES]))
+    y = np.concatenate((rng.uniform(0, 1080, 5000), [corner[1] + CARD_DIM[1] for corner in BOUNDARIES]))
+    cards = label_cards(x, y, ORIGIN, GRID_SHAPE, CARD_DIM, DIST_CARDS)
+
+    assert [label_card(x[i], y[i], ORIGIN, GRID_SHAPE, CARD_DIM, DIST_CARDS) for i in range(len(x))] == cards.tolist()
+    assert cards[-len(BOUNDARIES):].tolist() == list(range(1, len(BOUNDARIES) + 1))
+
+
+def test_card_visits():
+    cards = [1, 1, 1, -1, 1, 1, 2, 2, -1, -1, 3]
+    timestamps = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+    visits = card_visits(cards, timestamps)
+
+    assert visits.values.tolist() == [[1, 0, 20, 20], [1, 40, 50, 10], [2, 60, 70, 10], [3, 100, 100, 0]]
+    assert card_visits(cards, timestamps, min_duration=10)['CARD'].tolist() == [1, 1, 2]
+    # the two visits to card 1 are 20 ms apart
+    assert card_visits(cards, timestamps, max_gap=20).values.tolist()[0] == [1, 0, 50, 50]
+    assert card_visits([], []).empty
+
+
+def test_label_windows():
+    windows = [100, 200, 300]
+
+    assert label_windows([99, 100, 199, 200, 299, 300], windows).tolist() == [-1, 1, 1, 2, 2, -1]
+
+
+def test_label_fixations_windows():
+    windows = [100, 200, 300]
+    fixations = fixations_frame([[10, 10, 50, 120, 170], [20, 20, 60, 180, 240], [30, 30, 30, 250, 280],
+                                 [40, 40, 40, 60, 100], [50, 50, 30, 300, 330]])
+
+    assert label_fixations_windows(fixations, windows, StraddlePolicy.DROP)['CARD'].tolist() == [1, -1, 2, -1, -1]
+    assert label_fixations_windows(fixations, windows, StraddlePolicy.START)['CARD'].tolist() == [1, 1, 2, -1, -1]
+
+    # a fixation ending exactly on the first window start does not reach it
+    split = label_fixations_windows(fixations, windows, StraddlePolicy.SPLIT)
+    assert split[['X_AXIS', 'CARD', 'START_TIMESTAMP', 'END_TIMESTAMP', 'DURATION']].values.tolist() == [
+        [10, 1, 120, 170, 50], [20, 1, 180, 200, 20], [20, 2, 200, 240, 40], [30, 2, 250, 280, 30],
+        [40, -1, 60, 100, 40], [50, -1, 300, 330, 30]]
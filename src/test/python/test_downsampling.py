@@ -0,0 +1,45 @@
+import numpy as np
+
+from downsampling import Downsampling, downsample_indices, lttb_indices, minmax_indices
+
+
+def test_minmax_keeps_the_extremes_of_each_bucket():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=10007)
+    values[1234] = 50
+    values[8765] = -50
+    indices = minmax_indices(values, 100)
+
+    assert len(indices) <= 200 and np.all(np.diff(indices) > 0)
+    assert 1234 in indices and 8765 in indices
+    width = int(np.ceil(len(values) / 100))
+    for start in range(0, len(values), width):
+        bucket = values[start:start + width]
+        assert start + np.argmin(bucket) in indices and start + np.argmax(bucket) in indices
+
+
+def test_minmax_short_last_bucket():
+    # buckets of 3 samples, the last one with a single sample
+    assert minmax_indices([3, 1, 2, 5, 4, 0, 9], 3).tolist() == [0, 1, 3, 5, 6]
+
+
+def test_lttb():
+    x = np.arange(1000)
+    y = np.sin(x / 50)
+    y[500] = 10
+    indices = lttb_indices(x, y, 50)
+
+    assert len(indices) == 50 and np.all(np.diff(indices) > 0)
+    assert indices[0] == 0 and indices[-1] == 999
+    assert 500 in indices
+
+
+def test_downsample_indices():
+    x = np.arange(5000)
+    y = np.cos(x / 100)
+
+    assert downsample_indices(x, y, 10000).tolist() == list(range(5000))
+    assert len(downsample_indices(x, y, 100, Downsampling.NONE)) == 5000
+    assert len(downsample_indices(x, y, 100, Downsampling.MINMAX)) <= 100
+    assert len(downsample_indices(x, y, 100, Downsampling.LTTB)) == 100
+    assert 1234 in downsample_indices(x, y, 100, Downsampling.MINMAX, keep=[1234])
@@ -0,0 +1,337 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from avro.datafile import DataFileReader, DataFileWriter
+from avro.io import DatumReader, DatumWriter
+from avro.schema import parse
+from matplotlib.figure import Figure
+from scipy.signal import find_peaks
+
+import empatica_raw_data
+from empatica_raw_data import EmpaticaRawData, plot_signal, projection_schema, read_signal_cache
+from eyetracker_data import screen_cards_boundaries
+
+# game layout (GUI.py) on a 1920x1080 screen
+CARDS_DATA = (screen_cards_boundaries((7, 3), (200, 300), (1480, 1025), 10, (1920, 1080)), 200, 300)
+
+# start of the session (us), half a millisecond after a whole one so the rounding to ms matters
+START = 1700000000000500
+# length of each record (s)
+RECORD_SECONDS = 10
+IMU_PARAMS = {"physicalMin": -16, "physicalMax": 16, "digitalMin": -32768, "digitalMax": 32767}
+
+
+def signal_schema(name, items="float"):
+    return {"name": name, "type": {"type": "record", "name": name[0].upper() + name[1:], "fields": [
+        {"name": "timestampStart", "type": "long"},
+        {"name": "samplingFrequency", "type": "float"},
+        {"name": "values", "type": {"type": "array", "items": items}}]}}
+
+
+def imu_schema(name, params):
+    return {"name": name, "type": {"type": "record", "name": name[0].upper() + name[1:], "fields": [
+        {"name": "timestampStart", "type": "long"},
+        {"name": "samplingFrequency", "type": "float"},
+        {"name": "imuParams", "type": params},
+        {"name": "x", "type": {"type": "array", "items": "int"}},
+        {"name": "y", "type": {"type": "array", "items": "int"}},
+        {"name": "z", "type": {"type": "array", "items": "int"}}]}}
+
+
+# rawData as written by the Empatica devices (the gyroscope refers to the imuParams type defined by the accelerometer)
+SCHEMA = {"type": "record", "name": "AvroData", "namespace": "com.empatica.format.avro", "fields": [
+    {"name": "timezone", "type": "int"},
+    {"name": "rawData", "type": {"type": "record", "name": "RawData", "fields": [
+        imu_schema("accelerometer", {"type": "record", "name": "ImuParams", "fields": [
+            {"name": name, "type": "int"} for name in ("physicalMin", "physicalMax", "digitalMin", "digitalMax")]}),
+        imu_schema("gyroscope", "com.empatica.format.avro.ImuParams"),
+        signal_schema("eda"),
+        signal_schema("temperature"),
+        {"name": "tags", "type": {"type": "record", "name": "Tags", "fields": [
+            {"name": "tagsTimeMicros", "type": {"type": "array", "items": "long"}}]}},
+        signal_schema("bvp"),
+        {"name": "systolicPeaks", "type": {"type": "record", "name": "SystolicPeaks", "fields": [
+            {"name": "peaksTimeNanos", "type": {"type": "array", "items": "long"}}]}},
+        signal_schema("steps", "int")]}}]}
+
+
+def write_session(folder, files=2, records=3):
+    """
+    Writes a synthetic Empatica session: consecutive .avro files of consecutive records of RECORD_SECONDS each.
+    :return: rawData of each record, in order.
+    """
+    rng = np.random.default_rng(0)
+    written = list()
+    for file_index in range(files):
+        writer = DataFileWriter(open(os.path.join(folder, "1-1-TEST_{}.avro".format(file_index)), 'wb'), DatumWriter(), parse(json.dumps(SCHEMA)))
+        for _ in range(records):
+            start = START + len(written) * RECORD_SECONDS * 1000000
+
+            def signal(frequency, values):
+                return {"timestampStart": start, "samplingFrequency": float(frequency), "values": values(int(RECORD_SECONDS * frequency)).tolist()}
+
+            def imu():
+                count = RECORD_SECONDS * 64
+                return {"timestampStart": start, "samplingFrequency": 64.0, "imuParams": IMU_PARAMS,
+                        "x": rng.integers(-2000, 2000, count).tolist(), "y": rng.integers(-2000, 2000, count).tolist(),
+                        "z": rng.integers(-2000, 2000, count).tolist()}
+
+            raw_data = {"accelerometer": imu(), "gyroscope": imu(),
+                        "eda": signal(4, lambda count: rng.uniform(0, 1, count)),
+                        "temperature": signal(1, lambda count: rng.uniform(30, 35, count)),
+                        "tags": {"tagsTimeMicros": [start + 2500500]},
+                        "bvp": signal(64, lambda count: rng.normal(0, 50, count)),
+                        "systolicPeaks": {"peaksTimeNanos": [start * 1000 + 800000000, start * 1000 + 1700600000]},
+                        "steps": signal(0.2, lambda count: rng.integers(0, 5, count))}
+            writer.append({"timezone": 0, "rawData": raw_data})
+            written.append(raw_data)
+        writer.close()
+
+    return written
+
+
+def baseline_samples(records, signal):
+    """
+    Timestamps and values of a signal as extracted before the vectorization: one value at a time, from the start of its
+    record rounded to ms.
+    :return: Tuple (timestamps (ms), values) arrays.
+    """
+    timestamps, values = list(), list()
+    for raw_data in records:
+        data = raw_data[signal]
+        start = round(data["timestampStart"] / 1000)
+        period = (1 / data["samplingFrequency"]) * 1000
+        for i, value in enumerate(data["values"]):
+            timestamps.append(round(start + period * i))
+            values.append(value)
+
+    return np.array(timestamps), np.array(values, dtype=np.float32)
+
+
+def gaze(start, end):
+    """
+    :return: Raw gaze of a phase from start to end (ms), one sample every 10 ms.
+    """
+    timestamps = np.arange(start, end + 1, 10)
+    return pd.DataFrame({"X_AXIS": np.full(len(timestamps), 500), "Y_AXIS": np.full(len(timestamps), 300), "TIMESTAMP": timestamps})
+
+
+@pytest.fixture
+def session(tmp_path):
+    """
+    :return: Tuple (folder of the .avro files, rawData of each record).
+    """
+    folder = tmp_path / "avro"
+    folder.mkdir()
+
+    return str(folder), write_session(str(folder))
+
+
+def test_projection_schema():
+    schema = projection_schema(SCHEMA, ("eda", "gyroscope"), ("timestampStart", "imuParams")).to_json()
+    assert [field["name"] for field in schema["fields"]] == ["rawData"]
+    raw_data = schema["fields"][0]["type"]["fields"]
+    assert [field["name"] for field in raw_data] == ["gyroscope", "eda"]
+    assert [field["name"] for field in raw_data[0]["type"]["fields"]] == ["timestampStart", "imuParams"]
+    assert [field["name"] for field in raw_data[1]["type"]["fields"]] == ["timestampStart"]
+    # the imuParams type was defined by the (dropped) accelerometer
+    assert raw_data[0]["type"]["fields"][1]["type"]["type"] == "record"
+
+
+def test_projection_schema_reads_only_the_projected_fields(session):
+    folder, records = session
+    path = os.path.join(folder, "1-1-TEST_0.avro")
+    reader = DataFileReader(open(path, 'rb'), DatumReader(readers_schema=projection_schema(SCHEMA, ("gyroscope",), ("timestampStart", "imuParams"))))
+    datum = next(reader)
+    reader.close()
+
+    assert datum == {"rawData": {"gyroscope": {"timestampStart": START, "imuParams": IMU_PARAMS}}}
+
+
+def test_timestamps_match_the_baseline_rounding(session):
+    folder, records = session
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    empatica.load_data(["bvp", "eda"], [(0, 2 * START)])
+
+    for signal in ("bvp", "eda"):
+        timestamps, values = empatica.data[signal]
+        expected_timestamps, expected_values = baseline_samples(records, signal)
+        np.testing.assert_array_equal(timestamps, expected_timestamps)
+        np.testing.assert_array_equal(values, expected_values)
+    # 1700000000000.5 ms rounds to even
+    assert empatica.data["bvp"][0][:5].tolist() == [1700000000000, 1700000000016, 1700000000031, 1700000000047, 1700000000062]
+    assert empatica.rates == {"bvp": 64.0, "eda": 4.0}
+
+
+def test_multiple_signals(session):
+    folder, records = session
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    start = START // 1000
+    # phase one inside the first file, phase two across both files
+    empatica.set_phases(gaze(start + 5000, start + 12000), gaze(start + 25000, start + 41000))
+    variables = [EmpaticaRawData.Variables.EDA, EmpaticaRawData.Variables.TEMPERATURE, EmpaticaRawData.Variables.STEPS]
+    empatica.signals_raw_data(variables)
+
+    for variable in variables:
+        timestamps, values = baseline_samples(records, variable.value)
+        for signals, (first, last) in ((empatica.signals_one, (start + 5000, start + 12000)), (empatica.signals_two, (start + 25000, start + 41000))):
+            inside = (timestamps >= first) & (timestamps <= last)
+            np.testing.assert_array_equal(signals[variable][0], timestamps[inside])
+            np.testing.assert_array_equal(signals[variable][1], values[inside])
+    assert empatica.rates == {EmpaticaRawData.Variables.EDA: 4.0, EmpaticaRawData.Variables.TEMPERATURE: 1.0,
+                              EmpaticaRawData.Variables.STEPS: pytest.approx(0.2)}
+
+    empatica.select_variable(EmpaticaRawData.Variables.EDA)
+    assert list(empatica.raw_data_one.columns) == ["TIMESTAMP", "eda"]
+
+
+def test_imu_values_are_scaled_by_their_params(session):
+    folder, records = session
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    empatica.load_data(["accelerometer", "gyroscope"], [(0, 2 * START)])
+
+    scale = (IMU_PARAMS["physicalMax"] - IMU_PARAMS["physicalMin"]) / (IMU_PARAMS["digitalMax"] - IMU_PARAMS["digitalMin"])
+    for signal in ("accelerometer", "gyroscope"):
+        timestamps, values = empatica.data[signal]
+        digital = np.concatenate([np.column_stack((raw_data[signal]["x"], raw_data[signal]["y"], raw_data[signal]["z"])) for raw_data in records])
+        assert values.shape == (len(records) * RECORD_SECONDS * 64, 3)
+        np.testing.assert_allclose(values, digital * scale)
+        assert len(timestamps) == len(values)
+
+    empatica.signals_one = {EmpaticaRawData.Variables.ACCELEROMETER: empatica.data["accelerometer"]}
+    empatica.signals_two = empatica.signals_one
+    empatica.select_variable(EmpaticaRawData.Variables.ACCELEROMETER)
+    assert list(empatica.raw_data_one.columns) == ["TIMESTAMP", "accelerometer_x", "accelerometer_y", "accelerometer_z"]
+
+
+def test_tags_and_systolic_peaks_are_events(session):
+    folder, records = session
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    empatica.load_data(["tags", "systolicPeaks"], [(0, 2 * START)])
+
+    tags = [round(raw_data["tags"]["tagsTimeMicros"][0] / 1000) for raw_data in records]
+    assert empatica.data["tags"][0].tolist() == tags
+    peaks = [round(peak / 1000000) for raw_data in records for peak in raw_data["systolicPeaks"]["peaksTimeNanos"]]
+    assert empatica.data["systolicPeaks"][0].tolist() == peaks
+    for signal in ("tags", "systolicPeaks"):
+        assert np.all(empatica.data[signal][1] == 1)
+    assert empatica.rates == {"tags": None, "systolicPeaks": None}
+
+
+def test_only_the_overlapping_records_are_decoded(session, monkeypatch):
+    folder, records = session
+    decoded = list()
+    records_to_arrays = empatica_raw_data.records_to_arrays
+
+    def counted_records_to_arrays(file_records, signal):
+        decoded.append(len(file_records))
+        return records_to_arrays(file_records, signal)
+
+    monkeypatch.setattr(empatica_raw_data, "records_to_arrays", counted_records_to_arrays)
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    start = START // 1000
+    # inside the second record of the first file
+    empatica.load_data(["bvp", "tags"], [(start + 12000, start + 15000)])
+
+    assert decoded == [1, 1]
+    timestamps, values = baseline_samples(records, "bvp")
+    inside = (timestamps >= start + 12000) & (timestamps <= start + 15000)
+    np.testing.assert_array_equal(empatica.data["bvp"][0], timestamps[inside])
+    np.testing.assert_array_equal(empatica.data["bvp"][1], values[inside])
+    assert empatica.data["tags"][0].tolist() == [round(records[1]["tags"]["tagsTimeMicros"][0] / 1000)]
+
+    # with the decode cache, the whole file is decoded (and cached)
+    decoded.clear()
+    empatica = EmpaticaRawData(folder, CARDS_DATA)
+    empatica.load_data(["bvp"], [(start + 12000, start + 15000)])
+    assert decoded == [3]
+
+
+def test_decode_cache_miss_then_hit(session, tmp_path):
+    folder, records = session
+    cache_folder = str(tmp_path / "cache")
+    empatica = EmpaticaRawData(folder, CARDS_DATA, cache_folder=cache_folder)
+    empatica.load_data(["bvp", "eda"], [(0, 2 * START)])
+    assert (empatica.cache_hits, empatica.cache_misses) == (0, 4)
+    assert len(os.listdir(cache_folder)) == 4
+
+    cached = EmpaticaRawData(folder, CARDS_DATA, cache_folder=cache_folder)
+    cached.load_data(["bvp", "eda"], [(0, 2 * START)])
+    assert (cached.cache_hits, cached.cache_misses) == (4, 0)
+    for signal in ("bvp", "eda"):
+        np.testing.assert_array_equal(cached.data[signal][0], empatica.data[signal][0])
+        np.testing.assert_array_equal(cached.data[signal][1], empatica.data[signal][1])
+    assert cached.rates == empatica.rates
+
+
+@pytest.mark.parametrize("change", ["size", "mtime"])
+def test_decode_cache_is_invalidated_when_the_file_changes(session, tmp_path, change):
+    folder, records = session
+    cache_folder = str(tmp_path / "cache")
+    EmpaticaRawData(folder, CARDS_DATA, cache_folder=cache_folder).load_data(["eda"], [(0, 2 * START)])
+    path = os.path.join(folder, "1-1-TEST_1.avro")
+    assert read_signal_cache(cache_folder, path, "eda") is not None
+
+    stat = os.stat(path)
+    if change == "size":
+        # the last record removed, the modification time kept
+        reader = DataFileReader(open(path, 'rb'), DatumReader())
+        data = list(reader)
+        reader.close()
+        writer = DataFileWriter(open(path, 'wb'), DatumWriter(), parse(json.dumps(SCHEMA)))
+        for datum in data[:-1]:
+            writer.append(datum)
+        writer.close()
+        records = records[:-1]
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert os.stat(path).st_size != stat.st_size
+    else:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert read_signal_cache(cache_folder, path, "eda") is None
+
+    empatica = EmpaticaRawData(folder, CARDS_DATA, cache_folder=cache_folder)
+    empatica.load_data(["eda"], [(0, 2 * START)])
+    assert (empatica.cache_hits, empatica.cache_misses) == (1, 1)
+    np.testing.assert_array_equal(empatica.data["eda"][0], baseline_samples(records, "eda")[0])
+
+
+def test_export_all_renders_headless_in_parallel(session, tmp_path):
+    folder, records = session
+    empatica = EmpaticaRawData(folder, CARDS_DATA, use_cache=False)
+    start = START // 1000
+    output = tmp_path / "output"
+    output.mkdir()
+    empatica.set_phases(gaze(start + 5000, start + 12000), gaze(start + 25000, start + 41000),
+                        windows_two=[start + 25000 + 800 * card for card in range(22)],
+                        output_one=str(output / "phase_one_"), output_two=str(output / "phase_two_"))
+    variables = [EmpaticaRawData.Variables.EDA, EmpaticaRawData.Variables.BVP]
+
+    paths = empatica.export_all(variables, workers=2)
+
+    assert paths == [str(output / (phase + variable.value + ".png")) for variable in variables for phase in ("phase_one_", "phase_two_")]
+    for path in paths:
+        with open(path, 'rb') as image:
+            assert image.read(8) == b"\x89PNG\r\n\x1a\n"
+        assert os.path.isfile(path.replace(".png", ".xlsx"))
+
+
+def test_plot_signal_marks_every_peak(tmp_path):
+    rng = np.random.default_rng(0)
+    timestamps = 1700000000000 + 16 * np.arange(20000)
+    values = np.cumsum(rng.normal(0, 1, len(timestamps)))
+    cards = np.repeat(np.arange(-1, 20), len(timestamps) // 21 + 1)[:len(timestamps)]
+    figure = Figure(figsize=(4, 2), dpi=50)
+
+    plot_signal(str(tmp_path / "eda.png"), 0, EmpaticaRawData.Variables.EDA, timestamps, values, cards, figure=figure)
+
+    lines = {line.get_label(): line for line in figure.axes[0].lines}
+    # the trace is reduced to two points per pixel column, with the global extremes
+    trace = lines[[label for label in lines if label.startswith("_")][0]]
+    assert len(trace.get_xdata()) <= 2 * 4 * 50 + 3
+    assert values.max() in trace.get_ydata() and values.min() in trace.get_ydata()
+    peaks, _ = find_peaks(abs(values))
+    np.testing.assert_array_equal(lines["Local Peaks"].get_xdata(), timestamps[peaks])
+    assert os.path.isfile(tmp_path / "eda.png")
@@ -0,0 +1,89 @@
+import importlib
+import sys
+import types
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from gaze_file import PupilBinaryWriter, read_pupil_binary
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    """
+    :return: eyetracker_connection module, imported without the Tobii SDK (only its GazeData objects are used here).
+    """
+    monkeypatch.setitem(sys.modules, "tobii_research", types.ModuleType("tobii_research"))
+    monkeypatch.delitem(sys.modules, "eyetracker_connection", raising=False)
+    module = importlib.import_module("eyetracker_connection")
+    yield module
+    sys.modules.pop("eyetracker_connection", None)
+
+
+def gaze_data(i):
+    """
+    :return: Fake tobii_research GazeData object (only the fields copied by GazeRingBuffer.push), numbered i.
+    """
+    left = SimpleNamespace(gaze_point=SimpleNamespace(position_on_display_area=(i / 1000, 0.25), validity=1),
+                           pupil=SimpleNamespace(diameter=3.5, validity=1))
+    right = SimpleNamespace(gaze_point=SimpleNamespace(position_on_display_area=(0.75, i / 1000), validity=0),
+                            pupil=SimpleNamespace(diameter=float("nan"), validity=0))
+
+    return SimpleNamespace(left_eye=left, right_eye=right, device_time_stamp=i, system_time_stamp=10 ** 12 + 8333 * i)
+
+
+def push(buffer, first, count):
+    for i in range(first, first + count):
+        buffer.push(gaze_data(i))
+
+
+def test_read_since(connection):
+    buffer = connection.GazeRingBuffer(100)
+    push(buffer, 0, 30)
+
+    columns, position, lost = buffer.read_since(0)
+    assert (position, lost) == (30, 0)
+    assert columns["DEVICE_TIME_STAMP"].tolist() == list(range(30))
+    np.testing.assert_allclose(columns["LEFT_X"], np.arange(30) / 1000, rtol=1e-6)
+    assert np.all(columns["RIGHT_GAZE_VALIDITY"] == 0) and np.all(np.isnan(columns["RIGHT_PUPIL"]))
+    assert columns["SYSTEM_TIME_STAMP"][-1] == 10 ** 12 + 8333 * 29
+
+    # 250 more samples than the capacity: only the last 100 are kept, the 150 before them are lost
+    push(buffer, 30, 250)
+    columns, position, lost = buffer.read_since(position)
+    assert (position, lost) == (280, 150)
+    assert columns["DEVICE_TIME_STAMP"].tolist() == list(range(180, 280))
+
+    columns, position, lost = buffer.read_since(position)
+    assert (position, lost, len(columns["DEVICE_TIME_STAMP"])) == (280, 0, 0)
+
+
+def test_capture_writer(connection, tmp_path):
+    buffer = connection.GazeRingBuffer(50)
+    push(buffer, 0, 5)
+    path = str(tmp_path / "GAZE-DATA-2024-01-01-10-00-00-000.bin")
+    # the samples before the writer are not written, the writer only drains when asked (or when stopped)
+    capture = connection.CaptureWriter(buffer, PupilBinaryWriter(path, 5000, (1920, 1080)), interval=60)
+
+    push(buffer, 5, 30)
+    capture.drain()
+    assert (capture.samples, capture.lost) == (30, 0)
+
+    # more samples than the capacity between two chunks
+    push(buffer, 35, 120)
+    capture.drain()
+    assert (capture.samples, capture.lost) == (80, 70)
+
+    capture.start()
+    push(buffer, 155, 10)
+    capture.stop()
+    assert (capture.samples, capture.lost, capture.position) == (90, 70, 165)
+
+    header, samples = read_pupil_binary(path)
+    assert (header["TIMESTAMP_CORRECTION"], header["SCREEN_WIDTH"], header["SCREEN_HEIGHT"]) == (5000, 1920, 1080)
+    expected = list(range(5, 35)) + list(range(105, 165))
+    assert samples["DEVICE_TIME_STAMP"].tolist() == expected
+    assert samples["SYSTEM_TIME_STAMP"].tolist() == [10 ** 12 + 8333 * i for i in expected]
+    np.testing.assert_allclose(samples["RIGHT_Y"], np.array(expected) / 1000, rtol=1e-6)
+    assert np.all(samples["LEFT_PUPIL"] == 3.5) and np.all(samples["LEFT_PUPIL_VALIDITY"] == 1)
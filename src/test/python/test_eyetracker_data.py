@@ -0,0 +1,105 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import write_gaze_recording
+from eyetracker_data import EyetrackerData, read_manifest, read_table, read_tables, write_table
+
+START = 1700000000000
+COUNT = 3000
+
+
+def process(tmp_path, data_type):
+    """
+    Processes a synthetic recording of a phase, with the game layout of GUI.py on a 1920x1080 screen.
+    """
+    recording = str(tmp_path / "GAZE-DATA-2024-01-01-10-00-00-000.txt")
+    write_gaze_recording(recording, seed=3, count=COUNT, start=START)
+    phase = EyetrackerData(data_type, recording, (7, 3), (200, 300), (1480, 1025), 10, (1920, 1080))
+    windows = [int(window) for window in np.linspace(START, START + 16 * COUNT, 22)]
+    phase.process_data(windows if data_type == EyetrackerData.DataType.PHASE_TWO else None)
+
+    return phase
+
+
+@pytest.fixture(params=[EyetrackerData.ExportFormat.NPZ, EyetrackerData.ExportFormat.PARQUET, EyetrackerData.ExportFormat.FEATHER])
+def columnar_format(request):
+    """
+    :return: Columnar export format (PARQUET and FEATHER are skipped without pyarrow).
+    """
+    if request.param != EyetrackerData.ExportFormat.NPZ:
+        pytest.importorskip("pyarrow")
+
+    return request.param
+
+
+def test_write_and_read_table(tmp_path, columnar_format):
+    table = pd.DataFrame({"X_AXIS": np.array([1, 2, 3], dtype=np.int64), "DURATION": np.array([0.5, 1.5, np.nan]),
+                          "CARD": np.array([-1, 3, 21], dtype=np.int64)})
+    path = str(tmp_path / ("table." + columnar_format.value))
+    write_table(table, path, columnar_format)
+
+    read = read_table(path)
+    pd.testing.assert_frame_equal(read, table)
+    assert read.dtypes.to_dict() == table.dtypes.to_dict()
+
+
+def test_write_and_read_invalid_format(tmp_path):
+    with pytest.raises(ValueError):
+        write_table(pd.DataFrame({"A": [1]}), str(tmp_path / "table.xlsx"), EyetrackerData.ExportFormat.EXCEL)
+    with pytest.raises(ValueError):
+        read_table(str(tmp_path / "table.csv"))
+
+
+@pytest.mark.parametrize("data_type", [EyetrackerData.DataType.PHASE_ONE, EyetrackerData.DataType.PHASE_TWO])
+def test_export_data_round_trip(tmp_path, columnar_format, data_type):
+    phase = process(tmp_path, data_type)
+    output = tmp_path / "output"
+    output.mkdir()
+    phase.export_data(str(output), columnar_format)
+
+    tables = read_tables(str(output))
+    expected = phase.get_tables()
+    assert sorted(tables) == sorted(expected)
+    for name, table in expected.items():
+        pd.testing.assert_frame_equal(tables[name], table.reset_index(drop=True))
+    assert tables["raw_gaze"]["TIMESTAMP"].dtype == np.int64
+    assert tables["raw_gaze"]["CARD"].dtype == np.int64
+
+    manifest = read_manifest(str(output))
+    assert manifest == json.loads(json.dumps(dict(phase.get_manifest(), RAW_GAZE="raw_gaze." + columnar_format.value)))
+    assert manifest["DATA_TYPE"] == data_type.name
+    assert (manifest["START_TIMESTAMP"], manifest["END_TIMESTAMP"]) == (START, int(phase.raw_gaze["TIMESTAMP"].iloc[-1]))
+    if data_type == EyetrackerData.DataType.PHASE_ONE:
+        assert manifest["CARD_WINDOWS"] is None
+        assert manifest["MARKERS"] == phase.get_markers() and manifest["MARKERS"]["LONGEST_VISIT"] is not None
+        with open(output / "relevant_data.json") as infile:
+            assert json.load(infile) == json.loads(json.dumps(phase.get_relevant_data()))
+    else:
+        assert manifest["CARD_WINDOWS"] == phase.timestamps
+        assert manifest["MARKERS"] is None
+        assert not os.path.exists(output / "relevant_data.json")
+
+
+def test_export_excel(tmp_path):
+    phase = process(tmp_path, EyetrackerData.DataType.PHASE_ONE)
+    output = tmp_path / "output"
+    output.mkdir()
+    phase.export_data(str(output), EyetrackerData.ExportFormat.EXCEL)
+
+    assert read_tables(str(output)) == dict()
+    assert read_manifest(str(output))["RAW_GAZE"] == "raw_gaze.xlsx"
+    workbook = pd.read_excel(output / "raw_gaze.xlsx", sheet_name=None)
+    assert list(workbook) == ["RAW_GAZE"] + ["CARD_{}_GAZE".format(card) for card in range(1, 22)] + ["VISITS"]
+    pd.testing.assert_frame_equal(workbook["RAW_GAZE"], phase.raw_gaze.reset_index(drop=True))
+    pd.testing.assert_frame_equal(workbook["VISITS"], phase.visits_cards.reset_index(drop=True), check_dtype=False)
+    for card, sheet in enumerate(phase.aggregated_gaze):
+        assert len(workbook["CARD_{}_GAZE".format(card + 1)]) == len(sheet)
+
+    fixations = pd.read_excel(output / "fixations.xlsx", sheet_name=None)
+    assert list(fixations) == ["FIXATIONS"] + ["CARD_{}_FIXATIONS".format(card) for card in range(1, 22)]
+    pd.testing.assert_frame_equal(fixations["FIXATIONS"], phase.fixations.reset_index(drop=True), check_dtype=False)
+    assert fixations["FIXATIONS"]["START_TIMESTAMP"].dtype == np.int64
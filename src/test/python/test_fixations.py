@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+
+from eyetracker_data import EyetrackerData
+from fixations import FIXATION_COLUMNS, FixationDetector, idt_fixations, ivt_fixations, stream_fixations
+
+# clusters of constant gaze points (x, y, number of samples), far apart from each other, one sample every 16 ms
+CLUSTERS = [(100, 100, 10), (400, 120, 8), (410, 500, 12), (900, 600, 9)]
+INTERVAL = 16
+
+
+def cluster_trace(clusters=CLUSTERS):
+    """
+    Returns the (x, y, timestamps) arrays of a gaze trace made of the given clusters.
+    """
+    x = np.concatenate([np.full(count, cluster_x, dtype=np.float64) for cluster_x, _, count in clusters])
+    y = np.concatenate([np.full(count, cluster_y, dtype=np.float64) for _, cluster_y, count in clusters])
+    timestamps = 1000 + INTERVAL * np.arange(len(x), dtype=np.int64)
+
+    return x, y, timestamps
+
+
+def legacy_fixations(x, y, timestamps):
+    """
+    Returns the fixations of the legacy engine (EyetrackerData.get_fixations).
+    """
+    phase = EyetrackerData(EyetrackerData.DataType.PHASE_ONE, None, (7, 3), (200, 300), (1480, 1025), 10, (1920, 1080))
+    phase.raw_gaze = pd.DataFrame({'X_AXIS': x, 'Y_AXIS': y, 'TIMESTAMP': timestamps})
+
+    return phase.get_fixations()
+
+
+def test_idt_matches_legacy_engine():
+    x, y, timestamps = cluster_trace()
+    fixations = idt_fixations(x, y, timestamps, EyetrackerData.DISTANCE_THRESHOLD, EyetrackerData.DURATION_THRESHOLD)
+    legacy = legacy_fixations(x, y, timestamps)
+
+    assert list(fixations.columns) == FIXATION_COLUMNS
+    assert len(fixations) == len(CLUSTERS)
+    np.testing.assert_allclose(fixations.to_numpy(dtype=np.float64), legacy.to_numpy(dtype=np.float64))
+
+
+def test_idt_fixation_bounds():
+    x, y, timestamps = cluster_trace()
+    fixations = idt_fixations(x, y, timestamps, 25, 100)
+
+    first = 0
+    for (cluster_x, cluster_y, count), fixation in zip(CLUSTERS, fixations.itertuples(index=False)):
+        assert (fixation.X_AXIS, fixation.Y_AXIS) == (cluster_x, cluster_y)
+        assert fixation.START_TIMESTAMP == timestamps[first]
+        assert fixation.END_TIMESTAMP == timestamps[first + count - 1]
+        assert fixation.DURATION == INTERVAL * (count - 1)
+        first += count
+
+
+def test_idt_discards_short_fixations():
+    # the second cluster lasts 3 * 16 ms
+    x, y, timestamps = cluster_trace([(100, 100, 10), (400, 120, 4), (900, 600, 9)])
+    fixations = idt_fixations(x, y, timestamps, 25, 100)
+
+    assert fixations['X_AXIS'].tolist() == [100, 900]
+
+
+def test_idt_empty():
+    fixations = idt_fixations([], [], [], 25, 100)
+
+    assert fixations.empty
+    assert list(fixations.columns) == FIXATION_COLUMNS
+
+
+def test_detector_returns_each_fixation_when_it_ends():
+    x, y, timestamps = cluster_trace()
+    detector = FixationDetector(25, 100)
+
+    completed = list()
+    for i in range(len(x)):
+        fixation = detector.push(x[i], y[i], timestamps[i])
+        if fixation is not None:
+            completed.append((i, fixation))
+    completed.append((len(x), detector.flush()))
+
+    # each fixation is returned by the first sample of the next cluster (or by flush)
+    assert [i for i, _ in completed] == list(np.cumsum([count for _, _, count in CLUSTERS]))
+    assert detector.flush() is None
+
+
+def test_stream_matches_batch():
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.normal(0, 8, 2000))
+    y = np.cumsum(rng.normal(0, 8, 2000))
+    timestamps = np.cumsum(rng.integers(10, 20, 2000))
+
+    streamed = list(stream_fixations(zip(x, y, timestamps), 25, 100))
+    batch = idt_fixations(x, y, timestamps, 25, 100)
+
+    assert len(streamed) > 0
+    np.testing.assert_allclose(np.array(streamed, dtype=np.float64), batch.to_numpy(dtype=np.float64))
+
+
+def reference_ivt(x, y, timestamps, velocity_threshold, duration_threshold, merge_distance, merge_gap):
+    """
+    Sample by sample I-VT (see ivt_fixations).
+    """
+    velocity = [0.0] * len(x)
+    for i in range(1, len(x)):
+        velocity[i] = np.hypot(x[i] - x[i - 1], y[i] - y[i - 1]) / max(timestamps[i] - timestamps[i - 1], 1)
+    velocity[0] = velocity[1]
+
+    runs = list()
+    for i in range(len(x)):
+        if velocity[i] <= velocity_threshold:
+            if runs and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+
+    groups = list()
+    for k, (first, last) in enumerate(runs):
+        if groups:
+            previous_first, previous_last = runs[k - 1]
+            distance = np.hypot(np.mean(x[first:last + 1]) - np.mean(x[previous_first:previous_last + 1]),
+                                np.mean(y[first:last + 1]) - np.mean(y[previous_first:previous_last + 1]))
+            if timestamps[first] - timestamps[previous_last] <= merge_gap and distance <= merge_distance:
+                groups[-1].append((first, last))
+                continue
+        groups.append([(first, last)])
+
+    fixations = list()
+    for group in groups:
+        samples = np.concatenate([np.arange(first, last + 1) for first, last in group])
+        duration = timestamps[group[-1][1]] - timestamps[group[0][0]]
+        if duration >= duration_threshold and len(samples) >= 2:
+            fixations.append([x[samples].mean(), y[samples].mean(), duration, timestamps[group[0][0]],
+                              timestamps[group[-1][1]]])
+
+    return np.array(fixations, dtype=np.float64).reshape(-1, 5)
+
+
+def test_ivt_matches_reference():
+    rng = np.random.default_rng(1)
+    for trial in range(30):
+        count = rng.integers(2, 400)
+        x = np.cumsum(rng.normal(0, rng.uniform(1, 20), count))
+        y = np.cumsum(rng.normal(0, 5, count))
+        timestamps = np.cumsum(rng.integers(0, 30, count))
+        parameters = (rng.uniform(0.1, 2), rng.integers(0, 200), rng.uniform(1, 50), rng.integers(0, 100))
+
+        fixations = ivt_fixations(x, y, timestamps, *parameters)
+        assert list(fixations.columns) == FIXATION_COLUMNS
+        np.testing.assert_allclose(fixations.to_numpy(dtype=np.float64),
+                                   reference_ivt(x, y, timestamps, *parameters))
+
+
+def test_ivt_on_clusters():
+    # the first sample of each cluster comes from a saccade, so each fixation (but the first) starts at the second one
+    clusters = [(100, 100, 10), (400, 120, 10), (410, 500, 12)]
+    x, y, timestamps = cluster_trace(clusters)
+    fixations = ivt_fixations(x, y, timestamps, EyetrackerData.VELOCITY_THRESHOLD, EyetrackerData.DURATION_THRESHOLD,
+                              EyetrackerData.MERGE_DISTANCE, EyetrackerData.MERGE_GAP)
+
+    assert fixations[['X_AXIS', 'Y_AXIS']].values.tolist() == [[x, y] for x, y, _ in clusters]
+    assert fixations['DURATION'].tolist() == [INTERVAL * 9, INTERVAL * 8, INTERVAL * 10]
+
+
+def test_ivt_merges_close_fixations():
+    # a single sample away and back, within the merge gap (48 ms) and distance (10 px)
+    x, y, timestamps = cluster_trace([(100, 100, 10), (600, 600, 1), (110, 100, 10)])
+    fixations = ivt_fixations(x, y, timestamps, 1.0, 100, 25, 75)
+    unmerged = ivt_fixations(x, y, timestamps, 1.0, 100, 5, 75)
+
+    assert fixations[['START_TIMESTAMP', 'END_TIMESTAMP']].values.tolist() == [[timestamps[0], timestamps[-1]]]
+    assert fixations['X_AXIS'].iloc[0] == (100 * 10 + 110 * 9) / 19
+    assert len(unmerged) == 2
+
+
+def test_ivt_short_traces():
+    assert ivt_fixations([1.0], [1.0], [0], 1.0, 100, 25, 75).empty
+    assert ivt_fixations([0, 500, 0, 500], [0, 0, 0, 0], [0, 10, 20, 30], 1.0, 0, 25, 75).empty
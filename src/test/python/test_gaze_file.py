@@ -0,0 +1,133 @@
+import numpy as np
+
+from gaze_file import (GAZE_DTYPE, PUPIL_DTYPE, PUPIL_HEADER_DTYPE, GazeBinaryWriter, PupilBinaryWriter,
+                       convert_gaze_text, corrected_timestamps, is_gaze_binary, is_pupil_binary, iter_gaze_text,
+                       read_gaze, read_gaze_binary, read_gaze_binary_header, read_gaze_text, read_pupil_binary)
+
+SAMPLES = [(1211, 279, 1700000000016), (1208, 277, 1700000000032), (0, 1079, 1700000000048),
+           (1919, 0, 1700000000064), (960, 540, 1700000000080)]
+
+
+def write_text(path, samples=SAMPLES, tail=""):
+    """
+    Writes a gaze text file as TobiiDemo.java (X, Y and timestamp, one per line).
+    """
+    with open(path, "w") as outfile:
+        for sample in samples:
+            outfile.write("{}\n{}\n{}\n".format(*sample))
+        outfile.write(tail)
+
+
+def test_read_gaze_text(tmp_path):
+    write_text(tmp_path / "gaze.txt")
+    gaze = read_gaze_text(str(tmp_path / "gaze.txt"))
+
+    assert gaze.dtype == GAZE_DTYPE
+    assert gaze.tolist() == SAMPLES
+
+
+def test_incomplete_last_sample_is_ignored(tmp_path):
+    # recorder killed while writing the last sample
+    write_text(tmp_path / "gaze.txt", tail="1000\n50")
+
+    assert read_gaze_text(str(tmp_path / "gaze.txt")).tolist() == SAMPLES
+    assert np.concatenate(list(iter_gaze_text(str(tmp_path / "gaze.txt"), chunk_size=2))).tolist() == SAMPLES
+
+
+def test_iter_gaze_text_blocks(tmp_path):
+    samples = [(i % 1920, i % 1080, 1700000000000 + 16 * i) for i in range(10000)]
+    write_text(tmp_path / "gaze.txt", samples)
+    blocks = list(iter_gaze_text(str(tmp_path / "gaze.txt"), chunk_size=3000))
+
+    assert [len(block) for block in blocks] == [3000, 3000, 3000, 1000]
+    assert np.concatenate(blocks).tolist() == samples
+
+
+def test_gaze_binary_round_trip(tmp_path):
+    write_text(tmp_path / "gaze.txt")
+    binary_path = convert_gaze_text(str(tmp_path / "gaze.txt"), screen_size=(1920, 1080), rate=64.0)
+
+    assert binary_path == str(tmp_path / "gaze.gaze")
+    assert is_gaze_binary(binary_path) and not is_gaze_binary(str(tmp_path / "gaze.txt"))
+    assert read_gaze_binary_header(binary_path) == {"VERSION": 1, "SCREEN_WIDTH": 1920, "SCREEN_HEIGHT": 1080,
+                                                    "RATE": 64.0}
+    header, gaze = read_gaze_binary(binary_path)
+    assert isinstance(gaze, np.memmap) and not gaze.flags.writeable
+    assert gaze.tolist() == SAMPLES
+    assert read_gaze(binary_path).tolist() == read_gaze(str(tmp_path / "gaze.txt")).tolist()
+
+
+def test_gaze_binary_append(tmp_path):
+    path = str(tmp_path / "gaze.gaze")
+    writer = GazeBinaryWriter(path, (1920, 1080))
+    writer.append(np.array(SAMPLES[:2], dtype=GAZE_DTYPE))
+    writer.close()
+    # a partial record (writer killed) is dropped when the file is opened again
+    with open(path, "ab") as outfile:
+        outfile.write(b"\x01" * 5)
+    writer = GazeBinaryWriter(path)
+    writer.append(np.array(SAMPLES[2:], dtype=GAZE_DTYPE))
+    writer.close()
+
+    header, gaze = read_gaze_binary(path)
+    assert header["SCREEN_WIDTH"] == 1920
+    assert gaze.tolist() == SAMPLES
+
+
+def pupil_samples(count, first=0):
+    """
+    Returns pupil capture samples (PUPIL_DTYPE) with distinct values in every field.
+    """
+    index = np.arange(first, first + count)
+    samples = np.zeros(count, dtype=PUPIL_DTYPE)
+    for i, name in enumerate(PUPIL_DTYPE.names[:6]):
+        samples[name] = index / 1000 + i
+    samples["LEFT_GAZE_VALIDITY"] = index % 2
+    samples["RIGHT_PUPIL_VALIDITY"] = 1 - index % 2
+    samples["DEVICE_TIME_STAMP"] = 10 ** 9 + index
+    samples["SYSTEM_TIME_STAMP"] = 2 * 10 ** 12 + 8333 * index
+
+    return samples
+
+
+def test_pupil_binary_round_trip(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    samples = pupil_samples(1000)
+    writer = PupilBinaryWriter(path, 5000, (1920, 1080))
+    for chunk in np.array_split(samples, 7):
+        writer.append(chunk)
+    writer.close()
+
+    assert PUPIL_DTYPE.itemsize == 44 and PUPIL_HEADER_DTYPE.itemsize == 32
+    assert is_pupil_binary(path)
+    header, read = read_pupil_binary(path)
+    assert header == {"VERSION": 1, "SCREEN_WIDTH": 1920, "SCREEN_HEIGHT": 1080, "TIMESTAMP_CORRECTION": 5000}
+    assert isinstance(read, np.memmap)
+    np.testing.assert_array_equal(read, samples)
+    np.testing.assert_array_equal(corrected_timestamps(read, 5000),
+                                  (2 * 10 ** 12 + 8333 * np.arange(1000)) // 1000 + 5000)
+
+
+def test_pupil_binary_crash_and_reopen(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    writer = PupilBinaryWriter(path, 5000)
+    writer.append(pupil_samples(10))
+    writer.close()
+    with open(path, "ab") as outfile:
+        outfile.write(b"\x01" * 20)
+
+    # the partial record is ignored, and dropped when the capture goes on (the header is kept)
+    assert len(read_pupil_binary(path)[1]) == 10
+    writer = PupilBinaryWriter(path, 0)
+    writer.append(pupil_samples(5, 10))
+    writer.close()
+    header, read = read_pupil_binary(path)
+    assert header["TIMESTAMP_CORRECTION"] == 5000
+    np.testing.assert_array_equal(read, pupil_samples(15))
+
+
+def test_empty_pupil_capture(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    PupilBinaryWriter(path).close()
+
+    assert len(read_pupil_binary(path)[1]) == 0
@@ -0,0 +1,145 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from gaze_stream import GazeStreamReceiver
+
+# frames encoded as TobiiDemo.java (GazeStream) does, with ByteBuffer.order(ByteOrder.LITTLE_ENDIAN)
+SAMPLES = [(1211, 279, 1700000000016), (0, 1079, 1700000000032), (1919, 0, 2 ** 40 + 7)]
+ARCHIVE = "C:\\Users\\Gaze Öffnen\\GAZE-DATA-2024-01-01-10-00-00-000.txt"
+
+
+def java_frame(frame_type, payload):
+    """
+    GazeStream.send: length (int, little-endian) counting the type and the payload, type (1 byte), payload.
+    """
+    return struct.pack("<i", len(payload) + 1) + bytes([frame_type]) + payload
+
+
+def java_sample(x, y, timestamp):
+    """
+    GazeStream.sendSample: X and Y as float, timestamp as long.
+    """
+    return java_frame(ord("S"), struct.pack("<f", x) + struct.pack("<f", y) + struct.pack("<q", timestamp))
+
+
+def java_command(stream):
+    """
+    GazeStream.receiveCommand: Integer.reverseBytes(readInt()) of the length, then the type and the payload.
+    :return: Command, or None if the connection was closed.
+    """
+    header = stream.read(5)
+    if len(header) < 5:
+        return None
+    length = int.from_bytes(header[:4], "little")
+    assert header[4] == ord("C")
+
+    return stream.read(length - 1).decode("ascii")
+
+
+class FakeRecorder(threading.Thread):
+    """
+    Recorder side of the stream protocol (TobiiDemo.serve): sends the archive path and the samples on WRITE and the end
+    of the recording on STOP. Every frame is sent one byte at a time, so the receiver has to reassemble them.
+    """
+
+    def __init__(self, ends=True):
+        """
+        :param ends: Answer STOP with the end of the recording (a stuck recorder does not).
+        """
+        super().__init__(daemon=True)
+        self.ends = ends
+        self.server = socket.create_server(("localhost", 0))
+        self.port = self.server.getsockname()[1]
+        self.commands = list()
+        self.sent = threading.Event()
+
+    def send(self, connection, data):
+        for i in range(len(data)):
+            connection.sendall(data[i:i + 1])
+
+    def run(self):
+        connection, _ = self.server.accept()
+        with connection, connection.makefile("rb") as stream:
+            while True:
+                command = java_command(stream)
+                if command is None:
+                    return
+                self.commands.append(command)
+                if command == "WRITE":
+                    self.send(connection, java_frame(ord("F"), ARCHIVE.encode("utf-8")))
+                    for sample in SAMPLES[:2]:
+                        self.send(connection, java_sample(*sample))
+                    self.sent.set()
+                elif command == "STOP" and self.ends:
+                    self.send(connection, java_sample(*SAMPLES[2]))
+                    self.send(connection, java_frame(ord("E"), b""))
+
+
+@pytest.fixture
+def connect():
+    """
+    :return: Function (ends=True) -> (recorder, receiver) connected to each other, both closed after the test.
+    """
+    connected = list()
+
+    def connect_recorder(ends=True):
+        recorder = FakeRecorder(ends)
+        recorder.start()
+        receiver = GazeStreamReceiver("localhost", recorder.port)
+        connected.append((recorder, receiver))
+        return recorder, receiver
+
+    yield connect_recorder
+    for recorder, receiver in connected:
+        receiver.close()
+        recorder.join(5)
+        recorder.server.close()
+
+
+def test_round_trip(connect):
+    recorder, receiver = connect()
+    receiver.start_recording(archive=True)
+    assert recorder.sent.wait(5)
+    # the samples are only polled once complete
+    polled = list()
+    deadline = time.time() + 5
+    while len(polled) < 2 and time.time() < deadline:
+        polled.extend(receiver.poll())
+    assert polled == [tuple(float(value) for value in sample[:2]) + (sample[2],) for sample in SAMPLES[:2]]
+
+    samples = receiver.stop_recording()
+    assert receiver.archive_path == ARCHIVE
+    assert samples['X_AXIS'].tolist() == [sample[0] for sample in SAMPLES]
+    assert samples['Y_AXIS'].tolist() == [sample[1] for sample in SAMPLES]
+    assert samples['TIMESTAMP'].tolist() == [sample[2] for sample in SAMPLES]
+    assert receiver.poll() == [(1919.0, 0.0, 2 ** 40 + 7)]
+    receiver.close()
+    recorder.join(5)
+
+    assert recorder.commands == ["WRITE", "STOP"]
+
+
+def test_new_recording_discards_previous_samples(connect):
+    recorder, receiver = connect()
+    receiver.start_recording()
+    receiver.stop_recording()
+    recorder.sent.clear()
+    receiver.start_recording()
+    assert recorder.sent.wait(5)
+    assert len(receiver.stop_recording()) == len(SAMPLES)
+    receiver.close()
+    recorder.join(5)
+
+    assert recorder.commands == ["WRITE", "STOP", "WRITE", "STOP"]
+
+
+def test_stop_waits_for_the_end_of_the_recording(connect):
+    recorder, receiver = connect(ends=False)
+    receiver.start_recording()
+    assert recorder.sent.wait(5)
+    with pytest.raises(TimeoutError):
+        receiver.stop_recording(timeout=0.2)
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from conftest import write_gaze_recording
+from eyetracker_data import EyetrackerData
+from stage_cache import StageCache, arrays_digest, file_digest, frame_digest
+
+STAGES = ["load", "fixations", "labels", "visits", "aggregation"]
+
+
+def test_digests(tmp_path):
+    (tmp_path / "a.txt").write_bytes(b"1\n2\n3\n")
+    (tmp_path / "b.txt").write_bytes(b"1\n2\n3\n")
+
+    assert file_digest(str(tmp_path / "a.txt")) == file_digest(str(tmp_path / "b.txt"))
+    assert arrays_digest(np.arange(3)) == arrays_digest(np.arange(3))
+    # same bytes, different dtype or shape
+    assert arrays_digest(np.arange(4, dtype=np.int32)) != arrays_digest(np.arange(4, dtype=np.uint32))
+    assert arrays_digest(np.zeros((2, 2))) != arrays_digest(np.zeros(4))
+    frame = pd.DataFrame({"A": [1, 2], "B": [0.5, 1.5]})
+    assert frame_digest(frame) != frame_digest(frame.rename(columns={"B": "C"}))
+
+
+def test_hit_and_miss(tmp_path):
+    cache = StageCache(str(tmp_path))
+    calls = list()
+
+    def compute():
+        calls.append(1)
+        return {"fixations": pd.DataFrame({"X_AXIS": [1.5, 2.5], "DURATION": np.array([100, 200], dtype=np.int64)}),
+                "visits": pd.DataFrame({"CARD": np.array([3], dtype=np.int64)})}
+
+    key, tables = cache.run("fixations", ["input"], {"DISTANCE_THRESHOLD": 25}, compute)
+    same_key, cached = StageCache(str(tmp_path)).run("fixations", ["input"], {"DISTANCE_THRESHOLD": np.int64(25)},
+                                                     compute)
+    assert same_key == key and len(calls) == 1
+    for name in tables:
+        pd.testing.assert_frame_equal(cached[name], tables[name])
+
+    # a new parameter value or input is a new key
+    other = StageCache(str(tmp_path))
+    assert other.run("fixations", ["input"], {"DISTANCE_THRESHOLD": 30}, compute)[0] != key
+    assert other.run("fixations", ["other input"], {"DISTANCE_THRESHOLD": 25}, compute)[0] != key
+    assert len(calls) == 3 and other.executed == ["fixations", "fixations"] and other.hits == 0
+
+
+def process(recording, cache):
+    """
+    Processes phase one, with the game layout of GUI.py.
+    """
+    phase = EyetrackerData(EyetrackerData.DataType.PHASE_ONE, recording, (7, 3), (200, 300), (1480, 1025), 10,
+                           (1920, 1080))
+    phase.process_data(cache=cache)
+
+    return phase
+
+
+def test_only_changed_stages_are_executed(tmp_path, monkeypatch):
+    recording = str(tmp_path / "GAZE-DATA-2024-01-01-10-00-00-000.txt")
+    write_gaze_recording(recording, seed=1)
+    folder = str(tmp_path / ".stage_cache")
+
+    first = StageCache(folder)
+    expected = process(recording, None).get_relevant_data()
+    assert process(recording, first).get_relevant_data() == expected
+    assert first.executed == STAGES
+
+    second = StageCache(folder)
+    assert process(recording, second).get_relevant_data() == expected
+    assert second.executed == [] and second.hits == len(STAGES)
+
+    # a visit parameter only executes the visits again
+    monkeypatch.setattr(EyetrackerData, "MIN_VISIT_DURATION", 50)
+    visits = StageCache(folder)
+    process(recording, visits)
+    assert visits.executed == ["visits"]
+
+    # the stages after the fixations are executed again, but not the load
+    monkeypatch.setattr(EyetrackerData, "DISTANCE_THRESHOLD", 30)
+    fixations = StageCache(folder)
+    process(recording, fixations)
+    assert fixations.executed == ["fixations", "labels", "visits", "aggregation"]